@@ -0,0 +1,4 @@
+import time
+
+# Used to report how long a worker takes from importing the package to being ready to serve requests.
+IMPORT_STARTED_AT = time.perf_counter()
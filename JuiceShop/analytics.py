@@ -0,0 +1,251 @@
+import datetime as dt
+import json
+
+from pony.orm import db_session, delete, desc, max as sql_max, select, sum as sql_sum
+from pony.utils import datetime2timestamp
+
+import JuiceShop.common as c
+
+PERIODS = ('hour', 'day')
+DIMENSIONS = ('liquid', 'fruit', 'combination')
+# bounds used when a range is open, so every query has the same shape
+MIN_DATETIME = dt.datetime(1970, 1, 1)
+MAX_DATETIME = dt.datetime(9999, 12, 31)
+REBUILD_CHUNK_SIZE = 1000
+
+SALES_UPSERT = (
+    'INSERT INTO "SalesRollup" ("period", "dimension", "bucket", "name", "juices", "revenue") '
+    'VALUES ({p}, {p}, {p}, {p}, {p}, {p}) '
+    'ON CONFLICT ("period", "dimension", "bucket", "name") '
+    'DO UPDATE SET "juices" = "SalesRollup"."juices" + excluded."juices", '
+    '"revenue" = "SalesRollup"."revenue" + excluded."revenue"'
+)
+PAYMENTS_UPSERT = (
+    'INSERT INTO "PaymentRollup" ("period", "bucket", "orders", "paid", "revenue", "paid_revenue") '
+    'VALUES ({p}, {p}, {p}, {p}, {p}, {p}) '
+    'ON CONFLICT ("period", "bucket") '
+    'DO UPDATE SET "orders" = "PaymentRollup"."orders" + excluded."orders", '
+    '"paid" = "PaymentRollup"."paid" + excluded."paid", '
+    '"revenue" = "PaymentRollup"."revenue" + excluded."revenue", '
+    '"paid_revenue" = "PaymentRollup"."paid_revenue" + excluded."paid_revenue"'
+)
+
+
+def bucket(value: dt.datetime, period: str) -> dt.datetime:
+    # datetimes are stored as naive UTC, so buckets are UTC hours and days
+    if value.tzinfo is not None:
+        value = value.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if period == 'day' else value
+
+
+def combination_name(fruit_names) -> str:
+    # a JSON list, so fruit names can hold any character
+    return json.dumps(sorted(fruit_names))
+
+
+def sales_increments(order_at: dt.datetime, juices: list, increments: dict = None) -> dict:
+    """
+    Adds the sales of an order to the rollup increments: every juice counts for its liquid, each of its fruits and its
+    fruit combination. The revenue of a liquid or a fruit is its unit price in the juice, the revenue of a combination
+    is the juice price.
+    :param order_at: when the order was received.
+    :param juices: the juice snapshots of the order.
+    :param increments: increments to be added to, a new dict by default.
+    :return: a dict of [juices, revenue] keyed by (period, dimension, bucket, name)
+    """
+    increments = {} if increments is None else increments
+    for period in PERIODS:
+        order_bucket = bucket(order_at, period)
+        for juice in juices:
+            keys = [('liquid', juice['liquid']['name'], juice['liquid']['price']),
+                    ('combination', combination_name(f['name'] for f in juice['fruits']), juice['price'])]
+            keys.extend(('fruit', f['name'], f['price']) for f in juice['fruits'])
+            for dimension, name, revenue in keys:
+                totals = increments.setdefault((period, dimension, order_bucket, name), [0, 0])
+                totals[0] += 1
+                totals[1] += revenue
+    return increments
+
+
+def payment_increments(order_at: dt.datetime, orders: int, paid: int, revenue: int, paid_revenue: int,
+                       increments: dict = None) -> dict:
+    """
+    Adds order and payment counts to the rollup increments of the hour and day of an order.
+    :return: a dict of [orders, paid, revenue, paid_revenue] keyed by (period, bucket)
+    """
+    increments = {} if increments is None else increments
+    for period in PERIODS:
+        totals = increments.setdefault((period, bucket(order_at, period)), [0, 0, 0, 0])
+        for i, value in enumerate((orders, paid, revenue, paid_revenue)):
+            totals[i] += value
+    return increments
+
+
+def _apply(db, sales: dict, payments: dict):
+    """
+    Adds the increments to the rollup tables with atomic upserts, in the current transaction. Concurrent orders of the
+    same hour add to the same rows without reading them first, so no update is lost.
+    """
+    placeholder = '?' if db.provider.paramstyle == 'qmark' else '%s'
+    to_sql_datetime = datetime2timestamp if db.provider.dialect == 'SQLite' else (lambda value: value)
+    cursor = db.get_connection().cursor()
+    if sales:
+        cursor.executemany(SALES_UPSERT.format(p=placeholder),
+                           [(period, dimension, to_sql_datetime(sales_bucket), name, juices, revenue)
+                            for (period, dimension, sales_bucket, name), (juices, revenue) in sorted(sales.items())])
+    if payments:
+        cursor.executemany(PAYMENTS_UPSERT.format(p=placeholder),
+                           [(period, to_sql_datetime(payment_bucket), *totals)
+                            for (period, payment_bucket), totals in sorted(payments.items())])
+
+
+@db_session
+def record_order(db, order_at: dt.datetime, price: int, juices: list, is_paid: bool = False):
+    """
+    Adds a new order to the rollups, in the transaction creating it.
+    :param db: DB Connection
+    :param order_at: when the order was received.
+    :param price: the order price.
+    :param juices: the juice snapshots of the order.
+    :param is_paid: whether the order is already paid.
+    :return: None
+    """
+    _apply(db, sales_increments(order_at, juices),
+           payment_increments(order_at, 1, int(is_paid), price, price if is_paid else 0))
+
+
+@db_session
+def record_payment(db, order_at: dt.datetime, price: int, was_paid: bool, is_paid: bool):
+    """
+    Moves an order between the paid and unpaid counts when its payment status changes.
+    :return: None
+    """
+    if bool(was_paid) == bool(is_paid):
+        return
+    sign = 1 if is_paid else -1
+    _apply(db, {}, payment_increments(order_at, 0, sign, 0, sign * price))
+
+
+def rebuild(db, archive_db=None) -> int:
+    """
+    Recomputes the rollups from every order, for instance after upgrading a database that had orders without rollups.
+    Orders are read in chunks of REBUILD_CHUNK_SIZE, each chunk in its own transaction. The orders created meanwhile are
+    left to record_order, as only the orders up to the last one found when the rollups are emptied are read, but the
+    payments received meanwhile may be counted twice: run it while no order is received or paid, and not during an
+    archival. Orders found in both databases, after an interrupted archival, are counted once.
+    :param db: DB Connection
+    :param archive_db: the archive DB Connection, whose orders are counted too.
+    :return: the number of orders counted
+    """
+    with db_session:
+        delete(r for r in db.SalesRollup)
+        delete(r for r in db.PaymentRollup)
+        # in the transaction emptying the rollups, so every later order is only added by record_order
+        last_id = select(sql_max(o.id) for o in db.Order).first() or 0
+
+    count = 0
+    for source in (archive_db, db) if archive_db is not None else (db,):
+        after = 0
+        while True:
+            with db_session:
+                # plain rows: loading entities would track every snapshot for changes
+                chunk = select((o.id, o.order_at, o.price, o.is_paid, o.snapshot) for o in source.Order if o.id > after)
+                in_main_db = set()
+                if source is db:
+                    chunk = chunk.where(lambda o: o.id <= last_id).order_by(1)[:REBUILD_CHUNK_SIZE]
+                else:
+                    chunk = chunk.order_by(1)[:REBUILD_CHUNK_SIZE]
+                    # archived orders still in the main database are counted from it
+                    chunk_ids = tuple(row[0] for row in chunk)
+                    in_main_db = set(select(o.id for o in db.Order if o.id in chunk_ids)) if chunk_ids else set()
+                sales, payments = {}, {}
+                for order_id, order_at, price, is_paid, snapshot in chunk:
+                    if order_at is None or order_id in in_main_db:
+                        continue
+                    price = price or 0
+                    juices = snapshot['juices'] if snapshot is not None else c.order_juices(source.Order[order_id])
+                    sales_increments(order_at, juices, sales)
+                    payment_increments(order_at, 1, int(bool(is_paid)), price, price if is_paid else 0, payments)
+                    count += 1
+                _apply(db, sales, payments)
+            if not chunk:
+                break
+            after = chunk[-1][0]
+    return count
+
+
+def _range(since: dt.datetime, until: dt.datetime) -> tuple:
+    return since or MIN_DATETIME, until or MAX_DATETIME
+
+
+@db_session
+def top_combinations(db, since: dt.datetime = None, until: dt.datetime = None, limit: int = c.ANALYTICS_TOP_SIZE,
+                     period: str = 'day') -> list:
+    """
+    Returns the best selling fruit combinations.
+    :param db: DB Connection
+    :param since: first bucket included, unbounded by default.
+    :param until: last bucket excluded, unbounded by default.
+    :param limit: maximum number of combinations.
+    :param period: rollups used, 'day' by default; 'hour' when the range isn't made of whole days.
+    :return: a list of dicts with the fruits, the juices sold and the revenue
+    """
+    since, until = _range(since, until)
+    rows = select(
+        (r.name, sql_sum(r.juices), sql_sum(r.revenue)) for r in db.SalesRollup
+        if r.period == period and r.dimension == 'combination' and r.bucket >= since and r.bucket < until
+    ).order_by(lambda name, juices, revenue: (desc(juices), desc(revenue), name))[:limit]
+    return [{'fruits': json.loads(name), 'juices': juices, 'revenue': revenue / c.PRICE_DIVISOR}
+            for name, juices, revenue in rows]
+
+
+@db_session
+def revenue(db, dimension: str, period: str, since: dt.datetime = None, until: dt.datetime = None) -> list:
+    """
+    Returns the juices sold and the revenue of each liquid or fruit, per hour or day.
+    :param db: DB Connection
+    :param dimension: 'liquid' or 'fruit'.
+    :param period: 'hour' or 'day'.
+    :param since: first bucket included, unbounded by default.
+    :param until: last bucket excluded, unbounded by default.
+    :return: a list of dicts ordered by bucket and name
+    """
+    since, until = _range(since, until)
+    rows = select(
+        (r.bucket, r.name, r.juices, r.revenue) for r in db.SalesRollup
+        if r.period == period and r.dimension == dimension and r.bucket >= since and r.bucket < until
+    ).order_by(1, 2)
+    return [{'bucket': row_bucket, dimension: name, 'juices': juices, 'revenue': row_revenue / c.PRICE_DIVISOR}
+            for row_bucket, name, juices, row_revenue in rows]
+
+
+@db_session
+def payments(db, period: str, since: dt.datetime = None, until: dt.datetime = None) -> dict:
+    """
+    Returns the paid and unpaid orders and revenue, per hour or day and in total.
+    :param db: DB Connection
+    :param period: 'hour' or 'day'.
+    :param since: first bucket included, unbounded by default.
+    :param until: last bucket excluded, unbounded by default.
+    :return: a dict with the buckets and the totals
+    """
+    since, until = _range(since, until)
+    rows = select(
+        (r.bucket, r.orders, r.paid, r.revenue, r.paid_revenue) for r in db.PaymentRollup
+        if r.period == period and r.bucket >= since and r.bucket < until
+    ).order_by(1)
+
+    def payment_dict(orders, paid, payment_revenue, paid_revenue) -> dict:
+        return {
+            'orders': orders,
+            'paid': paid,
+            'unpaid': orders - paid,
+            'paid_ratio': paid / orders if orders else None,
+            'revenue': payment_revenue / c.PRICE_DIVISOR,
+            'paid_revenue': paid_revenue / c.PRICE_DIVISOR,
+        }
+
+    buckets = [dict(payment_dict(*totals), bucket=row_bucket) for row_bucket, *totals in rows]
+    totals = [sum(row[i] for row in rows) for i in range(1, 5)]
+    return {'buckets': buckets, 'total': payment_dict(*totals)}
@@ -0,0 +1,83 @@
+import datetime as dt
+
+from pony.orm import commit, db_session, select
+
+import JuiceShop.common as c
+from JuiceShop.database import migrations, models
+
+CATALOG_FIELDS = ('name', 'price', 'description', 'image')
+
+
+def define_archive_db(db_config: dict):
+    """
+    Binds the archive database. Its tables are the ones of the main database, created when missing and upgraded as
+    the main database is by migrations.upgrade: only the archival job writes to it.
+    :param db_config: the archive database settings, as ARCHIVE_DB_CONFIG.
+    :return: the bound database
+    """
+    db = models.define_db(create_tables=False, **db_config)
+    migrations.upgrade(db)
+    return db
+
+
+def _copy_catalog(entity, archive_entity, ids: set):
+    """
+    Copies the fruits or liquids of the archived juices, keeping their ids, so archived juices are read with the same
+    joins as the ones of the main database.
+    """
+    ids = tuple(ids)
+    archived = {item.id: item for item in archive_entity.select(lambda item: item.id in ids)}
+    for item in entity.select(lambda item: item.id in ids):
+        values = {field: getattr(item, field) for field in CATALOG_FIELDS}
+        if item.id in archived:
+            archived[item.id].set(**values)
+        else:
+            archive_entity(id=item.id, **values)
+
+
+def _copy_orders(archive_db, chunk: list):
+    ids = tuple(order.id for order in chunk)
+    already_archived = set(select(o.id for o in archive_db.Order if o.id in ids))
+    for order in chunk:
+        if order.id in already_archived:
+            continue
+        archive_order = archive_db.Order(id=order.id, payment_id=order.payment_id, price=order.price,
+                                         order_at=order.order_at, is_paid=order.is_paid, snapshot=order.snapshot)
+        for juice in order.juices:
+            archive_db.Juice(id=juice.id, price=juice.price, order=archive_order,
+                             liquid=archive_db.Liquid[juice.liquid.id] if juice.liquid else None,
+                             fruits=[archive_db.Fruit[fruit.id] for fruit in juice.fruits])
+
+
+def archive_orders(db, archive_db, older_than: dt.datetime, chunk_size: int = c.ARCHIVE_CHUNK_SIZE) -> int:
+    """
+    Moves the paid orders placed before a date, with their juices, from the main database to the archive. Orders are
+    moved in chunks: each chunk is committed to the archive first, then deleted from the main database, so a job
+    interrupted in between is resumed by running it again. Ids are kept, so archived orders and juices are paged like
+    the ones left in the main database.
+    :param db: DB Connection
+    :param archive_db: the archive DB Connection
+    :param older_than: orders placed before this datetime are archived.
+    :param chunk_size: orders moved per transaction.
+    :return: the number of orders archived
+    """
+    count = 0
+    while True:
+        with db_session:
+            chunk = select(o for o in db.Order if o.is_paid and o.order_at < older_than).order_by(db.Order.id)
+            chunk = list(chunk.prefetch(db.Order.juices, db.Juice.fruits, db.Juice.liquid)[:chunk_size])
+            if not chunk:
+                return count
+
+            juices = [juice for order in chunk for juice in order.juices]
+            _copy_catalog(db.Liquid, archive_db.Liquid, {juice.liquid.id for juice in juices if juice.liquid})
+            _copy_catalog(db.Fruit, archive_db.Fruit, {fruit.id for juice in juices for fruit in juice.fruits})
+            _copy_orders(archive_db, chunk)
+            commit()
+
+            for juice in juices:
+                juice.delete()
+            for order in chunk:
+                order.delete()
+            commit()
+        count += len(chunk)
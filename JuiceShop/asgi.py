@@ -0,0 +1,258 @@
+"""
+ASGI entry point of the Juice Shop API, serving the same /v1 routes as the Flask app.
+
+    uvicorn JuiceShop.asgi:application
+    python run_juice_shop_app.py --asgi
+
+The event loop only holds connections: each request runs the Flask app in a bounded thread pool, so the number of
+open connections doesn't depend on the number of threads. A GET of an unpaid order with `?wait=N` doesn't hold a
+thread while it waits, it waits on the loop for the payment event.
+"""
+import asyncio
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode
+
+import JuiceShop.common as c
+from JuiceShop import idempotency, juice_shop_app, notifications
+
+try:
+    import uvicorn
+except ImportError:
+    # optional: only needed to serve the ASGI app with run_juice_shop_app.py --asgi
+    uvicorn = None
+
+ORDER_PATH = re.compile(re.escape(c.API_VERSION) + r'/order/([^/]+)$')
+
+
+def _to_environ(scope: dict, body: bytes) -> dict:
+    """
+    Builds the WSGI environ of an ASGI HTTP request.
+    :param scope: the ASGI connection scope.
+    :param body: the whole request body.
+    :return: the environ
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    # the body is already read, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class _WSGIResponse:
+    """
+    A response of the Flask app being read by the event loop. It is created in a pool thread, with its first chunk
+    already read, so a response that isn't streamed is served with a single hop to the pool.
+    """
+
+    def __init__(self, wsgi_app, environ: dict):
+        self.status = None
+        self.headers = None
+        self.result = wsgi_app(environ, self._start_response)
+        self._chunks = iter(self.result)
+        self.first_chunk = next(self._chunks, b'')
+        # a response whose length is known and already read doesn't need another hop to find that it's over
+        length = next((value for name, value in self.headers if name.lower() == 'content-length'), None)
+        self.complete = length is not None and int(length) == len(self.first_chunk)
+        if self.complete:
+            self.close()
+
+    def _start_response(self, status: str, headers: list, exc_info=None):
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = headers
+
+    def next_chunk(self):
+        return next(self._chunks, None)
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+class ASGIApp:
+    """
+    Serves a Flask app as an ASGI app. The Flask app runs in a pool of `threads` threads, started on first use, and is
+    bound to the database at startup when the server sends lifespan events.
+    """
+
+    def __init__(self, flask_app, threads: int = c.ASGI_THREADS, max_body_size: int = c.CATALOG_IMPORT_MAX_SIZE):
+        self.flask_app = flask_app
+        self.threads = threads
+        self.max_body_size = max_body_size
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='juice-shop')
+        return self._executor
+
+    async def __call__(self, scope: dict, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise Exception("Unable to serve - unsupported ASGI scope type {}".format(scope['type']))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._run(juice_shop_app.bind_db, self.flask_app)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _read_body(self, receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body += message.get('body', b'')
+            if len(body) > self.max_body_size:
+                return None
+            if not message.get('more_body', False):
+                return bytes(body)
+
+    async def _http(self, scope: dict, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            await self._send_whole(send, 413, [('Content-Type', 'text/plain')], b'Request Entity Too Large')
+            return
+
+        order_match = ORDER_PATH.match(scope['path'])
+        wait = _wait_seconds(scope) if order_match and scope['method'] == 'GET' else 0
+        if wait:
+            await self._wait_for_payment(scope, order_match.group(1), wait, send)
+            return
+
+        response = await self._run(_WSGIResponse, self.flask_app, _to_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': _encode(response.headers)})
+        if response.complete:
+            await send({'type': 'http.response.body', 'body': response.first_chunk})
+            return
+
+        # a streamed response, as the juices export: each chunk is read in the pool and sent from the loop
+        try:
+            chunk = response.first_chunk
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self._run(response.next_chunk)
+        finally:
+            await self._run(response.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _wait_for_payment(self, scope: dict, payment_id: str, wait: float, send):
+        """
+        Answers a GET of an order with ?wait=N on the event loop: the order is read without waiting and, while it is
+        unpaid, the loop waits for its payment event before reading it again.
+        """
+        loop = asyncio.get_running_loop()
+        paid = loop.create_future()
+
+        def on_payment(message):
+            loop.call_soon_threadsafe(lambda: paid.done() or paid.set_result(message))
+
+        scope = dict(scope, query_string=urlencode(
+            [(k, v) for k, v in parse_qsl(scope['query_string'].decode('latin-1')) if k != 'wait']).encode('latin-1'))
+        # subscribed before reading the order, so an update committed in between is not missed
+        notifications.payment_events.subscribe(payment_id, on_payment)
+        try:
+            response = await self._run(_whole_response, self.flask_app, _to_environ(scope, b''))
+            if response[0] == 200 and not c.from_json_bytes(response[2])['is_paid']:
+                try:
+                    await asyncio.wait_for(paid, wait)
+                except asyncio.TimeoutError:
+                    # read again all the same: a payment made in another worker process isn't notified to this one
+                    pass
+                response = await self._run(_whole_response, self.flask_app, _to_environ(scope, b''))
+        finally:
+            notifications.payment_events.unsubscribe(payment_id, on_payment)
+
+        await self._send_whole(send, *response)
+
+    @staticmethod
+    async def _send_whole(send, status: int, headers: list, body: bytes):
+        await send({'type': 'http.response.start', 'status': status, 'headers': _encode(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def _whole_response(wsgi_app, environ: dict) -> tuple:
+    response = _WSGIResponse(wsgi_app, environ)
+    chunks = [response.first_chunk]
+    if not response.complete:
+        try:
+            chunks.extend(iter(response.next_chunk, None))
+        finally:
+            response.close()
+    return response.status, response.headers, b''.join(chunks)
+
+
+def _wait_seconds(scope: dict) -> float:
+    """
+    The `wait` parameter of a request, when it's valid: invalid ones are answered by the Flask app.
+    """
+    try:
+        wait = float(dict(parse_qsl(scope['query_string'].decode('latin-1'))).get('wait', 0))
+    except ValueError:
+        return 0
+    return wait if 0 < wait <= c.ORDER_MAX_WAIT else 0
+
+
+def _encode(headers: list) -> list:
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+def serve(host: str, port: int, workers: int = c.WORKERS):
+    """
+    Serves the ASGI app with uvicorn, in `workers` processes.
+    :param host: the address to listen on.
+    :param port: the port to listen on.
+    :param workers: the number of worker processes.
+    :return: None, returns when the server is stopped
+    """
+    if uvicorn is None:
+        raise Exception("Unable to serve ASGI - uvicorn is not installed")
+    idempotency.warn_if_per_process(workers)
+    uvicorn.run('JuiceShop.asgi:application', host=host, port=port, workers=workers, lifespan='on')
+
+
+application = ASGIApp(juice_shop_app.app)
@@ -0,0 +1,368 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop.database import query
+
+EPOCH_SIZE = 8
+GENERATION = struct.Struct('<8sQ')
+VERSION = struct.Struct('<Q')
+# epoch, version, catalog token, offset of the liquids body and its size, followed by the fruits and liquids bodies
+SNAPSHOT_HEADER = struct.Struct('<8sQQQQ')
+
+
+class MenuSnapshot(NamedTuple):
+    """
+    Immutable view of the menu, already rendered as the JSON bodies served by the catalog endpoints.
+    """
+    version: int
+    etag: str
+    # the catalog token of the database the menu was read from
+    token: int
+    fruits: bytes
+    liquids: bytes
+
+
+@db_session
+def _render_menu(db) -> tuple:
+    """
+    Loads fruits, vitamins and liquids using a fixed number of queries, in one transaction, and renders the menu bodies.
+    :param db: DB Connection
+    :return: a tuple with the catalog token and the fruits and liquids JSON bytes.
+    """
+    token = query.get_catalog_token(db)
+    fruits = {'fruits': [c.fruit_to_dict(fruit, with_descriptions=True) for fruit in query.get_fruit_records(db)]}
+    liquids = {'liquids': [c.liquid_to_dict(liquid) for liquid in query.get_liquid_records(db)]}
+
+    return token, c.to_json_bytes(fruits), c.to_json_bytes(liquids)
+
+
+def description_key(fruit_names, liquid_name: str) -> tuple:
+    """
+    Canonicalizes the ingredients of a juice: the description doesn't depend on the order, the case or the repetition of
+    the fruits.
+    :param fruit_names: the fruit names of the juice.
+    :param liquid_name: the liquid name of the juice.
+    :return: a tuple with the sorted, lower-cased fruit names and the lower-cased liquid name
+    """
+    return tuple(sorted({name.lower() for name in fruit_names})), liquid_name.lower()
+
+
+def _render_description(db, key: tuple):
+    """
+    Renders the description of a juice. Vitamins shared by several fruits are listed once.
+    :param db: DB Connection
+    :param key: the canonical ingredients, as returned by description_key.
+    :return: the description JSON bytes, or None when an ingredient doesn't exist.
+    """
+    fruit_names, liquid_name = key
+    fruits = query.get_fruits_by_lower_names(db, fruit_names)
+    liquids = query.get_liquids_by_lower_names(db, [liquid_name])
+    # lower-cased names are unique, so a name matches one fruit or liquid at most
+    if not liquids or len(fruits) != len(fruit_names):
+        return None
+
+    liquid = liquids[0]
+    fruits.sort(key=lambda fruit: fruit.lower_name)
+    juice_descr = {
+        'fruits': [{'name': fruit.name, 'description': fruit.description} for fruit in fruits],
+        'vitamins': [{'name': name, 'description': description}
+                     for name, description in query.get_vitamins_of_fruits(db, [fruit.id for fruit in fruits])],
+        'liquid': {'name': liquid.name, 'description': liquid.description}
+    }
+
+    return c.to_json_bytes(juice_descr)
+
+
+class MenuCache:
+    """
+    Holds the menu snapshot and the juice descriptions of one database. They are rendered on the first read and kept
+    until a catalog write calls invalidate().
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._build_lock = Lock()
+        # versions restart at 0 with the process, the epoch keeps ETags of different processes apart
+        self._epoch = os.urandom(4).hex()
+        self._version = 0
+        self._snapshot = None
+        self._descriptions = OrderedDict()
+        self._descriptions_version = 0
+
+    def check(self, db):
+        # the snapshot of a process-local cache is rendered by the process itself, from the database
+        pass
+
+    def _read_version(self) -> int:
+        return self._version
+
+    def _bump_version(self):
+        self._version += 1
+
+    def _load_snapshot(self, version: int):
+        # a snapshot rendered by another cache sharing this one's version, none here
+        return None
+
+    def _publish(self, snapshot: MenuSnapshot) -> MenuSnapshot:
+        return snapshot
+
+    def _etag(self, version: int) -> str:
+        return '{}-{}'.format(self._epoch, version)
+
+    @property
+    def etag(self) -> str:
+        """
+        The ETag of the current catalog version. It is known without rendering the snapshot.
+        """
+        return self._etag(self._read_version())
+
+    def snapshot(self, db) -> MenuSnapshot:
+        """
+        Returns the current snapshot, rendering it from the database if it was invalidated.
+        :param db: DB Connection
+        :return: the menu snapshot
+        """
+        self.check(db)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._read_version():
+            return snapshot
+
+        with self._build_lock:
+            version = self._read_version()
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._load_snapshot(version)
+                if snapshot is None:
+                    snapshot = MenuSnapshot(version, self._etag(version), *_render_menu(db))
+                    # a write committed while rendering, so this snapshot may be stale and must not be kept
+                    if version != self._read_version():
+                        return snapshot
+                    snapshot = self._publish(snapshot)
+                with self._lock:
+                    if version == self._read_version():
+                        self._snapshot = snapshot
+
+        return snapshot
+
+    def description(self, db, key: tuple):
+        """
+        Returns the description of a juice, rendering it on a miss. At most DESCRIPTION_CACHE_SIZE descriptions are
+        kept, the least recently used is evicted first.
+        :param db: DB Connection
+        :param key: the canonical ingredients, as returned by description_key.
+        :return: the description JSON bytes, or None when an ingredient doesn't exist.
+        """
+        with self._lock:
+            version = self._read_version()
+            if version != self._descriptions_version:
+                self._descriptions.clear()
+                self._descriptions_version = version
+            body = self._descriptions.get(key)
+            if body is not None:
+                self._descriptions.move_to_end(key)
+                return body
+
+        body = _render_description(db, key)
+        if body is None:
+            return None
+
+        with self._lock:
+            if version == self._read_version():
+                self._descriptions[key] = body
+                if len(self._descriptions) > c.DESCRIPTION_CACHE_SIZE:
+                    self._descriptions.popitem(last=False)
+
+        return body
+
+    def invalidate(self):
+        """
+        Drops the current snapshot and descriptions and bumps the version. It must be called after the catalog change
+        is committed.
+        :return: None
+        """
+        with self._lock:
+            self._bump_version()
+            self._snapshot = None
+            self._descriptions.clear()
+
+
+class SharedMenuCache(MenuCache):
+    """
+    A menu cache shared by the processes of a box through two files. `<path>.generation` holds the epoch and the
+    catalog version, mapped in memory by every process, so checking the version on each request is a memory read. A
+    catalog write in any process bumps it. `<path>` holds the rendered snapshot: the first process needing a version
+    renders it and writes it atomically, the other processes read the file instead of querying and rendering it again.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._pid = os.getpid()
+        self._generation_file = open(path + '.generation', 'a+b')
+        with self._locked_generation():
+            if os.fstat(self._generation_file.fileno()).st_size < GENERATION.size:
+                self._generation_file.truncate(0)
+                self._generation_file.write(GENERATION.pack(os.urandom(EPOCH_SIZE), 0))
+                self._generation_file.flush()
+        self._generation = mmap.mmap(self._generation_file.fileno(), GENERATION.size)
+        self._epoch_bytes = GENERATION.unpack_from(self._generation)[0]
+        # the epoch changes when the generation file is recreated, so ETags of a previous catalog don't match
+        self._epoch = self._epoch_bytes.hex()
+        self._checked = False
+
+    def check(self, db):
+        """
+        Checks, once per process, the snapshot file of the current version against the catalog token of the database.
+        The files outlive the processes, while the database may have been rebuilt or written by a process that doesn't
+        share them: the version is then bumped, so neither the stale snapshot nor its ETag is served. Workers forked
+        from a checked process don't check again.
+        :param db: DB Connection
+        :return: None
+        """
+        if self._checked:
+            return
+        with self._build_lock:
+            if self._checked:
+                return
+            header = self._read_header()
+            if header is not None and header[:2] == (self._epoch_bytes, self._read_version()):
+                if header[2] != query.get_catalog_token(db):
+                    self.invalidate()
+            self._checked = True
+
+    @contextmanager
+    def _locked_generation(self):
+        if self._pid != os.getpid():
+            # a forked worker shares the file description, and so the lock, of its parent: it needs its own
+            self._pid = os.getpid()
+            self._generation_file = open(self.path + '.generation', 'r+b')
+        fcntl.flock(self._generation_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._generation_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_version(self) -> int:
+        return VERSION.unpack_from(self._generation, EPOCH_SIZE)[0]
+
+    def _bump_version(self):
+        with self._locked_generation():
+            VERSION.pack_into(self._generation, EPOCH_SIZE, self._read_version() + 1)
+
+    def _read_file(self, size: int = -1) -> bytes:
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                return snapshot_file.read(size)
+        except FileNotFoundError:
+            return b''
+
+    def _read_header(self):
+        data = self._read_file(SNAPSHOT_HEADER.size)
+        return SNAPSHOT_HEADER.unpack(data) if len(data) == SNAPSHOT_HEADER.size else None
+
+    def _load_snapshot(self, version: int):
+        data = self._read_file()
+        header = SNAPSHOT_HEADER.unpack_from(data) if len(data) >= SNAPSHOT_HEADER.size else None
+        if header is None or header[:2] != (self._epoch_bytes, version) or len(data) != sum(header[3:]):
+            return None
+
+        return MenuSnapshot(version, self._etag(version), header[2], data[SNAPSHOT_HEADER.size:header[3]],
+                            data[header[3]:])
+
+    def _publish(self, snapshot: MenuSnapshot) -> MenuSnapshot:
+        # written aside and renamed, so other processes read either the previous file or the complete new one
+        temporary_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        liquids_offset = SNAPSHOT_HEADER.size + len(snapshot.fruits)
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_HEADER.pack(self._epoch_bytes, snapshot.version, snapshot.token,
+                                                     liquids_offset, len(snapshot.liquids)))
+            snapshot_file.write(snapshot.fruits)
+            snapshot_file.write(snapshot.liquids)
+        os.replace(temporary_path, self.path)
+        return snapshot
+
+
+_caches = WeakKeyDictionary()
+_caches_lock = Lock()
+
+
+def menu_cache(db) -> MenuCache:
+    """
+    Returns the menu cache bound to a database, creating it on first use.
+    :param db: DB Connection
+    :return: the menu cache of the database
+    """
+    cache = _caches.get(db)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(db, MenuCache())
+    return cache
+
+
+def snapshot_file(db):
+    """
+    Returns the path of the snapshot file shared by the processes serving a database: CATALOG_SNAPSHOT_FILE when set,
+    next to the SQLite file, or in the temporary directory. In-memory SQLite databases aren't shared between
+    processes, so neither is their catalog.
+    :param db: DB Connection
+    :return: the path, or None when the catalog can't be shared
+    """
+    if c.CATALOG_SNAPSHOT_FILE:
+        return c.CATALOG_SNAPSHOT_FILE
+    if db.provider.dialect == 'SQLite':
+        pool = db.provider.pool
+        if pool.is_shared_memory_db or pool.filename == ':memory:':
+            return None
+        return pool.filename + '-catalog'
+    return os.path.join(tempfile.gettempdir(), 'juice_shop_catalog')
+
+
+def share(db, path: str) -> MenuCache:
+    """
+    Replaces the menu cache of a database with one shared, through path, with the other processes serving it.
+    :param db: DB Connection
+    :param path: the snapshot file, as returned by snapshot_file.
+    :return: the shared menu cache
+    """
+    with _caches_lock:
+        cache = _caches[db] = SharedMenuCache(path)
+    return cache
+
+
+def mark_changed(db):
+    """
+    Gives the catalog a new token in the current transaction. Catalog writes call it before committing, and
+    invalidate() after, so a snapshot rendered before the write is never taken for the current catalog, not even by a
+    process started later.
+    :param db: DB Connection
+    :return: None
+    """
+    token = int.from_bytes(os.urandom(8), 'big') >> 1
+    catalog_version = db.CatalogVersion.get(id=1)
+    if catalog_version is None:
+        db.CatalogVersion(id=1, token=token)
+    else:
+        catalog_version.token = token
+
+
+def menu_snapshot(db) -> MenuSnapshot:
+    return menu_cache(db).snapshot(db)
+
+
+def juice_description(db, fruit_names, liquid_name: str):
+    return menu_cache(db).description(db, description_key(fruit_names, liquid_name))
+
+
+def invalidate(db):
+    menu_cache(db).invalidate()
@@ -1,74 +1,293 @@
+import datetime as dt
+import json
+import os
+
 from pony.orm import db_session
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    # optional: JSON is encoded and decoded with the json module, to the same bytes, when it isn't installed
+    orjson = None
 
 DB_FILE = 'juice_shop_db'
 PRICE_DIVISOR = 100
+# prices are stored in cents in 32-bit integer columns
+MAX_PRICE = (2 ** 31 - 1) / PRICE_DIVISOR
 API_VERSION = '/v1'
+JUICES_PAGE_SIZE = 100
+JUICES_MAX_PAGE_SIZE = 1000
+JUICES_EXPORT_CHUNK_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+DESCRIPTION_CACHE_SIZE = 1024
+# maximum seconds a GET of an order can wait for its payment
+ORDER_MAX_WAIT = 60
+ANALYTICS_TOP_SIZE = 10
+ANALYTICS_MAX_TOP_SIZE = 100
+# request bodies: the catalog import accepts larger ones, which is also the limit of every request
+PAYLOAD_MAX_SIZE = 64 * 1024
+PAYLOAD_MAX_ARRAY_LENGTH = 100
+CATALOG_IMPORT_MAX_SIZE = 16 * 1024 * 1024
+CATALOG_MAX_AGE = int(os.environ.get('JUICE_SHOP_CATALOG_MAX_AGE', 60))
+# the rendered catalog is shared by the worker processes of a box through a memory-mapped file, next to the SQLite
+# database unless JUICE_SHOP_CATALOG_SNAPSHOT_FILE sets it
+CATALOG_SHARED = os.environ.get('JUICE_SHOP_CATALOG_SHARED', '1') != '0'
+CATALOG_SNAPSHOT_FILE = os.environ.get('JUICE_SHOP_CATALOG_SNAPSHOT_FILE')
 
-DB_CONFIG = dict(provider='sqlite', filename=DB_FILE, create_db=True)
+# SQLite pragmas applied to every new connection. JUICE_SHOP_DB_PROFILE selects one of the profiles: 'default' keeps
+# SQLite defaults (rollback journal), 'wal' lets readers run while an order is being written.
+SQLITE_PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+}
+DB_PROFILE = os.environ.get('JUICE_SHOP_DB_PROFILE', 'default')
 
+# JUICE_SHOP_DB_PROVIDER selects the database backend, 'sqlite' (default) or 'postgres'. PostgreSQL connections are
+# shared by the threads of a process through a pool of JUICE_SHOP_DB_POOL_SIZE connections.
+DB_PROVIDER = os.environ.get('JUICE_SHOP_DB_PROVIDER', 'sqlite')
+DB_POOL_SIZE = int(os.environ.get('JUICE_SHOP_DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('JUICE_SHOP_DB_POOL_TIMEOUT', 30))
 
-@db_session
-def order_to_dict(order_object) -> dict:
+SQLITE_CONFIG = dict(provider='sqlite', filename=DB_FILE, create_db=True, pragmas=SQLITE_PROFILES[DB_PROFILE])
+POSTGRES_CONFIG = dict(provider='postgres',
+                       host=os.environ.get('JUICE_SHOP_DB_HOST', 'localhost'),
+                       port=int(os.environ.get('JUICE_SHOP_DB_PORT', 5432)),
+                       user=os.environ.get('JUICE_SHOP_DB_USER', 'juice_shop'),
+                       password=os.environ.get('JUICE_SHOP_DB_PASSWORD', ''),
+                       database=os.environ.get('JUICE_SHOP_DB_NAME', 'juice_shop'),
+                       pool_size=DB_POOL_SIZE,
+                       pool_timeout=DB_POOL_TIMEOUT)
+
+DB_CONFIG = POSTGRES_CONFIG if DB_PROVIDER == 'postgres' else SQLITE_CONFIG
+
+# Paid orders older than JUICE_SHOP_ARCHIVE_AFTER_DAYS are moved by the archival job to the archive database, a second
+# SQLite file or PostgreSQL database with the same tables, so the main one only holds recent orders.
+ARCHIVE_DB_FILE = 'juice_shop_archive_db'
+ARCHIVE_AFTER_DAYS = float(os.environ.get('JUICE_SHOP_ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_CHUNK_SIZE = 500
+ARCHIVE_SQLITE_CONFIG = dict(SQLITE_CONFIG, filename=ARCHIVE_DB_FILE)
+ARCHIVE_POSTGRES_CONFIG = dict(POSTGRES_CONFIG,
+                               database=os.environ.get('JUICE_SHOP_ARCHIVE_DB_NAME', 'juice_shop_archive'))
+
+ARCHIVE_DB_CONFIG = ARCHIVE_POSTGRES_CONFIG if DB_PROVIDER == 'postgres' else ARCHIVE_SQLITE_CONFIG
+
+# The app only creates missing tables when JUICE_SHOP_DB_MIGRATE is set, so workers don't pay for it on startup.
+DB_CREATE_TABLES = os.environ.get('JUICE_SHOP_DB_MIGRATE', '') == '1'
+
+# Serving: worker processes, and threads per worker running the Flask app. The default threads are the ones of
+# ThreadPoolExecutor; with PostgreSQL, more threads than pooled connections would only wait for a connection.
+CPU_COUNT = os.cpu_count() or 1
+WORKERS = int(os.environ.get('JUICE_SHOP_WORKERS', CPU_COUNT))
+DEFAULT_THREADS = min(CPU_COUNT + 4, 32, DB_POOL_SIZE if DB_PROVIDER == 'postgres' else 32)
+ASGI_THREADS = int(os.environ.get('JUICE_SHOP_ASGI_THREADS', DEFAULT_THREADS))
+WORKER_THREADS = int(os.environ.get('JUICE_SHOP_WORKER_THREADS', DEFAULT_THREADS))
+SERVER_HOST = os.environ.get('JUICE_SHOP_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('JUICE_SHOP_PORT', 8000))
+SERVER_BACKLOG = int(os.environ.get('JUICE_SHOP_BACKLOG', 2048))
+# seconds a stopped worker has to answer the requests it is serving before being killed
+SERVER_GRACEFUL_TIMEOUT = float(os.environ.get('JUICE_SHOP_GRACEFUL_TIMEOUT', 30))
+# a worker exiting within SERVER_WORKER_MIN_UPTIME seconds of its fork failed to start: it is replaced after a delay
+# doubling from SERVER_RESTART_DELAY up to SERVER_RESTART_MAX_DELAY, and the master stops after
+# SERVER_MAX_START_FAILURES of these failures in a row
+SERVER_WORKER_MIN_UPTIME = float(os.environ.get('JUICE_SHOP_WORKER_MIN_UPTIME', 5))
+SERVER_RESTART_DELAY = 0.1
+SERVER_RESTART_MAX_DELAY = 30
+SERVER_MAX_START_FAILURES = int(os.environ.get('JUICE_SHOP_MAX_START_FAILURES', 10))
+
+# Responses of POST /v1/order kept for retries sent with the same Idempotency-Key. JUICE_SHOP_IDEMPOTENCY_STORE selects
+# where: 'memory' (per process) or 'database' (the IdempotencyKey table, shared by all workers). It defaults to
+# 'database' when more than one worker is configured, as a retry may reach another worker than the first request.
+IDEMPOTENCY_STORE = os.environ.get('JUICE_SHOP_IDEMPOTENCY_STORE', 'database' if WORKERS > 1 else 'memory')
+IDEMPOTENCY_TTL = int(os.environ.get('JUICE_SHOP_IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Group commit: with JUICE_SHOP_GROUP_COMMIT=1, the orders received within JUICE_SHOP_GROUP_COMMIT_WINDOW_MS
+# milliseconds, at most GROUP_COMMIT_MAX_BATCH of them, are created by a writer thread in a single transaction.
+GROUP_COMMIT = os.environ.get('JUICE_SHOP_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_WINDOW = float(os.environ.get('JUICE_SHOP_GROUP_COMMIT_WINDOW_MS', 3)) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('JUICE_SHOP_GROUP_COMMIT_MAX_BATCH', 64))
+
+# Payment updates wake the ?wait=N requests of every worker process of a box: they are signalled through a
+# memory-mapped file of PAYMENT_EVENTS_SLOTS counters, next to the SQLite database, polled by each process every
+# PAYMENT_EVENTS_POLL_INTERVAL seconds. Turned off by setting JUICE_SHOP_PAYMENT_EVENTS_SHARED to 0. A waiting request
+# holds a thread of the Flask app, so at most ORDER_MAX_WAITING_THREADS of them wait at once in a process; the others
+# are answered without waiting. The ASGI app waits without holding a thread.
+PAYMENT_EVENTS_SHARED = os.environ.get('JUICE_SHOP_PAYMENT_EVENTS_SHARED', '1') != '0'
+PAYMENT_EVENTS_SLOTS = 4096
+PAYMENT_EVENTS_POLL_INTERVAL = 0.1
+ORDER_MAX_WAITING_THREADS = int(os.environ.get('JUICE_SHOP_ORDER_MAX_WAITING_THREADS', max(WORKER_THREADS // 2, 1)))
+
+# Query counts and timings of each request, exposed as Server-Timing headers, log lines and /metrics. Turned off by
+# setting JUICE_SHOP_INSTRUMENTATION to 0.
+INSTRUMENTATION = os.environ.get('JUICE_SHOP_INSTRUMENTATION', '1') != '0'
+
+
+def _json_default(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return http_date(value)
+    if isinstance(value, tuple):
+        # named tuples, which orjson doesn't serialize
+        return list(value)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def to_json_bytes(payload) -> bytes:
     """
-    This function creates a dict using an order object as reference.
-    :param order_object: the order object to be converted to dict.
-    :return: a dict with order data
+    Serializes a payload the same way flask.jsonify does for a non-debug app, without needing an app context, except
+    that non-ASCII characters are written as UTF-8 instead of being escaped, as orjson does. orjson is used when it is
+    installed.
+    :param payload: the object to be serialized.
+    :return: JSON bytes terminated by a new line.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default, option=_ORJSON_OPTIONS)
+    return (json.dumps(payload, separators=(',', ':'), sort_keys=True, ensure_ascii=False,
+                       default=_json_default) + '\n').encode('utf-8')
+
+
+def from_json_bytes(data: bytes):
+    """
+    Parses a JSON document, with orjson when it is installed.
+    :param data: the JSON bytes, UTF-8 encoded.
+    :return: the parsed object, raises ValueError when the document is invalid
     """
-    order_dict = {
-        'price': order_object.price / PRICE_DIVISOR,
-        'order_at': order_object.order_at,
-        'is_paid': order_object.is_paid,
-        'payment_id': order_object.payment_id,
-        'juices': []
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def stored_price(price: float) -> int:
+    """
+    Converts a price received from a client to the integer stored, in hundredths. It is rounded, as 1.15 * 100 is
+    114.99999999999999 in floating point.
+    :param price: the price, as in the API.
+    :return: the stored price
+    """
+    return int(round(price * PRICE_DIVISOR))
+
+
+def parse_datetime(value: str) -> dt.datetime:
+    """
+    Parses an ISO 8601 datetime received from a client. Datetimes are stored as naive UTC, so aware datetimes are
+    converted to UTC.
+    :param value: the ISO 8601 string.
+    :return: a naive UTC datetime
+    """
+    parsed = dt.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def juice_snapshot(price: int, liquid, fruits) -> dict:
+    """
+    Freezes a juice as stored in Order.snapshot: its price, and the names and prices of its ingredients at order time.
+    :param price: the juice price.
+    :param liquid: the liquid of the juice.
+    :param fruits: the fruits of the juice.
+    :return: a dict with the prices as stored, in cents
+    """
+    return {
+        'price': price,
+        'liquid': {'name': liquid.name, 'price': liquid.price},
+        'fruits': [{'name': f.name, 'price': f.price} for f in fruits]
     }
 
-    for juice in order_object.juices:
-        order_dict['juices'].append(
+
+@db_session
+def order_juices(order_object) -> list:
+    """
+    Returns the juices of an order as frozen in its snapshot. Orders created before snapshots were stored are read from
+    the juice, liquid and fruit tables instead.
+    :param order_object: the order.
+    :return: a list of juice snapshots, as returned by juice_snapshot
+    """
+    if order_object.snapshot is not None:
+        return order_object.snapshot['juices']
+    return [juice_snapshot(juice.price, juice.liquid, juice.fruits) for juice in order_object.juices]
+
+
+def order_to_dict(order_record) -> dict:
+    """
+    This function creates a dict using an order record as reference.
+    :param order_record: the query.OrderRecord to be converted to dict.
+    :return: a dict with order data
+    """
+    return {
+        'price': order_record.price / PRICE_DIVISOR,
+        'order_at': order_record.order_at,
+        'is_paid': order_record.is_paid,
+        'payment_id': order_record.payment_id,
+        'juices': [
             {
                 'price': juice.price / PRICE_DIVISOR,
                 'liquid': {'name': juice.liquid.name, 'price': juice.liquid.price / PRICE_DIVISOR},
                 'fruits': [{'name': f.name, 'price': f.price / PRICE_DIVISOR} for f in juice.fruits]
-            }
-        )
-
-    return order_dict
+            } for juice in order_record.juices
+        ]
+    }
 
 
-@db_session
-def fruit_to_dict(fruit_object) -> dict:
+def fruit_to_dict(fruit_record, with_descriptions: bool = False) -> dict:
     """
-    This function creates a dict using a fruit object as reference.
-    :param fruit_object: the order object to be converted to dict.
+    This function creates a dict using a fruit record as reference.
+    :param fruit_record: the query.FruitRecord to be converted to dict.
+    :param with_descriptions: when on, the vitamins have their description, as in the menu.
     :return: a dict with fruit data
     """
-    fruit_dict = {
-        'name': fruit_object.name,
-        'price': fruit_object.price / PRICE_DIVISOR,
-        'description': fruit_object.description,
-        'image': fruit_object.image,
-        'vitamins': []
+    return {
+        'name': fruit_record.name,
+        'price': fruit_record.price / PRICE_DIVISOR,
+        'description': fruit_record.description,
+        'image': fruit_record.image,
+        'vitamins': [
+            {'name': v.name, 'description': v.description} if with_descriptions else {'name': v.name}
+            for v in fruit_record.vitamins
+        ]
     }
 
-    for vitamin in fruit_object.vitamins:
-        fruit_dict['vitamins'].append({
-            'name': vitamin.name
-        })
-
-    return fruit_dict
-
 
-@db_session
-def liquid_to_dict(liquid_object) -> dict:
+def liquid_to_dict(liquid_record) -> dict:
     """
-    This function creates a dict using a liquid object as reference.
-    :param liquid_object: the liquid object to be converted to dict.
+    This function creates a dict using a liquid record as reference.
+    :param liquid_record: the query.LiquidRecord to be converted to dict.
     :return: a dict with liquid data
     """
-    juice_dict = {
-        'name': liquid_object.name,
-        'price': liquid_object.price / PRICE_DIVISOR,
-        'description': liquid_object.description,
-        'image': liquid_object.image,
+    return {
+        'name': liquid_record.name,
+        'price': liquid_record.price / PRICE_DIVISOR,
+        'description': liquid_record.description,
+        'image': liquid_record.image,
     }
 
-    return juice_dict
+
+def juice_row_to_dict(juice_row: tuple, fruit_rows: list) -> dict:
+    """
+    This function creates a dict using a row returned by query.get_juices_page as reference.
+    :param juice_row: the juice row to be converted to dict.
+    :param fruit_rows: the (name, price) of each fruit of the juice.
+    :return: a dict with juice data
+    """
+    juice_id, price, liquid_name, liquid_price, order_at, order_price = juice_row
+
+    return {
+        'id': juice_id,
+        'price': price / PRICE_DIVISOR,
+        'fruits': [{'name': name, 'price': fruit_price / PRICE_DIVISOR} for name, fruit_price in fruit_rows],
+        'liquid': {'name': liquid_name, 'price': liquid_price / PRICE_DIVISOR},
+        'order_datetime': order_at,
+        'order_total': order_price / PRICE_DIVISOR
+    }
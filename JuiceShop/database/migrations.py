@@ -0,0 +1,98 @@
+from pony.orm import db_session
+
+# (entity, attribute) of the columns added after the first release. Their type is the one Pony maps the attribute to.
+COLUMNS = (
+    ('Order', 'snapshot'),
+    ('Fruit', 'lower_name'),
+    ('Liquid', 'lower_name'),
+)
+
+# tables whose "lower_name" column holds the lower-cased "name", filled by models.define_entities on every write
+LOWER_NAMES = ('Fruit', 'Liquid')
+
+# (index name, table, column, is unique) of the lookup columns indexed after the first release. Databases created
+# since then already have them, as UNIQUE columns or as the index Pony generates from models.define_entities.
+INDEXES = (
+    ('unq_fruit__name', 'Fruit', 'name', True),
+    ('unq_liquid__name', 'Liquid', 'name', True),
+    ('unq_fruit__lower_name', 'Fruit', 'lower_name', True),
+    ('unq_liquid__lower_name', 'Liquid', 'lower_name', True),
+    ('unq_vitamin__name', 'Vitamin', 'name', True),
+    ('unq_order__payment_id', 'Order', 'payment_id', True),
+    ('idx_order__order_at', 'Order', 'order_at', False),
+)
+
+
+def _add_columns(db) -> list:
+    """
+    Adds the columns of COLUMNS missing from their tables. Existing rows get NULL.
+    :param db: DB Connection
+    :return: a list with the names of the columns checked or added.
+    """
+    names = []
+    for entity_name, attr_name in COLUMNS:
+        entity = getattr(db, entity_name)
+        attr = entity._adict_[attr_name]
+        table = entity._table_
+        cursor = db.execute('SELECT * FROM "{table}" WHERE 1 = 0'.format(table=table))
+        existing = {description[0] for description in cursor.description}
+        for column, converter in zip(attr.columns, attr.converters):
+            if column not in existing:
+                db.execute('ALTER TABLE "{table}" ADD COLUMN "{column}" {sql_type}'.format(
+                    table=table, column=column, sql_type=converter.get_sql_type()))
+            names.append('{}.{}'.format(table, column))
+    return names
+
+
+def _fill_lower_names(db):
+    """
+    Fills the lower-cased names of the rows written before the column was added. They are lower-cased in Python, as on
+    every write, because SQL LOWER() only folds ASCII letters on SQLite.
+    :param db: DB Connection
+    """
+    for table in LOWER_NAMES:
+        rows = db.select('SELECT "id", "name" FROM "{table}" WHERE "lower_name" IS NULL AND "name" <> \'\''.format(
+            table=table))
+        for row_id, name in rows:
+            lower_name = name.lower()
+            db.execute('UPDATE "{table}" SET "lower_name" = $lower_name WHERE "id" = $row_id'.format(table=table))
+
+
+def upgrade(db) -> list:
+    """
+    Upgrades a database created by an older version of the models. It is safe to run more than once. The database must
+    be bound without checking its tables, as they may miss columns until upgraded.
+    :param db: DB Connection
+    :return: a list with the names of the columns and indexes checked or created.
+    """
+    # tables added since the database was created already have every column and index
+    db.create_tables()
+    return _upgrade_tables(db)
+
+
+@db_session
+def _upgrade_tables(db) -> list:
+    """
+    Adds the missing columns, then the missing indexes, to the existing tables.
+    :param db: DB Connection
+    :return: a list with the names of the columns and indexes checked or created.
+    """
+    names = _add_columns(db)
+    _fill_lower_names(db)
+
+    for index_name, table, column, is_unique in INDEXES:
+        if is_unique:
+            # unique Optional(str) attributes store a missing value as NULL instead of an empty string
+            db.execute('UPDATE "{table}" SET "{column}" = NULL WHERE "{column}" = \'\''.format(
+                table=table, column=column))
+            duplicates = db.select(
+                'SELECT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL '
+                'GROUP BY "{column}" HAVING COUNT(*) > 1'.format(table=table, column=column))
+            if duplicates:
+                raise Exception("Unable to create unique index {} - duplicated values: {}".format(
+                    index_name, ', '.join(sorted(duplicates))))
+
+        db.execute('CREATE {unique}INDEX IF NOT EXISTS "{index_name}" ON "{table}" ("{column}")'.format(
+            unique='UNIQUE ' if is_unique else '', index_name=index_name, table=table, column=column))
+
+    return names + [index_name for index_name, _, _, _ in INDEXES]
@@ -1,29 +1,40 @@
 from datetime import datetime
 
-from pony.orm import Database, Optional, PrimaryKey, Set
+from pony.orm import Database, Json, Optional, PrimaryKey, Required, Set
+
+from JuiceShop.database.pool import pooled_postgres_provider
+
+
+def _store_lower_name(entity):
+    entity.lower_name = entity.name.lower() if entity.name else None
 
 
 def define_entities(db):
     class Fruit(db.Entity):
         id = PrimaryKey(int, auto=True)
-        name = Optional(str)
+        name = Optional(str, unique=True)
+        # the name lower-cased on every write, so juice descriptions are looked up case-insensitively by index
+        lower_name = Optional(str, unique=True)
         price = Optional(int)
         description = Optional(str)
         image = Optional(str)
         vitamins = Set('Vitamin')
         juices = Set('Juice')
+        before_insert = before_update = _store_lower_name
 
     class Liquid(db.Entity):
         id = PrimaryKey(int, auto=True)
-        name = Optional(str)
+        name = Optional(str, unique=True)
+        lower_name = Optional(str, unique=True)
         price = Optional(int)
         description = Optional(str)
         image = Optional(str)
         juices = Set('Juice')
+        before_insert = before_update = _store_lower_name
 
     class Vitamin(db.Entity):
         id = PrimaryKey(int, auto=True)
-        name = Optional(str)
+        name = Optional(str, unique=True)
         description = Optional(str)
         fruits = Set(Fruit)
 
@@ -38,14 +49,64 @@ def define_entities(db):
         id = PrimaryKey(int, auto=True)
         juices = Set(Juice)
         price = Optional(int)
-        payment_id = Optional(str)
-        order_at = Optional(datetime, volatile=True)
+        payment_id = Optional(str, unique=True)
+        order_at = Optional(datetime, volatile=True, index=True)
         is_paid = Optional(bool, volatile=True)
+        # the juices with their names and unit prices at order time, so an order is read from its own row
+        snapshot = Optional(Json, nullable=True)
+
+    class SalesRollup(db.Entity):
+        # juices sold and revenue per hour or day of a liquid, a fruit or a fruit combination, see analytics.py
+        period = Required(str)
+        dimension = Required(str)
+        bucket = Required(datetime)
+        name = Required(str)
+        juices = Required(int)
+        revenue = Required(int)
+        PrimaryKey(period, dimension, bucket, name)
+
+    class PaymentRollup(db.Entity):
+        # orders and revenue per hour or day, and how much of it is paid
+        period = Required(str)
+        bucket = Required(datetime)
+        orders = Required(int)
+        paid = Required(int)
+        revenue = Required(int)
+        paid_revenue = Required(int)
+        PrimaryKey(period, bucket)
+
+    class IdempotencyKey(db.Entity):
+        key = PrimaryKey(str)
+        request_hash = Required(str)
+        response = Required(str, autostrip=False)
+        created_at = Required(datetime, index=True)
+
+    class CatalogVersion(db.Entity):
+        # a single row, given a new random token by every catalog write, in its transaction, see catalog.py
+        id = PrimaryKey(int)
+        token = Required(int, size=64)
+
+
+def define_db(pragmas: dict = None, pool_size: int = None, pool_timeout: float = 30, create_tables: bool = True,
+              **db_params):
+    db = Database()
+
+    if pool_size and db_params.get('provider') == 'postgres':
+        db_params['provider'] = pooled_postgres_provider(pool_size, pool_timeout)
 
+    if pragmas:
+        @db.on_connect(provider='sqlite')
+        def apply_pragmas(database, connection):
+            """
+            Applies the pragmas to each new SQLite connection. It is registered before binding because Pony opens, and
+            keeps, the first connection while binding.
+            """
+            cursor = connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
 
-def define_db(**db_params):
-    db = Database(**db_params)
+    db.bind(**db_params)
     define_entities(db)
-    db.generate_mapping(create_tables=True)
+    db.generate_mapping(create_tables=create_tables, check_tables=create_tables)
 
     return db
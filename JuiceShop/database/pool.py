@@ -0,0 +1,140 @@
+import os
+from threading import Lock, Semaphore, local
+
+
+class ConnectionPool:
+    """
+    A process-wide pool of at most `size` DB-API connections shared by all threads. Pony keeps one connection per
+    thread for as long as the thread lives; with this pool a thread only holds a connection during a db_session.
+    """
+
+    def __init__(self, connect, size: int, timeout: float):
+        """
+        :param connect: a callable that opens a new DB-API connection.
+        :param size: maximum number of open connections.
+        :param timeout: seconds to wait for a free connection before giving up.
+        """
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._slots = Semaphore(self.size)
+        self._idle = []
+
+    def acquire(self) -> tuple:
+        """
+        Takes an idle connection, or opens a new one when there is none and the pool is not full.
+        :return: a tuple with the connection and whether it was just opened.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # connections opened before a fork belong to the parent process and must not be used here
+                self._reset()
+            slots = self._slots
+
+        if not slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Unable to get a database connection - all {} connections are in use after {}s".format(
+                self.size, self.timeout))
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), False
+        try:
+            return self.connect(), True
+        except Exception:
+            slots.release()
+            raise
+
+    def release(self, connection):
+        """
+        Rolls back what was left open and gives the connection back to the pool.
+        :param connection: a connection returned by acquire().
+        :return: None
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self.discard(connection)
+            raise
+        with self._lock:
+            self._idle.append(connection)
+        self._slots.release()
+
+    def discard(self, connection):
+        """
+        Closes a broken connection and frees its slot.
+        :param connection: a connection returned by acquire().
+        :return: None
+        """
+        try:
+            connection.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """
+        Closes every idle connection.
+        :return: None
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class BoundedPool(local):
+    """
+    Implements the interface Pony expects from a provider pool (one object per thread, holding `con`) on top of a
+    shared ConnectionPool.
+    """
+
+    def __init__(pool, shared: ConnectionPool):  # called separately in each thread
+        pool.shared = shared
+        pool.con = None
+
+    def connect(pool) -> tuple:
+        if pool.con is not None:
+            return pool.con, False
+        pool.con, is_new_connection = pool.shared.acquire()
+        return pool.con, is_new_connection
+
+    def release(pool, con):
+        assert con is pool.con
+        pool.con = None
+        pool.shared.release(con)
+
+    def drop(pool, con):
+        assert con is pool.con
+        pool.con = None
+        pool.shared.discard(con)
+
+    def disconnect(pool):
+        if pool.con is not None:
+            pool.drop(pool.con)
+        pool.shared.close()
+
+
+def pooled_postgres_provider(pool_size: int, pool_timeout: float) -> type:
+    """
+    Builds a Pony PostgreSQL provider whose connections come from a bounded ConnectionPool. psycopg2 is imported
+    here, so it is only needed when PostgreSQL is selected.
+    :param pool_size: maximum number of open connections per process.
+    :param pool_timeout: seconds to wait for a free connection.
+    :return: a provider class to be passed as `provider` to Database.bind
+    """
+    from pony.orm.dbproviders.postgres import PGProvider
+
+    class PooledPGProvider(PGProvider):
+        def get_pool(provider, *args, **kwargs):
+            def connect():
+                connection = provider.dbapi_module.connect(*args, **kwargs)
+                if 'client_encoding' not in kwargs:
+                    connection.set_client_encoding('UTF8')
+                return connection
+
+            return BoundedPool(ConnectionPool(connect, pool_size, pool_timeout))
+
+    return PooledPGProvider
@@ -1,6 +1,53 @@
+from datetime import datetime
+from typing import NamedTuple
+
 from pony.orm import db_session, select
 
 
+# Plain, immutable records returned to the handlers and serializers: they are built from tuple queries, so reading
+# them neither goes through Pony's identity map nor fires lazy loads. Prices are stored in cents.
+class VitaminRecord(NamedTuple):
+    name: str
+    description: str
+
+
+class FruitRecord(NamedTuple):
+    id: int
+    name: str
+    price: int
+    description: str
+    image: str
+    vitamins: tuple
+
+
+class LiquidRecord(NamedTuple):
+    id: int
+    name: str
+    price: int
+    description: str
+    image: str
+
+
+class IngredientRecord(NamedTuple):
+    name: str
+    price: int
+
+
+class JuiceRecord(NamedTuple):
+    price: int
+    liquid: IngredientRecord
+    fruits: tuple
+
+
+class OrderRecord(NamedTuple):
+    id: int
+    payment_id: str
+    price: int
+    order_at: datetime
+    is_paid: bool
+    juices: tuple
+
+
 @db_session
 def get_all_fruits(db: db_session) -> list:
     """
@@ -83,3 +130,258 @@ def get_order_by_payment_id(db: db_session, payment_id: str):
     :return:
     """
     return db.Order.get(payment_id=payment_id)
+
+
+@db_session
+def get_fruit_vitamins(db: db_session) -> list:
+    """
+    Returns the vitamins of every fruit with a single query, so callers don't need to load fruit.vitamins lazily.
+    :param db: DB Connection
+    :return: a list of (fruit id, vitamin name, vitamin description) tuples
+    """
+    return list(
+        select(
+            (f.id, v.name, v.description) for f in db.Fruit for v in f.vitamins
+        ))
+
+
+@db_session
+def get_juices_page(db: db_session, after: int = 0, limit: int = 100, since: datetime = None) -> list:
+    """
+    Returns one page of ordered juices, joined with their liquid and order, using keyset pagination by juice id.
+    :param db: DB Connection
+    :param after: only juices with an id greater than this one are returned
+    :param limit: maximum number of juices in the page
+    :param since: when given, only juices whose order was placed at or after this datetime are returned
+    :return: a list of (juice id, juice price, liquid name, liquid price, order datetime, order price) tuples
+    """
+    juices = select(
+        (j.id, j.price, j.liquid.name, j.liquid.price, j.order.order_at, j.order.price)
+        for j in db.Juice if j.id > after
+    )
+    if since is not None:
+        juices = juices.where(lambda j: j.order.order_at >= since)
+
+    return list(juices.order_by(1).limit(limit))
+
+
+@db_session
+def get_juice_fruits(db: db_session, juice_ids) -> list:
+    """
+    Returns the fruits of some juices with a single query.
+    :param db: DB Connection
+    :param juice_ids: the juice ids, at most a page of them
+    :return: a list of (juice id, fruit name, fruit price) tuples
+    """
+    juice_ids = tuple(juice_ids)
+    if not juice_ids:
+        return []
+    return list(
+        select(
+            (j.id, f.name, f.price) for j in db.Juice for f in j.fruits if j.id in juice_ids
+        ).without_distinct())
+
+
+@db_session
+def get_fruits_by_names(db: db_session, fruit_names) -> dict:
+    """
+    Resolves a collection of fruit names with a single query.
+    :param db: DB Connection
+    :param fruit_names: the fruit names to look up
+    :return: a dict mapping each name found to its fruit
+    """
+    fruit_names = tuple(set(fruit_names))
+    if not fruit_names:
+        return {}
+    return {f.name: f for f in select(f for f in db.Fruit if f.name in fruit_names)}
+
+
+@db_session
+def get_liquids_by_names(db: db_session, liquid_names) -> dict:
+    """
+    Resolves a collection of liquid names with a single query.
+    :param db: DB Connection
+    :param liquid_names: the liquid names to look up
+    :return: a dict mapping each name found to its liquid
+    """
+    liquid_names = tuple(set(liquid_names))
+    if not liquid_names:
+        return {}
+    return {l.name: l for l in select(l for l in db.Liquid if l.name in liquid_names)}
+
+
+@db_session
+def get_fruits_by_lower_names(db: db_session, fruit_names) -> list:
+    """
+    Returns the fruits whose lower-cased name is in a collection, with a single query on the indexed lower_name.
+    :param db: DB Connection
+    :param fruit_names: lower-cased fruit names
+    :return: a list of fruits
+    """
+    fruit_names = tuple(set(fruit_names))
+    if not fruit_names:
+        return []
+    return list(select(f for f in db.Fruit if f.lower_name in fruit_names))
+
+
+@db_session
+def get_liquids_by_lower_names(db: db_session, liquid_names) -> list:
+    """
+    Returns the liquids whose lower-cased name is in a collection, with a single query on the indexed lower_name.
+    :param db: DB Connection
+    :param liquid_names: lower-cased liquid names
+    :return: a list of liquids
+    """
+    liquid_names = tuple(set(liquid_names))
+    if not liquid_names:
+        return []
+    return list(select(l for l in db.Liquid if l.lower_name in liquid_names))
+
+
+@db_session
+def get_catalog_token(db: db_session) -> int:
+    """
+    Returns the token of the current catalog version, changed by every catalog write.
+    :param db: DB Connection
+    :return: the token, 0 when the catalog was never written
+    """
+    return select(v.token for v in db.CatalogVersion).first() or 0
+
+
+@db_session
+def get_vitamins_of_fruits(db: db_session, fruit_ids) -> list:
+    """
+    Returns the distinct vitamins of a set of fruits, ordered by name.
+    :param db: DB Connection
+    :param fruit_ids: the ids of the fruits
+    :return: a list of (vitamin name, vitamin description) tuples
+    """
+    fruit_ids = tuple(fruit_ids)
+    if not fruit_ids:
+        return []
+    return list(
+        select(
+            (v.name, v.description) for f in db.Fruit for v in f.vitamins if f.id in fruit_ids
+        ).order_by(1))
+
+
+@db_session
+def get_vitamins_by_names(db: db_session, vitamin_names) -> dict:
+    """
+    Resolves a collection of vitamin names with a single query.
+    :param db: DB Connection
+    :param vitamin_names: the vitamin names to look up
+    :return: a dict mapping each name found to its vitamin
+    """
+    vitamin_names = tuple(set(vitamin_names))
+    if not vitamin_names:
+        return {}
+    return {v.name: v for v in select(v for v in db.Vitamin if v.name in vitamin_names)}
+
+
+@db_session
+def get_fruits_with_vitamins_by_names(db: db_session, fruit_names) -> dict:
+    """
+    Resolves a collection of fruit names and loads their vitamins, with a fixed number of queries.
+    :param db: DB Connection
+    :param fruit_names: the fruit names to look up
+    :return: a dict mapping each name found to its fruit
+    """
+    fruit_names = tuple(set(fruit_names))
+    if not fruit_names:
+        return {}
+    return {f.name: f for f in select(f for f in db.Fruit if f.name in fruit_names).prefetch(db.Fruit.vitamins)}
+
+
+@db_session
+def get_fruit_records(db: db_session, fruit_names=None) -> list:
+    """
+    Returns fruits with their vitamins as records, with two queries.
+    :param db: DB Connection
+    :param fruit_names: when given, only the fruits with these names are returned
+    :return: a list of FruitRecord, ordered by id
+    """
+    fruits = select((f.id, f.name, f.price, f.description, f.image) for f in db.Fruit)
+    vitamins = select((f.id, v.name, v.description) for f in db.Fruit for v in f.vitamins)
+    if fruit_names is not None:
+        fruit_names = tuple(set(fruit_names))
+        if not fruit_names:
+            return []
+        fruits = fruits.where(lambda f: f.name in fruit_names)
+        vitamins = vitamins.where(lambda f: f.name in fruit_names)
+
+    vitamins_by_fruit = {}
+    for fruit_id, name, description in vitamins.order_by(2):
+        vitamins_by_fruit.setdefault(fruit_id, []).append(VitaminRecord(name, description))
+
+    return [FruitRecord(*row, tuple(vitamins_by_fruit.get(row[0], ()))) for row in fruits.order_by(1)]
+
+
+@db_session
+def get_liquid_records(db: db_session, liquid_names=None) -> list:
+    """
+    Returns liquids as records, with a single query.
+    :param db: DB Connection
+    :param liquid_names: when given, only the liquids with these names are returned
+    :return: a list of LiquidRecord, ordered by id
+    """
+    liquids = select((l.id, l.name, l.price, l.description, l.image) for l in db.Liquid)
+    if liquid_names is not None:
+        liquid_names = tuple(set(liquid_names))
+        if not liquid_names:
+            return []
+        liquids = liquids.where(lambda l: l.name in liquid_names)
+
+    return [LiquidRecord(*row) for row in liquids.order_by(1)]
+
+
+def _snapshot_juice_record(juice: dict) -> JuiceRecord:
+    return JuiceRecord(juice['price'], IngredientRecord(juice['liquid']['name'], juice['liquid']['price']),
+                       tuple(IngredientRecord(f['name'], f['price']) for f in juice['fruits']))
+
+
+def order_record(order_object) -> OrderRecord:
+    """
+    Converts an order already loaded in the current db_session, as the one being created or updated, to a record.
+    :param order_object: the order.
+    :return: the OrderRecord
+    """
+    if order_object.snapshot is not None:
+        juices = tuple(_snapshot_juice_record(juice) for juice in order_object.snapshot['juices'])
+    else:
+        juices = tuple(JuiceRecord(j.price, IngredientRecord(j.liquid.name, j.liquid.price),
+                                   tuple(IngredientRecord(f.name, f.price) for f in j.fruits))
+                       for j in order_object.juices)
+    return OrderRecord(order_object.id, order_object.payment_id, order_object.price, order_object.order_at,
+                       order_object.is_paid, juices)
+
+
+@db_session
+def get_order_record(db: db_session, payment_id: str):
+    """
+    Returns an order as a record. Orders with a snapshot are read with a single query, the ones created before
+    snapshots were stored need two more, whatever the number of juices.
+    :param db: DB Connection
+    :param payment_id: the payment id of the order
+    :return: the OrderRecord, or None
+    """
+    row = select((o.id, o.payment_id, o.price, o.order_at, o.is_paid, o.snapshot)
+                 for o in db.Order if o.payment_id == payment_id).first()
+    if row is None:
+        return None
+
+    order_id, snapshot = row[0], row[5]
+    if snapshot is not None:
+        juices = tuple(_snapshot_juice_record(juice) for juice in snapshot['juices'])
+    else:
+        fruits_by_juice = {}
+        for juice_id, name, price in select((j.id, f.name, f.price) for j in db.Juice for f in j.fruits
+                                            if j.order.id == order_id).without_distinct():
+            fruits_by_juice.setdefault(juice_id, []).append(IngredientRecord(name, price))
+        juices = tuple(JuiceRecord(price, IngredientRecord(liquid_name, liquid_price),
+                                   tuple(fruits_by_juice.get(juice_id, ())))
+                       for juice_id, price, liquid_name, liquid_price
+                       in select((j.id, j.price, j.liquid.name, j.liquid.price)
+                                 for j in db.Juice if j.order.id == order_id).order_by(1))
+
+    return OrderRecord(*row[:5], juices)
@@ -0,0 +1,112 @@
+import os
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
+
+from pony.orm import commit, db_session
+
+import JuiceShop.common as c
+from JuiceShop import orders
+from JuiceShop.database import query
+
+
+class PendingOrder(NamedTuple):
+    received_order: dict
+    payment_id: str
+    order_at: object
+    future: Future
+
+
+class OrderWriter:
+    """
+    Creates the orders of every request thread from a single writer thread, combining the orders received within
+    `window` seconds, at most `max_batch` of them, in one transaction. With SQLite, a burst of orders then pays for one
+    commit, and one fsync, per batch instead of one per order. Each order keeps its own payment id and its request only
+    gets its response once the batch is committed.
+    """
+
+    def __init__(self, db, window: float = c.GROUP_COMMIT_WINDOW, max_batch: int = c.GROUP_COMMIT_MAX_BATCH):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = Lock()
+        self._pid = None
+        self._queue = None
+
+    def _start(self):
+        # started on first use, and again in a forked worker, where the thread of its parent doesn't exist
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                Thread(target=self._run, args=(self._queue,), name='juice-shop-order-writer', daemon=True).start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, received_order: dict, payment_id: str, order_at) -> Future:
+        """
+        Queues an order for the next batch.
+        :return: a future of the OrderRecord of the created order, set once it is committed
+        """
+        pending = PendingOrder(received_order, payment_id, order_at, Future())
+        self._start().put(pending)
+        return pending.future
+
+    def create_order(self, received_order: dict, payment_id: str, order_at):
+        """
+        Creates an order in the next batch, as orders.create_order would alone.
+        :return: the OrderRecord of the committed order
+        """
+        return self.submit(received_order, payment_id, order_at).result()
+
+    def _run(self, pending_orders: queue.SimpleQueue):
+        while True:
+            batch = [pending_orders.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending_orders.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: list):
+        try:
+            records = self._create(batch)
+        except Exception:
+            # the shared transaction was rolled back: each order is retried alone, so only the failing one fails
+            for pending in batch:
+                try:
+                    pending.future.set_result(self._create([pending])[0])
+                except Exception as e:
+                    pending.future.set_exception(e)
+            return
+
+        for pending, record in zip(batch, records):
+            pending.future.set_result(record)
+
+    def _create(self, batch: list) -> list:
+        with db_session:
+            created = [orders.create_order(self.db, p.received_order, payment_id=p.payment_id, order_at=p.order_at)
+                       for p in batch]
+            commit()
+            return [query.order_record(new_order) for new_order in created]
+
+
+_writers = WeakKeyDictionary()
+_writers_lock = Lock()
+
+
+def order_writer(db) -> OrderWriter:
+    """
+    Returns the order writer of a database, creating it on first use.
+    :param db: DB Connection
+    :return: the order writer of the database
+    """
+    writer = _writers.get(db)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.setdefault(db, OrderWriter(db))
+    return writer
@@ -0,0 +1,204 @@
+import datetime as dt
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
+
+from pony.orm import TransactionIntegrityError, commit, db_session, delete, rollback
+
+import JuiceShop.common as c
+
+# expired keys are deleted from the database at most once per interval, by the request saving a key
+PURGE_INTERVAL = 60
+
+logger = logging.getLogger('juice_shop.idempotency')
+
+
+class KeyReuseError(ValueError):
+    """
+    Raised when an idempotency key is sent again with a different request body.
+    """
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    body: bytes
+
+
+def request_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class MemoryStore:
+    """
+    Keeps the responses in this process, at most `size` of them, for `ttl` seconds. The least recently used response
+    is evicted first.
+    """
+    # responses are saved once their transaction is committed
+    transactional = False
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._lock = Lock()
+        self._responses = OrderedDict()
+
+    def get(self, db, key: str):
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is None:
+                return None
+            expires_at, stored = entry
+            if expires_at <= time.monotonic():
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return stored
+
+    def save(self, db, key: str, stored: StoredResponse):
+        with self._lock:
+            self._responses[key] = (time.monotonic() + self.ttl, stored)
+            self._responses.move_to_end(key)
+            if len(self._responses) > self.size:
+                self._responses.popitem(last=False)
+
+
+class DatabaseStore:
+    """
+    Keeps the responses in the IdempotencyKey table, shared by every worker, for `ttl` seconds. A response is written
+    in the transaction of the order it belongs to, so both are committed, or neither.
+    """
+    transactional = True
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._purged_at = 0
+
+    def _cutoff(self) -> dt.datetime:
+        return dt.datetime.utcnow() - dt.timedelta(seconds=self.ttl)
+
+    @db_session
+    def get(self, db, key: str):
+        row = db.IdempotencyKey.get(key=key)
+        if row is None:
+            return None
+        if row.created_at < self._cutoff():
+            row.delete()
+            return None
+        return StoredResponse(row.request_hash, row.response.encode('utf-8'))
+
+    @db_session
+    def save(self, db, key: str, stored: StoredResponse):
+        db.IdempotencyKey(key=key, request_hash=stored.request_hash, response=stored.body.decode('utf-8'),
+                          created_at=dt.datetime.utcnow())
+        if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            cutoff = self._cutoff()
+            delete(k for k in db.IdempotencyKey if k.created_at < cutoff)
+
+
+def _new_store():
+    if c.IDEMPOTENCY_STORE == 'database':
+        return DatabaseStore(c.IDEMPOTENCY_TTL)
+    return MemoryStore(c.IDEMPOTENCY_CACHE_SIZE, c.IDEMPOTENCY_TTL)
+
+
+def warn_if_per_process(workers: int):
+    """
+    Logs a warning when several worker processes would each keep their own idempotency keys, so a retry reaching
+    another worker than the first request creates a second order.
+    :param workers: the number of worker processes serving the API.
+    :return: None
+    """
+    if workers > 1 and c.IDEMPOTENCY_STORE != 'database':
+        logger.warning('%s workers keep their own idempotency keys, set JUICE_SHOP_IDEMPOTENCY_STORE=database to '
+                       'share them', workers)
+
+
+_stores = WeakKeyDictionary()
+_stores_lock = Lock()
+
+
+def store_for(db):
+    """
+    Returns the idempotency store of a database, creating the one selected by IDEMPOTENCY_STORE on first use.
+    :param db: DB Connection
+    :return: a MemoryStore or a DatabaseStore
+    """
+    store = _stores.get(db)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(db, _new_store())
+    return store
+
+
+_key_locks = {}
+_key_locks_lock = Lock()
+
+
+@contextmanager
+def _key_lock(key: str):
+    """
+    Serializes the requests of this process sharing a key, so a retry arriving while the first attempt is still
+    running waits for its response.
+    """
+    with _key_locks_lock:
+        entry = _key_locks.setdefault(key, [Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+
+def _replay(stored: StoredResponse, digest: str, key: str) -> bytes:
+    if stored.request_hash != digest:
+        raise KeyReuseError("Unable to process the request - Idempotency-Key {} was used for another request".format(
+            key))
+    return stored.body
+
+
+@db_session
+def run_once(db, key: str, data: bytes, run) -> tuple:
+    """
+    Runs a request once per idempotency key, and commits it. A retry with the same key and body gets the response of
+    the first run, without running it again.
+    :param db: DB Connection
+    :param key: the Idempotency-Key sent by the client.
+    :param data: the request body.
+    :param run: a callable doing the request's writes and returning the response body, as bytes.
+    :return: a tuple with the response body and whether it was replayed
+    """
+    store = store_for(db)
+    digest = request_hash(data)
+    with _key_lock(key):
+        stored = store.get(db, key)
+        if stored is not None:
+            return _replay(stored, digest, key), True
+
+        body = run()
+        if not store.transactional:
+            commit()
+            store.save(db, key, StoredResponse(digest, body))
+            return body, False
+
+        try:
+            store.save(db, key, StoredResponse(digest, body))
+            commit()
+        except TransactionIntegrityError:
+            # another worker saved the key first: its response is kept and this run is rolled back
+            rollback()
+            stored = store.get(db, key)
+            if stored is None:
+                raise
+            return _replay(stored, digest, key), True
+
+    return body, False
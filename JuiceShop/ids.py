@@ -0,0 +1,63 @@
+import os
+import time
+from threading import Lock
+
+# Crockford's base32, as used by ULIDs: sorting the ids as strings sorts them by time
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+TIMESTAMP_BITS = 48
+RANDOM_BITS = 80
+ID_LENGTH = 26
+
+
+def encode(value: int, length: int = ID_LENGTH) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class UlidGenerator:
+    """
+    Generates ULIDs: a 48 bits millisecond timestamp followed by 80 random bits, 26 characters long. Ids generated in
+    the same millisecond by a process increment the random part, so they keep increasing. New rows are then appended
+    at the end of the payment id index instead of being scattered across it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def new(self, timestamp_ms: int = None) -> str:
+        """
+        :param timestamp_ms: milliseconds since the epoch, the current time by default.
+        :return: a new id
+        """
+        if timestamp_ms is None:
+            timestamp_ms = time.time_ns() // 1000000
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker must not continue the sequence of its parent, its siblings would repeat it
+                self._reset()
+            if timestamp_ms <= self._last_ms:
+                timestamp_ms = self._last_ms
+                random_part = self._last_random + 1
+                if random_part >> RANDOM_BITS:
+                    timestamp_ms, random_part = timestamp_ms + 1, int.from_bytes(os.urandom(10), 'big')
+            else:
+                random_part = int.from_bytes(os.urandom(10), 'big')
+            self._last_ms, self._last_random = timestamp_ms, random_part
+
+        return encode((timestamp_ms << RANDOM_BITS) | random_part)
+
+
+_generator = UlidGenerator()
+
+
+def new_payment_id(timestamp_ms: int = None) -> str:
+    return _generator.new(timestamp_ms)
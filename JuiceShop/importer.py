@@ -0,0 +1,153 @@
+import csv
+import io
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import catalog
+from JuiceShop.database import query
+
+SECTIONS = ('vitamins', 'fruits', 'liquids')
+# the CSV `type` column of each section
+CSV_TYPES = {'vitamin': 'vitamins', 'fruit': 'fruits', 'liquid': 'liquids'}
+
+
+def parse_csv(text: str) -> dict:
+    """
+    Reads a catalog from CSV, with the columns type, name, price, description, image and vitamins. Each row is a
+    vitamin, a fruit or a liquid, given by its type; the vitamins of a fruit are separated by semicolons.
+    :param text: the CSV document, with a header row.
+    :return: the catalog, as expected by import_catalog
+    """
+    received_catalog = {section: [] for section in SECTIONS}
+    for line, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+        section = CSV_TYPES.get((row.get('type') or '').strip().lower())
+        if section is None:
+            raise ValueError("Unable to import the catalog - line {} has an unknown type {!r}".format(
+                line, row.get('type')))
+        item = {'name': row.get('name'), 'description': row.get('description') or ''}
+        if section != 'vitamins':
+            item['price'] = row.get('price')
+            item['image'] = row.get('image') or ''
+        if section == 'fruits':
+            item['vitamins'] = [name.strip() for name in (row.get('vitamins') or '').split(';') if name.strip()]
+        received_catalog[section].append(item)
+    return received_catalog
+
+
+def _validate(received_catalog: dict) -> dict:
+    """
+    Checks the catalog before anything is written: every item needs a name, unique in its section, fruits and liquids
+    need a price from 0 to MAX_PRICE, and the vitamins of a fruit are a list of names.
+    :param received_catalog: the catalog payload.
+    :return: the items of each section, keyed by name
+    """
+    if not isinstance(received_catalog, dict):
+        raise ValueError("Unable to import the catalog - expected an object with {}".format(', '.join(SECTIONS)))
+
+    items = {}
+    for section in SECTIONS:
+        items[section] = {}
+        lower_names = set()
+        section_items = received_catalog.get(section) or []
+        if not isinstance(section_items, list):
+            raise ValueError("Unable to import the catalog - {} must be a list".format(section))
+        for position, item in enumerate(section_items):
+            name = item.get('name') if isinstance(item, dict) else None
+            if not name or not isinstance(name, str):
+                raise ValueError("Unable to import the catalog - {} #{} has no name".format(section, position + 1))
+            # fruit and liquid names are unique whatever their case, see models.define_entities
+            if name in items[section] or (section != 'vitamins' and name.lower() in lower_names):
+                raise ValueError("Unable to import the catalog - {} {!r} is duplicated".format(section, name))
+            lower_names.add(name.lower())
+            if not all(isinstance(item.get(field) or '', str) for field in ('description', 'image')):
+                raise ValueError("Unable to import the catalog - {} {!r} has an invalid description or image".format(
+                    section, name))
+            if section != 'vitamins':
+                try:
+                    price = float(item.get('price'))
+                except (TypeError, ValueError, OverflowError):
+                    price = None
+                # NaN and infinities fail the comparisons too
+                if price is None or not 0 <= price <= c.MAX_PRICE:
+                    raise ValueError("Unable to import the catalog - {} {!r} has an invalid price".format(
+                        section, name))
+                item = dict(item, price=c.stored_price(price))
+            if section == 'fruits':
+                vitamins = item.get('vitamins') or []
+                if not isinstance(vitamins, list) or not all(isinstance(vit_name, str) for vit_name in vitamins):
+                    raise ValueError("Unable to import the catalog - {} {!r} has invalid vitamins, expected a list of "
+                                     "names".format(section, name))
+            items[section][name] = item
+    return items
+
+
+def _upsert(entity, existing: dict, values_by_name: dict, summary: dict) -> dict:
+    """
+    Creates the items that don't exist and updates the ones that changed.
+    :param entity: the entity class.
+    :param existing: the entities already stored, keyed by name.
+    :param values_by_name: the attribute values of each item, keyed by name. Collections are given as sets.
+    :param summary: the counters of the section, updated in place.
+    :return: a dict with the entity of every item, keyed by name
+    """
+    entities = dict(existing)
+    for name, values in values_by_name.items():
+        current = existing.get(name)
+        if current is None:
+            entities[name] = entity(name=name, **values)
+            summary['inserted'] += 1
+        elif any((set(getattr(current, field)) if isinstance(value, set) else getattr(current, field)) != value
+                 for field, value in values.items()):
+            current.set(**values)
+            summary['updated'] += 1
+        else:
+            summary['skipped'] += 1
+    return entities
+
+
+def _values(item: dict, fields: tuple) -> dict:
+    return {field: item[field] if field == 'price' else item.get(field) or '' for field in fields}
+
+
+@db_session
+def import_catalog(db, received_catalog: dict) -> dict:
+    """
+    Inserts or updates the vitamins, fruits and liquids of a catalog. Names are resolved with one query per entity
+    type, whatever the size of the catalog, and nothing is written when the catalog is invalid. The vitamins of a
+    fruit are replaced by the ones listed in the catalog; vitamin names that don't exist are ignored and reported.
+    When called inside a db_session, the caller commits. The caller also invalidates the menu cache once committed.
+    :param db: DB Connection
+    :param received_catalog: a dict with lists of 'vitamins', 'fruits' and 'liquids'. Prices are given as in the API.
+    :return: a summary with the inserted, updated and skipped (unchanged) rows of each section, and the unknown
+    vitamins
+    """
+    items = _validate(received_catalog)
+    for section, lookup in (('fruits', query.get_fruits_by_lower_names), ('liquids', query.get_liquids_by_lower_names)):
+        conflicts = sorted(entity.name for entity in lookup(db, [name.lower() for name in items[section]])
+                           if entity.name not in items[section])
+        if conflicts:
+            raise ValueError("Unable to import the catalog - {} {} already exist with a different case".format(
+                section, ', '.join(map(repr, conflicts))))
+    summary = {section: {'inserted': 0, 'updated': 0, 'skipped': 0} for section in SECTIONS}
+
+    fruit_vitamin_names = {vit_name for fruit in items['fruits'].values() for vit_name in fruit.get('vitamins') or []}
+    vitamins = _upsert(db.Vitamin, query.get_vitamins_by_names(db, set(items['vitamins']) | fruit_vitamin_names),
+                       {name: _values(item, ('description',)) for name, item in items['vitamins'].items()},
+                       summary['vitamins'])
+
+    _upsert(db.Liquid, query.get_liquids_by_names(db, items['liquids']),
+            {name: _values(item, ('price', 'description', 'image')) for name, item in items['liquids'].items()},
+            summary['liquids'])
+
+    fruit_values = {}
+    for name, item in items['fruits'].items():
+        fruit_values[name] = _values(item, ('price', 'description', 'image'))
+        fruit_values[name]['vitamins'] = {vitamins[vit_name] for vit_name in item.get('vitamins') or []
+                                          if vit_name in vitamins}
+    _upsert(db.Fruit, query.get_fruits_with_vitamins_by_names(db, items['fruits']), fruit_values, summary['fruits'])
+
+    if any(summary[section]['inserted'] or summary[section]['updated'] for section in SECTIONS):
+        catalog.mark_changed(db)
+    summary['unknown_vitamins'] = sorted(fruit_vitamin_names - set(vitamins))
+    return summary
@@ -0,0 +1,228 @@
+import json
+import logging
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import Flask, current_app, g, has_request_context, request
+
+from JuiceShop.payloads import JSONProvider
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4'
+
+logger = logging.getLogger('juice_shop.requests')
+
+
+def _db_totals(db) -> tuple:
+    """
+    Reads the number of statements and the time spent in them by the current thread, as counted by Pony.
+    :param db: DB Connection
+    :return: a tuple with the statement count and the seconds spent.
+    """
+    stat = db.local_stats.get(None)
+    if stat is None or not stat.db_count:
+        return 0, 0.0
+    return stat.db_count, stat.sum_time
+
+
+class RequestMetrics:
+    """
+    Measures one request: the SQL statements run by the thread serving it, the time spent serializing JSON and the
+    time spent in the app.
+    """
+    __slots__ = ('db', 'started_at', 'queries_before', 'db_time_before', 'serialize_time')
+
+    def __init__(self, db):
+        self.db = db
+        self.started_at = time.perf_counter()
+        self.queries_before, self.db_time_before = _db_totals(db)
+        self.serialize_time = 0.0
+
+    def read(self) -> dict:
+        """
+        :return: a dict with the queries run so far and the db, serialize and handler times in seconds.
+        """
+        queries, db_time = _db_totals(self.db)
+        if queries < self.queries_before:
+            # Pony's local statistics were merged and reset during the request, they can't be compared anymore
+            queries, db_time = self.queries_before, self.db_time_before
+        return {
+            'queries': queries - self.queries_before,
+            'db': db_time - self.db_time_before,
+            'serialize': self.serialize_time,
+            'handler': time.perf_counter() - self.started_at,
+        }
+
+
+class Histogram:
+    """
+    A cumulative histogram, as exposed by Prometheus.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+        lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+METRICS = (
+    ('juice_shop_request_duration_seconds', 'handler', DURATION_BUCKETS,
+     'Time spent by the app on a request, from the first hook to the end of the db_session.'),
+    ('juice_shop_request_db_seconds', 'db', DURATION_BUCKETS, 'Time spent running SQL statements during a request.'),
+    ('juice_shop_request_serialize_seconds', 'serialize', DURATION_BUCKETS,
+     'Time spent serializing JSON responses during a request.'),
+    ('juice_shop_request_queries', 'queries', QUERY_BUCKETS, 'Number of SQL statements run by a request.'),
+)
+
+
+class MetricsRegistry:
+    """
+    Aggregates the request metrics of this process per route, method and status.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}
+        self._requests = {}
+
+    def observe(self, route: str, method: str, status: int, measures: dict):
+        with self._lock:
+            histograms = self._histograms.get((route, method))
+            if histograms is None:
+                histograms = self._histograms[(route, method)] = [Histogram(buckets) for _, _, buckets, _ in METRICS]
+            for histogram, (_, measure, _, _) in zip(histograms, METRICS):
+                histogram.observe(measures[measure])
+            self._requests[(route, method, status)] = self._requests.get((route, method, status), 0) + 1
+
+    def render(self) -> str:
+        """
+        :return: the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            lines = ['# HELP juice_shop_requests_total Requests served, by route, method and status.',
+                     '# TYPE juice_shop_requests_total counter']
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append('juice_shop_requests_total{{route="{}",method="{}",status="{}"}} {}'.format(
+                    route, method, status, count))
+            for i, (name, _, _, description) in enumerate(METRICS):
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for (route, method), histograms in sorted(self._histograms.items()):
+                    lines.extend(histograms[i].render(name, 'route="{}",method="{}"'.format(route, method)))
+        return '\n'.join(lines) + '\n'
+
+
+def _add_serialize_time(started_at: float):
+    # the provider is also used without a request, by the test client for instance
+    metrics = g.get('request_metrics') if has_request_context() else None
+    if metrics is not None:
+        metrics.serialize_time += time.perf_counter() - started_at
+
+
+class TimedJSONProvider(JSONProvider):
+    """
+    The app's JSON provider, adding the time spent in dumps and jsonify to the metrics of the current request.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        started_at = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add_serialize_time(started_at)
+
+    def response(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            _add_serialize_time(started_at)
+
+
+def server_timing(measures: dict) -> str:
+    return 'db;dur={:.3f};desc="{} queries", serialize;dur={:.3f}, handler;dur={:.3f}'.format(
+        measures['db'] * 1000, measures['queries'], measures['serialize'] * 1000, measures['handler'] * 1000)
+
+
+def _route() -> str:
+    # the URL rule instead of the path, so every order payment id doesn't become a separate series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class Instrumentation:
+    """
+    Measures every request of a Flask app. Like pony.flask.Pony, it is an extension registering request hooks; it must
+    be registered before Pony so its teardown runs after the db_session is committed.
+    """
+
+    def __init__(self, app: Flask = None, get_db=None):
+        """
+        :param app: the app to be instrumented.
+        :param get_db: a callable returning the database bound to the app, called in each request.
+        """
+        self.get_db = get_db
+        self.registry = MetricsRegistry()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._start)
+        app.after_request(self._add_server_timing)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.metrics, methods=['GET'])
+        app.extensions['instrumentation'] = self
+
+    def _start(self):
+        g.request_metrics = RequestMetrics(self.get_db())
+
+    def _add_server_timing(self, response):
+        # the db_session is still open: statements run by its commit are only counted in the log and /metrics
+        metrics = g.get('request_metrics')
+        if metrics is not None:
+            g.response_status = response.status_code
+            response.headers['Server-Timing'] = server_timing(metrics.read())
+        return response
+
+    def _finish(self, exception):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return
+        measures = metrics.read()
+        status = 500 if exception is not None else g.pop('response_status', None)
+        route = _route()
+        self.registry.observe(route, request.method, status, measures)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method,
+                'route': route,
+                'path': request.path,
+                'status': status,
+                'queries': measures['queries'],
+                'db_ms': round(measures['db'] * 1000, 3),
+                'serialize_ms': round(measures['serialize'] * 1000, 3),
+                'handler_ms': round(measures['handler'] * 1000, 3),
+            }))
+
+    def metrics(self):
+        return current_app.response_class(self.registry.render(), mimetype=PROMETHEUS_MIMETYPE)
@@ -1,96 +1,222 @@
 import datetime as dt
-import json
-import uuid
+import time
 from http import HTTPStatus
+from threading import BoundedSemaphore, Lock
 
-from flask import Flask, jsonify, make_response, request
+from flask import Blueprint, Flask, current_app, jsonify, make_response, request
 from pony.flask import Pony
+from pony.orm import commit, db_session, rollback
 
+import JuiceShop
 import JuiceShop.common as c
+from JuiceShop import (analytics, archive, catalog, group_commit, idempotency, ids, importer, notifications, orders,
+                       payloads)
+from JuiceShop.instrumentation import Instrumentation
 from JuiceShop.database import models, query
 
-app = Flask(__name__)
-Pony(app)
+api = Blueprint('api', __name__)
 
-db = models.define_db(**c.DB_CONFIG)
+# Bound on the first request, or explicitly by bind_db() in a launcher before forking workers.
+db = None
+# Bound before the first request reading archived orders, outside of its db_session.
+archive_db = None
+_db_lock = Lock()
+# the databases bound by bind_db and bind_archive_db, with the settings they were bound from
+_bound_db_config = (None, None)
+_bound_archive_db_config = (None, None)
+# threads of this process held by GET requests waiting for a payment
+_waiting_threads = BoundedSemaphore(c.ORDER_MAX_WAITING_THREADS)
+
+
+def bind_db(flask_app: Flask = None):
+    """
+    Binds the database configured in the app, once per process. The tables are only created, and checked, when the
+    DB_CREATE_TABLES setting is on. A process serves a single database: an app configured with another DB_CONFIG than
+    the bound one raises an exception instead of silently using it.
+    :param flask_app: the app whose configuration is used, by default the current app.
+    :return: the bound database
+    """
+    global db, _bound_db_config
+    flask_app = flask_app or current_app
+    if db is not None:
+        _check_config(_bound_db_config, db, flask_app.config, 'DB_CONFIG')
+        return db
+
+    with _db_lock:
+        if db is None:
+            db = models.define_db(create_tables=flask_app.config['DB_CREATE_TABLES'], **flask_app.config['DB_CONFIG'])
+            _bound_db_config = (db, flask_app.config['DB_CONFIG'])
+            snapshot_path = catalog.snapshot_file(db) if flask_app.config['CATALOG_SHARED'] else None
+            if snapshot_path:
+                catalog.share(db, snapshot_path)
+            events_path = notifications.events_file(db) if flask_app.config['PAYMENT_EVENTS_SHARED'] else None
+            if events_path:
+                notifications.payment_events.share(events_path)
+            flask_app.config['IMPORT_TO_READY_SECONDS'] = time.perf_counter() - JuiceShop.IMPORT_STARTED_AT
+            flask_app.logger.info('Database bound, %.1f ms from import to ready',
+                                  flask_app.config['IMPORT_TO_READY_SECONDS'] * 1000)
+
+    _check_config(_bound_db_config, db, flask_app.config, 'DB_CONFIG')
+    return db
+
+
+def _check_config(bound: tuple, current_db, app_config, setting: str):
+    bound_db, bound_config = bound
+    config = app_config[setting]
+    # only a database bound by this module is checked, not one set on the module directly
+    if bound_db is current_db and config is not bound_config and config != bound_config:
+        raise Exception("Unable to bind the database - this process already serves the database of another {}".format(
+            setting))
+
+
+def bind_archive_db(flask_app: Flask = None):
+    """
+    Binds the archive database configured in the app, once per process. As with bind_db, an app configured with
+    another ARCHIVE_DB_CONFIG than the bound one raises an exception.
+    :param flask_app: the app whose configuration is used, by default the current app.
+    :return: the bound archive database
+    """
+    global archive_db, _bound_archive_db_config
+    flask_app = flask_app or current_app
+    if archive_db is not None:
+        _check_config(_bound_archive_db_config, archive_db, flask_app.config, 'ARCHIVE_DB_CONFIG')
+        return archive_db
+
+    with _db_lock:
+        if archive_db is None:
+            archive_db = archive.define_archive_db(flask_app.config['ARCHIVE_DB_CONFIG'])
+            _bound_archive_db_config = (archive_db, flask_app.config['ARCHIVE_DB_CONFIG'])
+
+    _check_config(_bound_archive_db_config, archive_db, flask_app.config, 'ARCHIVE_DB_CONFIG')
+    return archive_db
+
+
+def _bind_db_before_request():
+    bind_db()
+    # binding upgrades the archive tables, which Pony refuses inside the request's db_session
+    if archive_requested():
+        bind_archive_db()
+
+
+def _get_db():
+    return db
+
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Creates the Flask app. The database is not touched here, it is bound lazily by bind_db(), once per process: every
+    app of a process must have the same DB_CONFIG and ARCHIVE_DB_CONFIG.
+    :param config: settings overriding the defaults, DB_CONFIG, DB_CREATE_TABLES, ARCHIVE_DB_CONFIG, CATALOG_SHARED,
+    PAYMENT_EVENTS_SHARED, GROUP_COMMIT and INSTRUMENTATION.
+    :return: the Flask app
+    """
+    new_app = Flask(__name__)
+    new_app.config.update(DB_CONFIG=c.DB_CONFIG, DB_CREATE_TABLES=c.DB_CREATE_TABLES,
+                          ARCHIVE_DB_CONFIG=c.ARCHIVE_DB_CONFIG, CATALOG_SHARED=c.CATALOG_SHARED,
+                          PAYMENT_EVENTS_SHARED=c.PAYMENT_EVENTS_SHARED, GROUP_COMMIT=c.GROUP_COMMIT,
+                          INSTRUMENTATION=c.INSTRUMENTATION, MAX_CONTENT_LENGTH=c.CATALOG_IMPORT_MAX_SIZE)
+    new_app.config.update(config or {})
+    new_app.json = payloads.JSONProvider(new_app)
+
+    new_app.register_blueprint(api)
+    # registered before Pony, so the database is bound before the request's db_session starts
+    new_app.before_request(_bind_db_before_request)
+    if new_app.config['INSTRUMENTATION']:
+        Instrumentation(new_app, _get_db)
+    Pony(new_app)
+
+    return new_app
 
 
 def generate_uuid() -> str:
-    return uuid.uuid4().hex[0:10]
+    """
+    Generates the payment id of a new order, a time-ordered ULID.
+    :return: the payment id
+    """
+    return ids.new_payment_id()
 
 
 def current_datetime() -> dt.datetime:
     return dt.datetime.utcnow()
 
 
-@app.route(c.API_VERSION + '/fruits', methods=['GET'])
+def archive_requested() -> bool:
+    return request.args.get('archive') in ('1', 'true')
+
+
+@api.errorhandler(payloads.PayloadError)
+def invalid_payload(error: payloads.PayloadError):
+    return make_response(str(error), HTTPStatus.BAD_REQUEST)
+
+
+def json_bytes_response(body: bytes):
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def catalog_response(menu: str):
+    """
+    Creates the response of a catalog endpoint. When the client already has the current catalog version, it answers
+    HTTP 304 without touching the database or the snapshot.
+    :param menu: the MenuSnapshot field to be returned, 'fruits' or 'liquids'.
+    :return: the response with the ETag and Cache-Control headers
+    """
+    menu_cache = catalog.menu_cache(db)
+    menu_cache.check(db)
+    if request.if_none_match.contains(menu_cache.etag):
+        response = current_app.response_class(status=HTTPStatus.NOT_MODIFIED)
+        response.set_etag(menu_cache.etag)
+    else:
+        snapshot = menu_cache.snapshot(db)
+        response = json_bytes_response(getattr(snapshot, menu))
+        response.set_etag(snapshot.etag)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = c.CATALOG_MAX_AGE
+    return response
+
+
+@api.route(c.API_VERSION + '/fruits', methods=['GET'])
 def list_fruits():
     """
     This function returns all fruits available. It combines the vitamins associated to each fruit.
     :return: json with all fruits stored in our DB with the associated vitamin.
     """
-    response_dict = {'fruits': []}
-    all_fruits = query.get_all_fruits(db)
-
-    for fruit in all_fruits:
-        fruit_vitamin = fruit.vitamins
-        response_dict['fruits'].append({
-            'name': fruit.name,
-            'price': fruit.price / c.PRICE_DIVISOR,
-            'description': fruit.description,
-            'image': fruit.image,
-            'vitamins': [
-                {
-                    'name': v.name,
-                    'description': v.description,
-                } for v in fruit_vitamin
-            ]
-        })
+    return catalog_response('fruits')
 
-    return jsonify(response_dict)
 
-
-@app.route(c.API_VERSION + '/liquids', methods=['GET'])
+@api.route(c.API_VERSION + '/liquids', methods=['GET'])
 def list_liquids():
     """
     This function returns all liquids available.
     :return:
     """
-    response_dict = {'liquids': []}
-    all_liquids = query.get_all_liquids(db)
-
-    for liquid in all_liquids:
-        response_dict['liquids'].append({
-            'name': liquid.name,
-            'price': liquid.price / c.PRICE_DIVISOR,
-            'description': liquid.description,
-            'image': liquid.image
-        })
-
-    return jsonify(response_dict)
+    return catalog_response('liquids')
 
 
-@app.route(c.API_VERSION + '/fruits/store', methods=['PUT'])
+@api.route(c.API_VERSION + '/fruits/store', methods=['PUT'])
 def store_new_fruit():
     """
     This endpoint is used to store / update fruits to database.
-    :return: a JSON with the created or updated fruit
+    :return: a JSON with the created or updated fruit, or HTTP 409 when the name only differs by case from an existing
+    fruit.
     """
-    received_fruit = json.loads(request.data)
+    received_fruit = payloads.decode(payloads.FRUIT)
 
-    new_fruit = query.get_fruit_by_name(db, received_fruit['name'].lower())
+    new_fruit = query.get_fruit_by_name(db, received_fruit['name'])
     if new_fruit is None:
+        if query.get_fruits_by_lower_names(db, [received_fruit['name'].lower()]):
+            return make_response("Fruit name already exists with a different case", HTTPStatus.CONFLICT)
         new_fruit = db.Fruit(name=received_fruit['name'],
-                             price=int(received_fruit['price'] * c.PRICE_DIVISOR),
+                             price=c.stored_price(received_fruit['price']),
                              description=received_fruit['description'],
                              image=received_fruit['image']
                              )
     else:
-        new_fruit(name=received_fruit['name'],
-                  price=int(received_fruit['price'] * c.PRICE_DIVISOR),
-                  description=received_fruit['description'],
-                  image=received_fruit['image']
-                  )
+        new_fruit.set(name=received_fruit['name'],
+                      price=c.stored_price(received_fruit['price']),
+                      description=received_fruit['description'],
+                      image=received_fruit['image']
+                      )
 
     for vit_name in received_fruit['vitamins']:
         vitamin = query.get_vitamin_by_name(db, vit_name)
@@ -98,153 +224,315 @@ def store_new_fruit():
             continue
         new_fruit.vitamins.add(vitamin)
 
-    return jsonify(c.fruit_to_dict(new_fruit))
+    catalog.mark_changed(db)
+    commit()
+    catalog.invalidate(db)
 
+    return jsonify(c.fruit_to_dict(query.get_fruit_records(db, [new_fruit.name])[0]))
 
-@app.route(c.API_VERSION + '/liquids/store', methods=['PUT'])
+
+@api.route(c.API_VERSION + '/liquids/store', methods=['PUT'])
 def store_new_liquid():
     """
     This endpoint is used to store new liquids to database.
-    :return: a JSON with the created liquid, or HTTP 409 when liquids name already exists.
+    :return: a JSON with the created or updated liquid, or HTTP 409 when the name only differs by case from an existing
+    liquid.
     """
-    received_liquid = json.loads(request.data)
+    received_liquid = payloads.decode(payloads.LIQUID)
 
-    new_liquid = query.get_liquid_by_name(db, received_liquid['name'].lower())
+    new_liquid = query.get_liquid_by_name(db, received_liquid['name'])
     if new_liquid is None:
-        new_liquid = db.Fruit(name=received_liquid['name'],
-                              price=int(received_liquid['price'] * c.PRICE_DIVISOR),
-                              description=received_liquid['description'],
-                              image=received_liquid['image']
-                              )
+        if query.get_liquids_by_lower_names(db, [received_liquid['name'].lower()]):
+            return make_response("Liquid name already exists with a different case", HTTPStatus.CONFLICT)
+        new_liquid = db.Liquid(name=received_liquid['name'],
+                               price=c.stored_price(received_liquid['price']),
+                               description=received_liquid['description'],
+                               image=received_liquid['image']
+                               )
     else:
-        new_liquid(name=received_liquid['name'],
-                   price=int(received_liquid['price'] * c.PRICE_DIVISOR),
-                   description=received_liquid['description'],
-                   image=received_liquid['image']
-                   )
+        new_liquid.set(name=received_liquid['name'],
+                       price=c.stored_price(received_liquid['price']),
+                       description=received_liquid['description'],
+                       image=received_liquid['image']
+                       )
+
+    catalog.mark_changed(db)
+    commit()
+    catalog.invalidate(db)
 
-    return jsonify(c.liquid_to_dict(new_liquid))
+    return jsonify(c.liquid_to_dict(query.get_liquid_records(db, [new_liquid.name])[0]))
 
 
-@app.route(c.API_VERSION + '/juices', methods=['GET'])
+@api.route(c.API_VERSION + '/catalog/import', methods=['PUT'])
+def import_catalog():
+    """
+    This endpoint is used to store / update many vitamins, fruits and liquids at once, in a single transaction. The
+    catalog is sent as JSON, or as CSV with the `text/csv` content type.
+    :return: a JSON with the inserted, updated and skipped rows of each entity type, or HTTP 400 when the catalog is
+    invalid.
+    """
+    try:
+        if request.mimetype == 'text/csv':
+            received_catalog = importer.parse_csv(payloads.read_body(c.CATALOG_IMPORT_MAX_SIZE).decode('utf-8'))
+        else:
+            received_catalog = payloads.decode(None, c.CATALOG_IMPORT_MAX_SIZE)
+        summary = importer.import_catalog(db, received_catalog)
+    except ValueError as e:
+        return make_response(str(e), HTTPStatus.BAD_REQUEST)
+
+    commit()
+    catalog.invalidate(db)
+
+    return jsonify(summary)
+
+
+def load_juices_page(database, after: int, limit: int, since: dt.datetime = None) -> list:
+    """
+    Loads a page of ordered juices with a fixed number of queries, whatever the page size.
+    :param database: DB Connection
+    :param after: only juices with an id greater than this one are loaded
+    :param limit: maximum number of juices in the page
+    :param since: when given, only juices ordered at or after this datetime are loaded
+    :return: a list with the juices as dicts
+    """
+    juice_rows = query.get_juices_page(database, after, limit, since)
+    if not juice_rows:
+        return []
+
+    fruits_by_juice = {}
+    for juice_id, name, price in query.get_juice_fruits(database, [juice_row[0] for juice_row in juice_rows]):
+        fruits_by_juice.setdefault(juice_id, []).append((name, price))
+
+    return [c.juice_row_to_dict(juice_row, fruits_by_juice.get(juice_row[0], [])) for juice_row in juice_rows]
+
+
+def stream_juices(database, after: int, since: dt.datetime = None):
+    """
+    Generates one JSON line per juice, reading the juices in chunks of JUICES_EXPORT_CHUNK_SIZE. Each chunk runs in
+    its own db_session, so no session or transaction is held while the client reads the response.
+    :param database: DB Connection
+    :param after: only juices with an id greater than this one are exported
+    :param since: when given, only juices ordered at or after this datetime are exported
+    :return: a generator of JSON lines
+    """
+    while True:
+        with db_session:
+            juices = load_juices_page(database, after, c.JUICES_EXPORT_CHUNK_SIZE, since)
+        for juice in juices:
+            yield c.to_json_bytes(juice)
+        if len(juices) < c.JUICES_EXPORT_CHUNK_SIZE:
+            return
+        after = juices[-1]['id']
+
+
+@api.route(c.API_VERSION + '/juices', methods=['GET'])
 def get_juices():
     """
-    This endpoint returns all the juices ordered. The shop owner can use this endpoint for further analyses.
-    :return: a JSON with all juices ordered.
-    """
-    response_dict = {'juices': []}
-
-    all_juices = query.get_all_juices(db)
-    for juice in all_juices:
-        response_dict['juices'].append({
-            'id': juice.id,
-            'price': juice.price / c.PRICE_DIVISOR,
-            'fruits': [
-                {
-                    'name': f.name,
-                    'price': f.price / c.PRICE_DIVISOR,
-                } for f in juice.fruits
-            ],
-            'liquid': {
-                'name': juice.liquid.name,
-                'price': juice.liquid.price / c.PRICE_DIVISOR
-            },
-            'order_datetime': juice.order.order_at,
-            'order_total': juice.order.price / c.PRICE_DIVISOR
-        })
-
-    return jsonify(response_dict)
-
-
-@app.route(c.API_VERSION + '/order', methods=['POST'])
+    This endpoint returns the juices ordered, one page at a time. The shop owner can use this endpoint for further
+    analyses. Pages are ordered by juice id; the `next_after` value of a page is passed as `after` to get the next one.
+    When the client accepts `application/x-ndjson`, every juice after `after` is streamed instead, one JSON per line.
+    With `archive=1`, the juices of archived orders are returned instead.
+    :return: a JSON with a page of juices ordered.
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', c.JUICES_PAGE_SIZE))
+        since = c.parse_datetime(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        return make_response('Invalid pagination parameters', HTTPStatus.BAD_REQUEST)
+    if after < 0 or not 0 < limit <= c.JUICES_MAX_PAGE_SIZE:
+        return make_response('Invalid pagination parameters', HTTPStatus.BAD_REQUEST)
+
+    database = bind_archive_db() if archive_requested() else db
+    if request.accept_mimetypes.best_match(['application/json', c.NDJSON_MIMETYPE]) == c.NDJSON_MIMETYPE:
+        return current_app.response_class(stream_juices(database, after, since), mimetype=c.NDJSON_MIMETYPE)
+
+    juices = load_juices_page(database, after, limit, since)
+
+    return jsonify({
+        'juices': juices,
+        'next_after': juices[-1]['id'] if len(juices) == limit else None
+    })
+
+
+def analytics_range() -> dict:
+    """
+    Reads the since, until and period parameters shared by the analytics endpoints.
+    :return: the keyword arguments of the analytics queries, raises ValueError when a parameter is invalid
+    """
+    period = request.args.get('period', 'day')
+    if period not in analytics.PERIODS:
+        raise ValueError(period)
+    return {
+        'period': period,
+        'since': c.parse_datetime(request.args['since']) if 'since' in request.args else None,
+        'until': c.parse_datetime(request.args['until']) if 'until' in request.args else None,
+    }
+
+
+@api.route(c.API_VERSION + '/analytics/combinations', methods=['GET'])
+def get_top_combinations():
+    """
+    This endpoint returns the best selling fruit combinations between `since` and `until`. It reads the daily rollups,
+    or the hourly ones with `period=hour`, so its cost doesn't grow with the number of orders.
+    :return: a JSON with the combinations, their juices sold and revenue.
+    """
+    try:
+        kwargs = analytics_range()
+        limit = int(request.args.get('limit', c.ANALYTICS_TOP_SIZE))
+    except ValueError:
+        return make_response('Invalid analytics parameters', HTTPStatus.BAD_REQUEST)
+    if not 0 < limit <= c.ANALYTICS_MAX_TOP_SIZE:
+        return make_response('Invalid analytics parameters', HTTPStatus.BAD_REQUEST)
+
+    return jsonify({'combinations': analytics.top_combinations(db, limit=limit, **kwargs)})
+
+
+@api.route(c.API_VERSION + '/analytics/revenue', methods=['GET'])
+def get_revenue():
+    """
+    This endpoint returns the juices sold and the revenue of each liquid, or each fruit with `by=fruit`, per day or per
+    hour with `period=hour`.
+    :return: a JSON with the revenue of each bucket and ingredient.
+    """
+    by = request.args.get('by', 'liquid')
+    try:
+        kwargs = analytics_range()
+    except ValueError:
+        return make_response('Invalid analytics parameters', HTTPStatus.BAD_REQUEST)
+    if by not in ('liquid', 'fruit'):
+        return make_response('Invalid analytics parameters', HTTPStatus.BAD_REQUEST)
+
+    return jsonify({'revenue': analytics.revenue(db, by, **kwargs)})
+
+
+@api.route(c.API_VERSION + '/analytics/payments', methods=['GET'])
+def get_payments():
+    """
+    This endpoint returns the orders, how many of them are paid, and the revenue, per day or per hour with
+    `period=hour`, and in total.
+    :return: a JSON with the payments of each bucket and the totals.
+    """
+    try:
+        kwargs = analytics_range()
+    except ValueError:
+        return make_response('Invalid analytics parameters', HTTPStatus.BAD_REQUEST)
+
+    return jsonify(analytics.payments(db, **kwargs))
+
+
+def place_order(received_order: dict, group: bool = True):
+    """
+    Creates an order with a new payment id. With the GROUP_COMMIT setting, the order is created and committed by the
+    order writer, with the orders of concurrent requests; otherwise it is committed with the request.
+    :param received_order: the validated order payload.
+    :param group: whether the order can be committed by the order writer.
+    :return: the OrderRecord of the new order
+    """
+    if group and current_app.config['GROUP_COMMIT']:
+        return group_commit.order_writer(db).create_order(received_order, generate_uuid(), current_datetime())
+    new_order = orders.create_order(db, received_order, payment_id=generate_uuid(), order_at=current_datetime())
+    return query.order_record(new_order)
+
+
+@api.route(c.API_VERSION + '/order', methods=['POST'])
 def receive_order():
     """
     This endpoint receives a JSON with an order. The order should contain a list of Juices. The order cost is calculated
-    and returned a payment id and the order details.
-    :return: A JSON with the order created and the payment id.
-    """
-    received_order = json.loads(request.data)
-    new_order = db.Order(
-        payment_id=generate_uuid(),
-        order_at=current_datetime(),
-        is_paid=False
-    )
-
-    order_price = 0
-    for juice in received_order['order']:
-        juice_price = 0
-        new_juice = db.Juice()
-        for fruit_name in juice['fruits']:
-            fruit = query.get_fruit_by_name(db, fruit_name)
-            if fruit is None:
-                continue
-            new_juice.fruits.add(fruit)
-            juice_price += fruit.price
-        liquid = query.get_liquid_by_name(db, juice['liquid'])
-        if liquid is None:
-            continue
-        new_juice.liquid = liquid
-        juice_price += liquid.price
-        new_juice.price = juice_price
-        new_juice.order = new_order
-        order_price += juice_price
-    new_order.price = order_price
+    and returned a payment id and the order details. When the request has an `Idempotency-Key` header, a retry with
+    the same key gets the response of the first request instead of creating another order.
+    :return: A JSON with the order created and the payment id, or HTTP 422 when the key was used for another order.
+    """
+    received_order = payloads.decode(payloads.ORDER)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is None:
+        return jsonify(c.order_to_dict(place_order(received_order)))
+
+    if not 0 < len(idempotency_key) <= c.IDEMPOTENCY_KEY_MAX_LENGTH:
+        return make_response('Invalid Idempotency-Key', HTTPStatus.BAD_REQUEST)
+
+    def create():
+        # a key kept in the database is committed with its order, so the order can't be committed apart by the writer
+        group = not idempotency.store_for(db).transactional
+        return c.to_json_bytes(c.order_to_dict(place_order(received_order, group)))
+
+    try:
+        body, replayed = idempotency.run_once(db, idempotency_key, request.data, create)
+    except idempotency.KeyReuseError as e:
+        return make_response(str(e), HTTPStatus.UNPROCESSABLE_ENTITY)
 
-    return jsonify(c.order_to_dict(new_order))
+    response = json_bytes_response(body)
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
 
 
-@app.route(c.API_VERSION + '/order/<string:payment_id>', methods=['PUT', 'GET'])
+@api.route(c.API_VERSION + '/order/<string:payment_id>', methods=['PUT', 'GET'])
 def update_payment_status(payment_id):
     """
-    This endpoint is used to update and retrieve an order payment status.
+    This endpoint is used to update and retrieve an order payment status. With `?wait=N`, a GET of an unpaid order
+    waits up to N seconds for its payment status to be updated before answering, unless ORDER_MAX_WAITING_THREADS
+    requests of the process are already waiting. With `archive=1`, a GET also looks for the order in the archive.
     :return: a JSON with the payment status. If the order doesn't exist, it returns an HTTP Error 404.
     """
     if request.method == 'PUT':
-        received_payment = json.loads(request.data)
+        received_payment = payloads.decode(payloads.PAYMENT)
         order_to_update = query.get_order_by_payment_id(db, payment_id)
         if order_to_update is None:
             response = make_response('Resource not found', HTTPStatus.NOT_FOUND)
             return response
+        was_paid = order_to_update.is_paid
         order_to_update.is_paid = received_payment['is_paid']
-        return jsonify(c.order_to_dict(order_to_update))
-
-    requested_order = db.Order.get(payment_id=payment_id)
-    if requested_order is None:
-        response = make_response('Resource not found', HTTPStatus.NOT_FOUND)
-        return response
+        analytics.record_payment(db, order_to_update.order_at, order_to_update.price or 0, was_paid,
+                                 order_to_update.is_paid)
+        commit()
+        notifications.payment_events.publish(payment_id, order_to_update.is_paid)
+        return jsonify(c.order_to_dict(query.order_record(order_to_update)))
+
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return make_response('Invalid wait parameter', HTTPStatus.BAD_REQUEST)
+    if not 0 <= wait <= c.ORDER_MAX_WAIT:
+        return make_response('Invalid wait parameter', HTTPStatus.BAD_REQUEST)
+
+    # subscribed before reading the order, so an update committed in between is not missed
+    with notifications.payment_events.listen(payment_id) as listener:
+        requested_order = query.get_order_record(db, payment_id)
+        if requested_order is None and archive_requested():
+            # archived orders are paid, so they are never waited for
+            requested_order = query.get_order_record(bind_archive_db(), payment_id)
+        if requested_order is None:
+            response = make_response('Resource not found', HTTPStatus.NOT_FOUND)
+            return response
+        if wait and not requested_order.is_paid and _waiting_threads.acquire(blocking=False):
+            try:
+                # nothing was written: the transaction is closed so no connection is held while waiting
+                rollback()
+                listener.wait(wait)
+            finally:
+                _waiting_threads.release()
+            requested_order = query.get_order_record(db, payment_id)
 
     return jsonify(c.order_to_dict(requested_order))
 
 
-@app.route(c.API_VERSION + '/juice/description', methods=['POST'])
+@api.route(c.API_VERSION + '/juice/description', methods=['POST'])
 def get_juice_description():
     """
     This endpoint returns a JSON with the description of each ingredient of a juice. The description also gives a
-    list of the Vitamins and its benefits.
-    :return: JSON with a description of a juice ingredients and benefits.
-    """
-    juice_ingredients = json.loads(request.data)
-    juice_descr = {
-        'fruits': [],
-        'vitamins': [],
-        'liquid': {}
-    }
+    list of the Vitamins and its benefits. Descriptions are cached by ingredients until the catalog changes.
+    :return: JSON with a description of a juice ingredients and benefits. If an ingredient doesn't exist, it returns an
+    HTTP Error 404.
+    """
+    juice_ingredients = payloads.decode(payloads.JUICE)
+
+    juice_descr = catalog.juice_description(db, juice_ingredients['fruits'], juice_ingredients['liquid'])
+    if juice_descr is None:
+        response = make_response('Resource not found', HTTPStatus.NOT_FOUND)
+        return response
+
+    return json_bytes_response(juice_descr)
 
-    for fruit_name in juice_ingredients['fruits']:
-        fruit = query.get_fruit_by_name(db, fruit_name)
-        juice_descr['fruits'].append({
-            'name': fruit.name,
-            'description': fruit.description
-        })
-        for vitamin in fruit.vitamins:
-            juice_descr['vitamins'].append({
-                'name': vitamin.name,
-                'description': vitamin.description
-            })
-    juice_liquid = query.get_liquid_by_name(db, juice_ingredients['liquid'])
-    juice_descr['liquid'] = {
-        'name': juice_liquid.name,
-        'description': juice_liquid.description
-    }
 
-    return jsonify(juice_descr)
+app = create_app()
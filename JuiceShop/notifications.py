@@ -0,0 +1,184 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+import JuiceShop.common as c
+
+COUNTER = struct.Struct('<Q')
+
+
+class Listener:
+    """
+    Receives the messages published on one key, for a thread waiting on them.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self.message = None
+
+    def __call__(self, message):
+        self.message = message
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until a message is published or the timeout expires.
+        :param timeout: seconds to wait.
+        :return: whether a message was published
+        """
+        return self._event.wait(timeout)
+
+
+class SharedSignals:
+    """
+    Counters shared by the processes of a box through a memory-mapped file. A key is hashed to one of `slots` counters,
+    incremented when something is published on it; reading it is a memory read. Keys sharing a slot only cause a
+    spurious notification.
+    """
+
+    def __init__(self, path: str, slots: int = c.PAYMENT_EVENTS_SLOTS):
+        self.path = path
+        self.slots = slots
+        size = slots * COUNTER.size
+        with open(path, 'a+b') as signals_file:
+            if os.fstat(signals_file.fileno()).st_size < size:
+                # the new counters read as 0
+                signals_file.truncate(size)
+            self._counters = mmap.mmap(signals_file.fileno(), size)
+
+    def _offset(self, key: str) -> int:
+        # crc32 rather than hash(), which differs between processes
+        return zlib.crc32(key.encode('utf-8')) % self.slots * COUNTER.size
+
+    def read(self, key: str) -> int:
+        return COUNTER.unpack_from(self._counters, self._offset(key))[0]
+
+    def increment(self, key: str) -> int:
+        # not atomic: two processes incrementing at once may write the same value, which still differs from the one
+        # their waiters read
+        offset = self._offset(key)
+        counter = (COUNTER.unpack_from(self._counters, offset)[0] + 1) % (1 << 64)
+        COUNTER.pack_into(self._counters, offset, counter)
+        return counter
+
+
+class PubSub:
+    """
+    Publish/subscribe, keyed by a string. Subscribers are callbacks, called in the publishing thread, so a thread can
+    wait on a Listener and an event loop can wrap a callback resolving a future. Once shared, publishing also signals
+    the key to the other processes sharing the file, whose subscribers are called, with None as message, by a watcher
+    thread polling the signals every PAYMENT_EVENTS_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._subscribers = {}
+        self.signals = None
+        # the signal counter of each subscribed key when it was last notified
+        self._seen = {}
+        self._watcher_pid = None
+
+    def share(self, path: str):
+        """
+        Shares the published keys with the other processes using the same file.
+        :param path: the signals file, as returned by events_file.
+        :return: None
+        """
+        with self._lock:
+            if self.signals is None or self.signals.path != path:
+                self.signals = SharedSignals(path)
+                self._seen = {key: self.signals.read(key) for key in self._subscribers}
+
+    def subscribe(self, key: str, callback):
+        with self._lock:
+            self._subscribers.setdefault(key, []).append(callback)
+            if self.signals is not None:
+                self._seen.setdefault(key, self.signals.read(key))
+                if self._watcher_pid != os.getpid():
+                    # started on first use, and again in a forked worker, where the thread of its parent doesn't exist
+                    self._watcher_pid = os.getpid()
+                    Thread(target=self._watch, name='juice-shop-events', daemon=True).start()
+
+    def unsubscribe(self, key: str, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(key)
+            if callbacks is None:
+                return
+            try:
+                callbacks.remove(callback)
+            except ValueError:
+                pass
+            if not callbacks:
+                del self._subscribers[key]
+                self._seen.pop(key, None)
+
+    def publish(self, key: str, message) -> int:
+        """
+        Calls every callback subscribed to a key.
+        :param key: the key the message is published on.
+        :param message: the message passed to the callbacks.
+        :return: the number of callbacks called
+        """
+        with self._lock:
+            callbacks = list(self._subscribers.get(key, ()))
+            if self.signals is not None:
+                counter = self.signals.increment(key)
+                if key in self._seen:
+                    # the subscribers of this process are called here, not again by the watcher
+                    self._seen[key] = counter
+        for callback in callbacks:
+            callback(message)
+        return len(callbacks)
+
+    def _watch(self):
+        while True:
+            time.sleep(c.PAYMENT_EVENTS_POLL_INTERVAL)
+            signalled = []
+            with self._lock:
+                for key, seen in self._seen.items():
+                    counter = self.signals.read(key)
+                    if counter != seen:
+                        self._seen[key] = counter
+                        signalled.append((key, list(self._subscribers.get(key, ()))))
+            for key, callbacks in signalled:
+                for callback in callbacks:
+                    callback(None)
+
+    @contextmanager
+    def listen(self, key: str):
+        """
+        Subscribes a Listener to a key for the duration of a with block.
+        :param key: the key to listen to.
+        :return: the listener
+        """
+        listener = Listener()
+        self.subscribe(key, listener)
+        try:
+            yield listener
+        finally:
+            self.unsubscribe(key, listener)
+
+
+def events_file(db):
+    """
+    Returns the path of the signals file shared by the processes serving a database: next to the SQLite file, or in
+    the temporary directory. Processes of other boxes aren't signalled. In-memory SQLite databases aren't shared
+    between processes, so neither are their events.
+    :param db: DB Connection
+    :return: the path, or None when the events can't be shared
+    """
+    if db.provider.dialect == 'SQLite':
+        pool = db.provider.pool
+        if pool.is_shared_memory_db or pool.filename == ':memory:':
+            return None
+        return pool.filename + '-events'
+    return os.path.join(tempfile.gettempdir(), 'juice_shop_events')
+
+
+# changes of the payment status of an order, keyed by payment id
+payment_events = PubSub()
@@ -0,0 +1,60 @@
+import datetime as dt
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import analytics
+from JuiceShop.database import query
+
+
+@db_session
+def resolve_ingredients(db, received_order: dict) -> tuple:
+    """
+    Collects the distinct fruit and liquid names of a whole order and resolves them with one query per entity type.
+    :param db: DB Connection
+    :param received_order: the order payload, with a list of juices under 'order'.
+    :return: a tuple with the fruits and the liquids found, both as dicts keyed by name.
+    """
+    fruit_names = {fruit_name for juice in received_order['order'] for fruit_name in juice['fruits']}
+    liquid_names = {juice['liquid'] for juice in received_order['order']}
+
+    return query.get_fruits_by_names(db, fruit_names), query.get_liquids_by_names(db, liquid_names)
+
+
+@db_session
+def create_order(db, received_order: dict, payment_id: str, order_at: dt.datetime):
+    """
+    Prices an order and creates it with its juices. Unknown fruits are ignored and juices with an unknown liquid are
+    not added to the order. The juices are also frozen in the order snapshot, which order reads are served from, and
+    added to the sales rollups in the same transaction.
+    :param db: DB Connection
+    :param received_order: the order payload, with a list of juices under 'order'.
+    :param payment_id: the payment id of the new order.
+    :param order_at: when the order was received.
+    :return: the created order
+    """
+    fruits, liquids = resolve_ingredients(db, received_order)
+
+    new_order = db.Order(
+        payment_id=payment_id,
+        order_at=order_at,
+        is_paid=False
+    )
+
+    order_price = 0
+    juice_snapshots = []
+    for juice in received_order['order']:
+        liquid = liquids.get(juice['liquid'])
+        if liquid is None:
+            continue
+        juice_fruits = [fruits[fruit_name] for fruit_name in juice['fruits'] if fruit_name in fruits]
+        juice_price = liquid.price + sum(fruit.price for fruit in juice_fruits)
+        db.Juice(price=juice_price, liquid=liquid, fruits=juice_fruits, order=new_order)
+        # a fruit listed twice is priced twice, but the juice holds it once
+        juice_snapshots.append(c.juice_snapshot(juice_price, liquid, dict.fromkeys(juice_fruits)))
+        order_price += juice_price
+    new_order.price = order_price
+    new_order.snapshot = {'juices': juice_snapshots}
+    analytics.record_order(db, order_at, order_price, juice_snapshots)
+
+    return new_order
@@ -0,0 +1,113 @@
+from typing import NamedTuple
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import JuiceShop.common as c
+
+
+class Number(NamedTuple):
+    """
+    The schema of a finite number from minimum to maximum.
+    """
+    minimum: float
+    maximum: float
+
+
+# A schema describes a JSON body: a dict is an object whose keys are all required, a list of one schema is an array of
+# at most PAYLOAD_MAX_ARRAY_LENGTH items, a Number is a number in its range and a type is a scalar. Keys not in the
+# schema are ignored.
+NUMBER = (int, float)
+TYPE_NAMES = {str: 'a string', bool: 'a boolean', NUMBER: 'a number'}
+PRICE = Number(0, c.MAX_PRICE)
+
+FRUIT = {'name': str, 'price': PRICE, 'description': str, 'image': str, 'vitamins': [str]}
+LIQUID = {'name': str, 'price': PRICE, 'description': str, 'image': str}
+JUICE = {'fruits': [str], 'liquid': str}
+ORDER = {'order': [JUICE]}
+PAYMENT = {'is_paid': bool}
+
+
+class PayloadError(ValueError):
+    """
+    Raised when a request body isn't JSON or doesn't match the schema of its route.
+    """
+
+
+def validate(value, schema, path: str = 'body'):
+    """
+    Checks a decoded body against a schema.
+    :param value: the decoded value.
+    :param schema: the schema of the value.
+    :param path: where the value is in the body, for the error messages.
+    :return: None, raises PayloadError at the first mismatch
+    """
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise PayloadError("Invalid payload - {} must be an object".format(path))
+        for key, key_schema in schema.items():
+            if key not in value:
+                raise PayloadError("Invalid payload - {}.{} is missing".format(path, key))
+            validate(value[key], key_schema, '{}.{}'.format(path, key))
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            raise PayloadError("Invalid payload - {} must be a list".format(path))
+        if len(value) > c.PAYLOAD_MAX_ARRAY_LENGTH:
+            raise PayloadError("Invalid payload - {} has more than {} items".format(path, c.PAYLOAD_MAX_ARRAY_LENGTH))
+        for position, item in enumerate(value):
+            validate(item, schema[0], '{}[{}]'.format(path, position))
+    elif isinstance(schema, Number):
+        validate(value, NUMBER, path)
+        # NaN and infinities, which the json module parses, fail the comparisons too
+        if not schema.minimum <= value <= schema.maximum:
+            raise PayloadError("Invalid payload - {} must be from {:g} to {:.2f}".format(path, schema.minimum,
+                                                                                      schema.maximum))
+    elif not isinstance(value, schema) or isinstance(value, bool) != (schema is bool):
+        # bool is a subclass of int, but true isn't a price
+        raise PayloadError("Invalid payload - {} must be {}".format(path, TYPE_NAMES[schema]))
+
+
+def read_body(max_size: int = c.PAYLOAD_MAX_SIZE) -> bytes:
+    """
+    Reads the body of the current request, answering HTTP 413 when it is larger than max_size.
+    :param max_size: maximum size in bytes.
+    :return: the body
+    """
+    if request.content_length is not None and request.content_length > max_size:
+        raise RequestEntityTooLarge()
+    data = request.get_data()
+    if len(data) > max_size:
+        raise RequestEntityTooLarge()
+    return data
+
+
+def decode(schema, max_size: int = c.PAYLOAD_MAX_SIZE):
+    """
+    Reads, parses and validates the JSON body of the current request. Handlers call it before touching the database,
+    so a bad body is answered without opening a transaction.
+    :param schema: the schema of the body, or None when the handler validates it.
+    :param max_size: maximum size of the body in bytes.
+    :return: the decoded body, raises PayloadError when it is invalid
+    """
+    try:
+        payload = c.from_json_bytes(read_body(max_size))
+    except ValueError:
+        raise PayloadError("Invalid payload - the body is not JSON")
+    if schema is not None:
+        validate(payload, schema)
+    return payload
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider, with jsonify writing the bytes of common.to_json_bytes, so every response goes through the
+    same encoder, orjson when it is installed.
+    """
+
+    def loads(self, s, **kwargs):
+        return c.from_json_bytes(s)
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(c.to_json_bytes(self._prepare_response_obj(args, kwargs)),
+                                        mimetype=self.mimetype)
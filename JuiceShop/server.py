@@ -0,0 +1,296 @@
+"""
+Pre-forking WSGI server of the Juice Shop API.
+
+    python run_juice_shop_app.py --prefork --workers 4 --threads 8
+
+The master process binds the database, renders the catalog and opens the listening socket once, then forks the worker
+processes, which serve requests with a bounded pool of threads each; JSON rendering then runs on every core. The master
+replaces workers that die, after a growing delay when they die right after starting, and stops when they keep failing
+to start. SIGHUP starts a new set of workers and stops the previous ones once their requests are answered, SIGTERM and
+SIGINT stop the server the same way.
+"""
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Thread
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import JuiceShop.common as c
+from JuiceShop import catalog, idempotency, juice_shop_app
+
+logger = logging.getLogger('juice_shop.server')
+
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection: an idle keep-alive connection would hold one of the few threads of a worker
+    protocol_version = 'HTTP/1.0'
+
+    def log_request(self, *args, **kwargs):
+        # requests are logged by the instrumentation
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Serves a WSGI app on an already listening socket with at most `threads` threads. A connection is only accepted
+    when a thread is free, so the others wait in the listen backlog, where an idle worker can take them.
+    """
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, address: tuple, fd: int, threads: int):
+        super().__init__(address[0], address[1], app, handler=RequestHandler, fd=fd)
+        # every worker is woken by a new connection, the ones that don't get it must not block in accept()
+        self.socket.setblocking(False)
+        self._slots = BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='juice-shop')
+
+    def _handle_request_noblock(self):
+        # the thread is taken before accepting: a busy worker would otherwise hold the connection until a thread frees
+        self._slots.acquire()
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            # accepted by another worker
+            self._slots.release()
+            return
+        if self.verify_request(request, client_address):
+            self.process_request(request, client_address)
+        else:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self):
+        """
+        Waits for the requests being served, once serve_forever() returned.
+        :return: None
+        """
+        self._executor.shutdown(wait=True)
+
+
+def preload(flask_app):
+    """
+    Prepares, in the master process, what every worker would do on its first request: binding the database, which maps
+    the entities, and rendering the catalog, which is then shared through its snapshot file. The connection opened
+    meanwhile is closed, so no worker inherits it.
+    :param flask_app: the Flask app.
+    :return: the bound database
+    """
+    db = juice_shop_app.bind_db(flask_app)
+    catalog.menu_snapshot(db)
+    db.disconnect()
+    return db
+
+
+class PreforkServer:
+    """
+    The master process: it owns the listening socket and the workers, and reacts to signals.
+    """
+
+    def __init__(self, flask_app, host: str = c.SERVER_HOST, port: int = c.SERVER_PORT, workers: int = c.WORKERS,
+                 threads: int = c.WORKER_THREADS, backlog: int = c.SERVER_BACKLOG,
+                 graceful_timeout: float = c.SERVER_GRACEFUL_TIMEOUT, min_uptime: float = c.SERVER_WORKER_MIN_UPTIME,
+                 max_start_failures: int = c.SERVER_MAX_START_FAILURES):
+        self.flask_app = flask_app
+        self.address = (host, port)
+        self.workers = workers
+        self.threads = threads
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.min_uptime = min_uptime
+        self.max_start_failures = max_start_failures
+        self.socket = None
+        # pids of the current workers, which are replaced when they die, and of the ones being stopped, with deadlines
+        self._current = set()
+        # fork times of the current workers, the workers that failed to start in a row, and when to replace them
+        self._started_at = {}
+        self._start_failures = 0
+        self._replace_at = 0
+        self._retiring = {}
+        self._signals = []
+        self._wakeup_read, self._wakeup_write = None, None
+
+    def listen(self):
+        self.socket = socket.create_server(self.address, backlog=self.backlog)
+        self.address = self.socket.getsockname()[:2]
+        return self.address
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def run(self):
+        """
+        Serves until SIGTERM or SIGINT.
+        :return: None
+        """
+        if self.socket is None:
+            self.listen()
+        preload(self.flask_app)
+
+        # signals only queue themselves, the loop wakes up on the bytes written to this pipe
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+        signal.set_wakeup_fd(self._wakeup_write)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        logger.info('Listening on %s:%s with %s workers of %s threads', *self.address, self.workers, self.threads)
+        idempotency.warn_if_per_process(self.workers)
+        self._spawn_workers()
+        try:
+            while True:
+                timeout = min(max(self._replace_at - time.monotonic(), 0), 1) if self._missing_workers() else 1
+                if select.select([self._wakeup_read], [], [], timeout)[0]:
+                    os.read(self._wakeup_read, 1024)
+                signals, self._signals = self._signals, []
+                if signal.SIGTERM in signals or signal.SIGINT in signals:
+                    break
+                if signal.SIGHUP in signals:
+                    self.reload()
+                self._reap()
+                if self._missing_workers() and time.monotonic() >= self._replace_at:
+                    self._spawn_workers()
+        finally:
+            self.stop()
+
+    def reload(self):
+        """
+        Starts a new set of workers, then stops the current ones once their requests are answered. The catalog is
+        rendered again when it changed; the code isn't reloaded, a new version needs a restart.
+        :return: None
+        """
+        logger.info('Reloading the workers')
+        preload(self.flask_app)
+        previous, self._current = self._current, set()
+        self._spawn_workers()
+        self._retire(previous)
+
+    def stop(self):
+        """
+        Stops every worker, waiting graceful_timeout seconds for the requests being served before killing them.
+        :return: None
+        """
+        self._retire(set(self._current))
+        self._current.clear()
+        while self._retiring:
+            self._reap()
+            time.sleep(0.05)
+        self.socket.close()
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def _retire(self, pids: set):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self._retiring[pid] = deadline
+            _kill(pid, signal.SIGTERM)
+
+    def _reap(self):
+        while self._current or self._retiring:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                # every worker was already reaped
+                self._retiring.clear()
+                break
+            if pid == 0:
+                break
+            self._retiring.pop(pid, None)
+            uptime = time.monotonic() - self._started_at.pop(pid, 0)
+            if pid in self._current:
+                self._current.discard(pid)
+                self._worker_exited(pid, os.waitstatus_to_exitcode(status), uptime)
+
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now > deadline:
+                _kill(pid, signal.SIGKILL)
+
+    def _worker_exited(self, pid: int, exit_code: int, uptime: float):
+        """
+        Schedules the replacement of a worker that died. A worker that dies right after its fork, because of a bad
+        configuration or an unreachable database, is replaced after a growing delay instead of being forked again at
+        once, and the master gives up after max_start_failures of them in a row.
+        """
+        if uptime >= self.min_uptime:
+            self._start_failures = 0
+            logger.warning('Worker %s exited with status %s, replacing it', pid, exit_code)
+            return
+
+        self._start_failures += 1
+        if self._start_failures >= self.max_start_failures:
+            raise Exception("Unable to serve - {} workers in a row failed to start".format(self._start_failures))
+        delay = min(c.SERVER_RESTART_DELAY * 2 ** (self._start_failures - 1), c.SERVER_RESTART_MAX_DELAY)
+        self._replace_at = time.monotonic() + delay
+        logger.warning('Worker %s failed to start with status %s, replacing it in %.1f s', pid, exit_code, delay)
+
+    def _missing_workers(self) -> bool:
+        return len(self._current) < self.workers
+
+    def _spawn_workers(self):
+        while len(self._current) < self.workers:
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 0
+                try:
+                    self._serve_worker()
+                except BaseException:
+                    logger.exception('Worker %s failed', os.getpid())
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            self._current.add(pid)
+            self._started_at[pid] = time.monotonic()
+
+    def _serve_worker(self):
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # the master stops the workers on SIGINT, sent to the whole process group by Ctrl-C
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        server = PooledWSGIServer(self.flask_app, self.address, self.socket.fileno(), self.threads)
+        self.socket.close()
+        # shutdown() waits for serve_forever() to return, so it's called from another thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: Thread(target=server.shutdown).start())
+        server.serve_forever()
+        server.drain()
+
+
+def _kill(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def serve(host: str = c.SERVER_HOST, port: int = c.SERVER_PORT, workers: int = c.WORKERS,
+          threads: int = c.WORKER_THREADS, backlog: int = c.SERVER_BACKLOG):
+    """
+    Serves the Flask app with pre-forked workers until SIGTERM or SIGINT.
+    :return: None
+    """
+    if sys.platform == 'win32':
+        raise Exception("Unable to serve - pre-forking needs os.fork, use --asgi on Windows")
+    PreforkServer(juice_shop_app.app, host, port, workers, threads, backlog).run()
@@ -0,0 +1,120 @@
+import datetime as dt
+from unittest import TestCase, mock
+
+from pony.orm import db_session, select
+
+from JuiceShop import analytics, orders
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+ORDERS = [
+    (dt.datetime(2020, 1, 1, 5, 10), [{'fruits': ['fruit_A', 'fruit_B'], 'liquid': 'liquid_A'},
+                                      {'fruits': ['fruit_B', 'fruit_A'], 'liquid': 'liquid_B'}]),
+    (dt.datetime(2020, 1, 1, 5, 50), [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]),
+    (dt.datetime(2020, 1, 1, 9, 0), [{'fruits': ['fruit_B', 'fruit_A'], 'liquid': 'liquid_A'}]),
+    (dt.datetime(2020, 1, 2, 0, 30), [{'fruits': ['fruit_B'], 'liquid': 'liquid_B'}]),
+]
+
+
+@db_session
+def rollups(db) -> tuple:
+    return (sorted(select((r.period, r.dimension, r.bucket, r.name, r.juices, r.revenue) for r in db.SalesRollup)),
+            sorted(select((r.period, r.bucket, r.orders, r.paid, r.revenue, r.paid_revenue) for r in db.PaymentRollup)))
+
+
+class AnalyticsTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+        for position, (order_at, juices) in enumerate(ORDERS):
+            with db_session:
+                orders.create_order(test_db, {'order': juices}, payment_id=str(position), order_at=order_at)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def pay(self, payment_id: str, is_paid: bool):
+        with db_session:
+            order = test_db.Order.get(payment_id=payment_id)
+            analytics.record_payment(test_db, order.order_at, order.price, order.is_paid, is_paid)
+            order.is_paid = is_paid
+
+    def test_top_combinations(self):
+        self.assertEqual(analytics.top_combinations(test_db), [
+            {'fruits': ['fruit_A', 'fruit_B'], 'juices': 3, 'revenue': 26.0},
+            {'fruits': ['fruit_B'], 'juices': 1, 'revenue': 8.0},
+            {'fruits': ['fruit_A'], 'juices': 1, 'revenue': 4.0},
+        ])
+
+        self.assertEqual(analytics.top_combinations(test_db, since=dt.datetime(2020, 1, 1, 6), period='hour', limit=1),
+                         [{'fruits': ['fruit_A', 'fruit_B'], 'juices': 1, 'revenue': 8.0}])
+
+    def test_revenue(self):
+        self.assertEqual(analytics.revenue(test_db, 'liquid', 'day'), [
+            {'bucket': dt.datetime(2020, 1, 1), 'liquid': 'liquid_A', 'juices': 3, 'revenue': 6.0},
+            {'bucket': dt.datetime(2020, 1, 1), 'liquid': 'liquid_B', 'juices': 1, 'revenue': 4.0},
+            {'bucket': dt.datetime(2020, 1, 2), 'liquid': 'liquid_B', 'juices': 1, 'revenue': 4.0},
+        ])
+
+        self.assertEqual(analytics.revenue(test_db, 'fruit', 'hour', until=dt.datetime(2020, 1, 1, 6)), [
+            {'bucket': dt.datetime(2020, 1, 1, 5), 'fruit': 'fruit_A', 'juices': 3, 'revenue': 6.0},
+            {'bucket': dt.datetime(2020, 1, 1, 5), 'fruit': 'fruit_B', 'juices': 2, 'revenue': 8.0},
+        ])
+
+    def test_payments(self):
+        self.pay('0', True)
+        self.pay('2', True)
+        self.pay('2', False)
+        self.pay('3', True)
+
+        result = analytics.payments(test_db, 'day')
+        self.assertEqual([(b['bucket'], b['orders'], b['paid'], b['unpaid']) for b in result['buckets']],
+                         [(dt.datetime(2020, 1, 1), 3, 1, 2), (dt.datetime(2020, 1, 2), 1, 1, 0)])
+        self.assertEqual(result['total'], {'orders': 4, 'paid': 2, 'unpaid': 2, 'paid_ratio': 0.5, 'revenue': 38.0,
+                                           'paid_revenue': 26.0})
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.pay('1', True)
+        incremental = rollups(test_db)
+
+        analytics.REBUILD_CHUNK_SIZE, chunk_size = 3, analytics.REBUILD_CHUNK_SIZE
+        try:
+            self.assertEqual(analytics.rebuild(test_db), len(ORDERS))
+        finally:
+            analytics.REBUILD_CHUNK_SIZE = chunk_size
+
+        self.assertEqual(rollups(test_db), incremental)
+
+    def test_order_created_during_rebuild_counted_once(self):
+        apply = analytics._apply
+        created = []
+
+        def apply_then_order(db, sales, payments):
+            apply(db, sales, payments)
+            if not created:
+                # record_order applies the rollups of the new order through this function too
+                created.append('during_rebuild')
+                orders.create_order(test_db, {'order': ORDERS[0][1]}, payment_id='during_rebuild',
+                                    order_at=ORDERS[0][0])
+
+        analytics.REBUILD_CHUNK_SIZE, chunk_size = 1, analytics.REBUILD_CHUNK_SIZE
+        try:
+            with mock.patch('JuiceShop.analytics._apply', side_effect=apply_then_order):
+                self.assertEqual(analytics.rebuild(test_db), len(ORDERS))
+            during = rollups(test_db)
+            self.assertEqual(analytics.rebuild(test_db), len(ORDERS) + 1)
+        finally:
+            analytics.REBUILD_CHUNK_SIZE = chunk_size
+
+        self.assertEqual(during, rollups(test_db),
+                         msg="test err 'test_order_created_during_rebuild_counted_once', the new order counted twice")
+
+    def test_rollups_rolled_back_with_order(self):
+        before = rollups(test_db)
+        with self.assertRaises(ZeroDivisionError):
+            with db_session:
+                orders.create_order(test_db, {'order': ORDERS[0][1]}, payment_id='failed', order_at=ORDERS[0][0])
+                1 / 0
+
+        self.assertEqual(rollups(test_db), before)
@@ -0,0 +1,52 @@
+from http import HTTPStatus
+from unittest import TestCase, mock
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import juice_shop_app
+
+
+class CreateAppTestCase(TestCase):
+
+    @mock.patch('JuiceShop.juice_shop_app.db', None)
+    def test_db_bound_on_first_request(self):
+        test_app = juice_shop_app.create_app({
+            'DB_CONFIG': dict(provider='sqlite', filename=':sharedmemory:'),
+            'DB_CREATE_TABLES': True
+        })
+        self.assertIsNone(juice_shop_app.db, msg="test err 'test_db_bound_on_first_request', bound by create_app")
+
+        response = test_app.test_client().get(c.API_VERSION + '/liquids')
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b'{"liquids":[]}\n')
+        self.assertIsNotNone(juice_shop_app.db)
+        self.assertGreater(test_app.config['IMPORT_TO_READY_SECONDS'], 0)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', None)
+    def test_tables_not_created_by_default(self):
+        test_app = juice_shop_app.create_app({'DB_CONFIG': dict(provider='sqlite', filename=':sharedmemory:')})
+
+        self.assertFalse(test_app.config['DB_CREATE_TABLES'])
+        with test_app.app_context():
+            bound_db = juice_shop_app.bind_db()
+        self.assertIs(juice_shop_app.bind_db(test_app), bound_db)
+        with db_session:
+            self.assertEqual(bound_db.select("SELECT name FROM sqlite_master WHERE type = 'table'"), [])
+
+    @mock.patch('JuiceShop.juice_shop_app._bound_db_config', (None, None))
+    @mock.patch('JuiceShop.juice_shop_app.db', None)
+    def test_another_db_config_refused(self):
+        bound_db = juice_shop_app.bind_db(juice_shop_app.create_app({
+            'DB_CONFIG': dict(provider='sqlite', filename=':sharedmemory:')
+        }))
+        same_app = juice_shop_app.create_app({'DB_CONFIG': dict(provider='sqlite', filename=':sharedmemory:')})
+        other_app = juice_shop_app.create_app({'DB_CONFIG': dict(provider='sqlite', filename='other_db')})
+
+        self.assertIs(juice_shop_app.bind_db(same_app), bound_db)
+        with self.assertRaisesRegex(Exception, 'another DB_CONFIG'):
+            juice_shop_app.bind_db(other_app)
+        response = other_app.test_client().get(c.API_VERSION + '/liquids')
+        self.assertEqual(response.status_code, HTTPStatus.INTERNAL_SERVER_ERROR,
+                         msg="test err 'test_another_db_config_refused', served from the first database")
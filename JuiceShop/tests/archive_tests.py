@@ -0,0 +1,140 @@
+import datetime as dt
+import json
+import os
+import sqlite3
+import tempfile
+from http import HTTPStatus
+from unittest import TestCase, mock
+
+from pony.orm import commit, db_session, select
+
+import JuiceShop.common as c
+from JuiceShop import analytics, archive, juice_shop_app, orders
+from JuiceShop.database import query
+from JuiceShop.tests.analytics_tests import rollups
+from JuiceShop.tests.migrations_tests import OLD_SCHEMA
+from JuiceShop.tests.view_tests import DB_BACKEND_TEST, DB_CONFIG_TEST, populate_database, test_db
+
+ARCHIVE_DB_CONFIGS_TEST = {
+    'postgres': dict(DB_CONFIG_TEST,
+                     database=os.environ.get('JUICE_SHOP_TEST_ARCHIVE_DB_NAME', 'juice_shop_test_archive')),
+}
+ARCHIVE_DB_CONFIG_TEST = ARCHIVE_DB_CONFIGS_TEST.get(DB_BACKEND_TEST, dict(
+    provider='sqlite', filename=os.path.join(tempfile.gettempdir(), 'juice_shop_test_archive_db'), create_db=True))
+
+test_archive_db = archive.define_archive_db(ARCHIVE_DB_CONFIG_TEST)
+
+cutoff = dt.datetime(2020, 6, 1)
+# (payment id, order datetime, is paid): only the first one is old enough and paid
+ORDERS = [
+    ('old_paid', dt.datetime(2020, 1, 1, 5), True),
+    ('old_unpaid', dt.datetime(2020, 1, 2, 5), False),
+    ('new_paid', dt.datetime(2020, 7, 1, 5), True),
+]
+
+
+class ArchiveTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        test_archive_db.create_tables()
+        populate_database(self.test_db)
+        juices = [{'fruits': ['fruit_A', 'fruit_B'], 'liquid': 'liquid_A'}, {'fruits': [], 'liquid': 'liquid_B'}]
+        for payment_id, order_at, is_paid in ORDERS:
+            with db_session:
+                new_order = orders.create_order(test_db, {'order': juices}, payment_id=payment_id, order_at=order_at)
+                analytics.record_payment(test_db, order_at, new_order.price, new_order.is_paid, is_paid)
+                new_order.is_paid = is_paid
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+        test_archive_db.drop_all_tables(with_all_data=True)
+
+    def test_archive_orders(self):
+        with db_session:
+            expected = c.order_to_dict(query.get_order_record(test_db, 'old_paid'))
+
+        self.assertEqual(archive.archive_orders(test_db, test_archive_db, cutoff, chunk_size=1), 1)
+        self.assertEqual(archive.archive_orders(test_db, test_archive_db, cutoff), 0)
+
+        with db_session:
+            self.assertEqual(sorted(select(o.payment_id for o in test_db.Order)), ['new_paid', 'old_unpaid'])
+            self.assertEqual(test_db.Juice.select().count(), 4)
+            self.assertEqual(c.order_to_dict(query.get_order_record(test_archive_db, 'old_paid')), expected)
+            self.assertEqual(sorted((j.liquid.name, sorted(j.fruits.name)) for j in test_archive_db.Juice.select()),
+                             [('liquid_A', ['fruit_A', 'fruit_B']), ('liquid_B', [])])
+
+    def test_archive_db_of_an_older_version_upgraded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'archive_db')
+            with sqlite3.connect(filename) as connection:
+                connection.executescript(OLD_SCHEMA)
+            old_archive_db = archive.define_archive_db(dict(provider='sqlite', filename=filename))
+
+            self.assertEqual(archive.archive_orders(test_db, old_archive_db, cutoff), 1)
+            with db_session:
+                self.assertEqual(sorted(select(f.lower_name for f in old_archive_db.Fruit)), ['fruit_a', 'fruit_b'])
+            old_archive_db.disconnect()
+
+    def test_rebuild_counts_archived_orders(self):
+        before = rollups(test_db)
+        archive.archive_orders(test_db, test_archive_db, cutoff)
+
+        self.assertEqual(analytics.rebuild(test_db, test_archive_db), len(ORDERS))
+        self.assertEqual(rollups(test_db), before)
+
+    def test_rebuild_after_interrupted_archival(self):
+        before = rollups(test_db)
+        commits = []
+
+        def commit_archive_only():
+            # the chunk is committed to the archive, then the job stops before deleting it from the main database
+            if commits:
+                raise KeyboardInterrupt
+            commits.append(commit())
+
+        with mock.patch('JuiceShop.archive.commit', side_effect=commit_archive_only):
+            with self.assertRaises(KeyboardInterrupt):
+                archive.archive_orders(test_db, test_archive_db, cutoff)
+        with db_session:
+            self.assertEqual(test_archive_db.Order.select().count(), 1)
+            self.assertEqual(test_db.Order.select().count(), len(ORDERS))
+
+        self.assertEqual(analytics.rebuild(test_db, test_archive_db), len(ORDERS))
+        self.assertEqual(rollups(test_db), before,
+                         msg="test err 'test_rebuild_after_interrupted_archival', archived orders counted twice")
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_archive_read_through_api(self):
+        archive.archive_orders(test_db, test_archive_db, cutoff)
+        archive_app = juice_shop_app.create_app({'ARCHIVE_DB_CONFIG': ARCHIVE_DB_CONFIG_TEST})
+
+        # the archive is bound by the first request reading it, whichever endpoint it is
+        for endpoint in (c.API_VERSION + '/juices?archive=1', c.API_VERSION + '/order/old_paid?archive=1'):
+            with mock.patch('JuiceShop.juice_shop_app.archive_db', None), \
+                    mock.patch('JuiceShop.juice_shop_app._bound_archive_db_config', (None, None)):
+                response = archive_app.test_client().get(endpoint)
+                juice_shop_app.archive_db.disconnect()
+            self.assertEqual(response.status_code, HTTPStatus.OK,
+                             msg="test err 'test_archive_read_through_api', {} unable to bind the archive".format(
+                                 endpoint))
+
+        with mock.patch('JuiceShop.juice_shop_app.archive_db', None), \
+                mock.patch('JuiceShop.juice_shop_app._bound_archive_db_config', (None, None)):
+            test_app = archive_app.test_client()
+            endpoint = c.API_VERSION + '/order/old_paid'
+
+            self.assertEqual(test_app.get(endpoint).status_code, HTTPStatus.NOT_FOUND)
+            response = test_app.get(endpoint + '?archive=1')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertTrue(json.loads(response.data)['is_paid'])
+            self.assertEqual(test_app.get(c.API_VERSION + '/order/new_paid?archive=1').status_code, HTTPStatus.OK)
+
+            hot_juices = json.loads(test_app.get(c.API_VERSION + '/juices').data)['juices']
+            archived_juices = json.loads(test_app.get(c.API_VERSION + '/juices?archive=1').data)['juices']
+            juice_shop_app.archive_db.disconnect()
+        self.assertEqual(len(hot_juices), 4)
+        self.assertEqual([(j['liquid']['name'], j['price']) for j in archived_juices],
+                         [('liquid_A', 8.0), ('liquid_B', 4.0)])
+        self.assertLess(archived_juices[-1]['id'], hot_juices[0]['id'])
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import time
+from http import HTTPStatus
+from unittest import TestCase, mock
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import asgi, catalog
+from JuiceShop.juice_shop_app import app
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+
+async def call(asgi_app, method: str, path: str, body: bytes = b'', headers=(), chunks: list = None) -> tuple:
+    """
+    Sends one request to an ASGI app, as a server would.
+    :return: a tuple with the status, the headers and the body
+    """
+    path, _, query_string = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode('latin-1'),
+             'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    requests = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    if chunks is not None:
+        chunks.extend(message['body'] for message in sent[1:] if message['body'])
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(message['body'] for message in sent[1:])
+
+
+def json_call(asgi_app, method: str, path: str, payload) -> tuple:
+    return call(asgi_app, method, path, json.dumps(payload).encode(), [('Content-Type', 'application/json')])
+
+
+@mock.patch('JuiceShop.juice_shop_app.db', test_db)
+class ASGITestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+        catalog.invalidate(test_db)
+        self.asgi_app = asgi.ASGIApp(app, threads=1)
+
+    def tearDown(self):
+        self.asgi_app.executor.shutdown()
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_same_responses_as_wsgi(self):
+        async def scenario():
+            order = await json_call(self.asgi_app, 'POST', c.API_VERSION + '/order',
+                                    {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+            invalid = await json_call(self.asgi_app, 'POST', c.API_VERSION + '/order', {'order': [{}]})
+            fruits = await call(self.asgi_app, 'GET', c.API_VERSION + '/fruits')
+            chunks = []
+            export = await call(self.asgi_app, 'GET', c.API_VERSION + '/juices',
+                                headers=[('Accept', c.NDJSON_MIMETYPE)], chunks=chunks)
+            return order, invalid, fruits, export, chunks
+
+        order, invalid, fruits, export, chunks = asyncio.run(scenario())
+
+        self.assertEqual(order[0], HTTPStatus.OK)
+        self.assertEqual(json.loads(order[2])['price'], 4.0)
+        self.assertEqual(invalid[:3:2], (HTTPStatus.BAD_REQUEST, b'Invalid payload - body.order[0].fruits is missing'))
+        self.assertEqual(fruits[2], app.test_client().get(c.API_VERSION + '/fruits').data)
+        self.assertEqual(fruits[1][b'etag'], app.test_client().get(c.API_VERSION + '/fruits').headers['ETag'].encode())
+        self.assertEqual([json.loads(line)['price'] for line in export[2].splitlines()], [4.0])
+        self.assertEqual(len(chunks), 1)
+
+    def test_wait_for_payment_without_a_thread(self):
+        async def scenario():
+            order = await json_call(self.asgi_app, 'POST', c.API_VERSION + '/order',
+                                    {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+            endpoint = c.API_VERSION + '/order/' + json.loads(order[2])['payment_id']
+            waiters = [asyncio.create_task(call(self.asgi_app, 'GET', endpoint + '?wait=10')) for _ in range(5)]
+            await asyncio.sleep(0.1)
+            # the only pool thread isn't held by the waiting requests
+            await json_call(self.asgi_app, 'PUT', endpoint, {'is_paid': True})
+            return await asyncio.gather(*waiters)
+
+        started_at = time.perf_counter()
+        responses = asyncio.run(scenario())
+
+        self.assertLess(time.perf_counter() - started_at, 5,
+                        msg="test err 'test_wait_for_payment_without_a_thread', the waiting requests weren't notified")
+        self.assertEqual([json.loads(body)['is_paid'] for status, headers, body in responses], [True] * 5)
+
+    def test_wait_timeout_reads_the_order_again(self):
+        async def scenario():
+            order = await json_call(self.asgi_app, 'POST', c.API_VERSION + '/order',
+                                    {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+            payment_id = json.loads(order[2])['payment_id']
+            waiter = asyncio.create_task(call(self.asgi_app, 'GET', c.API_VERSION + '/order/{}?wait=0.5'.format(
+                payment_id)))
+            await asyncio.sleep(0.1)
+            # paid by another worker process, which doesn't notify this one
+            with db_session:
+                test_db.Order.get(payment_id=payment_id).is_paid = True
+            return await waiter
+
+        status, headers, body = asyncio.run(scenario())
+        self.assertTrue(json.loads(body)['is_paid'])
+
+    def test_large_body_rejected(self):
+        self.asgi_app.max_body_size = 16
+        response = asyncio.run(json_call(self.asgi_app, 'PUT', c.API_VERSION + '/liquids/store', {'name': 'x' * 16}))
+
+        self.assertEqual(response[0], HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
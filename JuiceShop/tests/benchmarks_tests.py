@@ -0,0 +1,57 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from benchmarks import group_commit, payment_ids, run, seed
+
+
+class BenchmarkHarnessTestCase(TestCase):
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False).name
+
+    def tearDown(self):
+        os.remove(self.db_file)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', None)
+    def test_every_route_measured(self):
+        size = seed.SeedSize(vitamins=3, fruits=5, liquids=2, orders=30)
+        report = run.run(self.db_file, size, requests=8, concurrency=2)
+
+        for driver in run.DRIVERS:
+            self.assertEqual(sorted(report['results'][driver]), sorted(run.ROUTES))
+            for route, result in report['results'][driver].items():
+                self.assertEqual((result['requests'], result['errors']), (8, 0),
+                                 msg="test err 'test_every_route_measured', {} {}: {}".format(driver, route, result))
+        self.assertEqual(report['config']['orders'], 30)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', None)
+    def test_allocations_traced(self):
+        size = seed.SeedSize(vitamins=3, fruits=5, liquids=2, orders=30)
+        report = run.run(self.db_file, size, routes=('update_payment_status',), drivers=('test_client',), requests=4,
+                         concurrency=1, trace_memory=True)
+
+        self.assertGreater(report['results']['test_client']['update_payment_status']['traced_peak_kb'], 0)
+
+    def test_compare(self):
+        baseline = {'results': {'wsgi': {'list_fruits': {'p95_ms': 10.0, 'throughput_rps': 100.0}}}}
+        faster = {'results': {'wsgi': {'list_fruits': {'p95_ms': 11.0, 'throughput_rps': 95.0}}}}
+        slower = {'results': {'wsgi': {'list_fruits': {'p95_ms': 13.0, 'throughput_rps': 70.0}}}}
+
+        self.assertEqual(run.compare(baseline, faster, threshold=0.2), [])
+        self.assertEqual(len(run.compare(baseline, slower, threshold=0.2)), 2)
+
+    def test_payment_ids_benchmark(self):
+        result = payment_ids.run('ulid', orders=30, chunk=20, profile='default',
+                                 directory=os.path.dirname(self.db_file))
+
+        self.assertEqual(len(result['chunk_orders_per_second']), 2)
+        self.assertGreater(result['orders_per_second'], 0)
+
+    def test_group_commit_benchmark(self):
+        for window_ms in (0, 1):
+            result = group_commit.run(window_ms, clients=2, seconds=0.2, profile='default',
+                                      directory=os.path.dirname(self.db_file))
+
+            self.assertGreater(result['orders_per_second'], 0)
+            self.assertGreater(result['p99_ms'], 0)
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+from http import HTTPStatus
+from unittest import TestCase, mock
+
+import JuiceShop.common as c
+from JuiceShop import catalog, importer
+from JuiceShop.juice_shop_app import app
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+
+def query_count(db) -> int:
+    db.merge_local_stats()
+    return sum(stat.db_count for stat in db.global_stats.values())
+
+
+class SharedCatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'catalog')
+
+    def tearDown(self):
+        catalog._caches.pop(test_db, None)
+        self.directory.cleanup()
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_snapshot_shared_between_workers(self):
+        # two caches on the same files behave as two worker processes
+        first, second = catalog.SharedMenuCache(self.path), catalog.SharedMenuCache(self.path)
+        rendered = first.snapshot(test_db)
+        # a worker checks the shared version against the catalog token of the database once, when it starts
+        second.check(test_db)
+
+        before = query_count(test_db)
+        loaded = second.snapshot(test_db)
+        self.assertEqual(query_count(test_db), before,
+                         msg="test err 'test_snapshot_shared_between_workers', the second worker queried the database")
+        self.assertEqual((loaded.fruits, loaded.liquids), (rendered.fruits, rendered.liquids))
+        self.assertEqual(loaded.etag, first.etag)
+
+        first.invalidate()
+        self.assertNotEqual(second.etag, loaded.etag)
+        self.assertEqual(second.etag, first.etag)
+        self.assertIsNot(second.snapshot(test_db), loaded)
+
+    def test_snapshot_file_of_another_catalog_ignored(self):
+        catalog.SharedMenuCache(self.path).snapshot(test_db)
+        os.remove(self.path + '.generation')
+
+        cache = catalog.SharedMenuCache(self.path)
+        before = query_count(test_db)
+        self.assertEqual(json.loads(cache.snapshot(test_db).liquids)['liquids'][0]['name'], 'liquid_A')
+        self.assertGreater(query_count(test_db), before)
+
+    def test_snapshot_of_a_changed_database_ignored(self):
+        stale = catalog.SharedMenuCache(self.path).snapshot(test_db)
+        # written by a process that doesn't share the catalog, as a restart after a database rebuild
+        importer.import_catalog(test_db, {'liquids': [{'name': 'liquid_C', 'price': 1, 'description': '',
+                                                       'image': ''}]})
+
+        cache = catalog.SharedMenuCache(self.path)
+        cache.check(test_db)
+        self.assertNotEqual(cache.etag, stale.etag)
+        self.assertEqual([liquid['name'] for liquid in json.loads(cache.snapshot(test_db).liquids)['liquids']],
+                         ['liquid_A', 'liquid_B', 'liquid_C'])
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_shared_snapshot_served(self):
+        catalog.share(test_db, self.path)
+        test_app = app.test_client()
+
+        response = test_app.get(c.API_VERSION + '/liquids')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual([liquid['name'] for liquid in json.loads(response.data)['liquids']], ['liquid_A', 'liquid_B'])
+
+        response = test_app.get(c.API_VERSION + '/liquids', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
@@ -0,0 +1,59 @@
+import datetime as dt
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from pony.orm import TransactionIntegrityError, commit, db_session, select
+
+import JuiceShop.common as c
+from JuiceShop import group_commit
+from JuiceShop.juice_shop_app import app
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+order_at = dt.datetime(year=2020, month=1, day=1, hour=5)
+ORDER = {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]}
+
+
+class GroupCommitTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    @mock.patch('JuiceShop.group_commit.commit', wraps=commit)
+    def test_concurrent_orders_share_a_commit(self, counted_commit):
+        writer = group_commit.OrderWriter(test_db, window=10, max_batch=5)
+        with ThreadPoolExecutor(max_workers=5) as requests:
+            records = list(requests.map(lambda i: writer.create_order(ORDER, 'order_{}'.format(i), order_at), range(5)))
+
+        self.assertEqual(counted_commit.call_count, 1,
+                         msg="test err 'test_concurrent_orders_share_a_commit', the orders weren't committed together")
+        self.assertEqual(sorted(record.payment_id for record in records), ['order_{}'.format(i) for i in range(5)])
+        self.assertEqual({record.price for record in records}, {400})
+        with db_session:
+            self.assertEqual(select(o for o in test_db.Order).count(), 5)
+
+    def test_failing_order_fails_alone(self):
+        writer = group_commit.OrderWriter(test_db, window=10, max_batch=3)
+        futures = [writer.submit(ORDER, payment_id, order_at) for payment_id in ('same', 'other', 'same')]
+
+        self.assertEqual([futures[0].result().payment_id, futures[1].result().payment_id], ['same', 'other'])
+        self.assertIsInstance(futures[2].exception(), TransactionIntegrityError)
+        with db_session:
+            self.assertEqual(sorted(select(o.payment_id for o in test_db.Order)), ['other', 'same'])
+
+    @mock.patch.dict(app.config, {'GROUP_COMMIT': True})
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_order_endpoint(self):
+        test_app = app.test_client()
+        response = test_app.post(c.API_VERSION + '/order', json=ORDER)
+        payment_id = json.loads(response.data)['payment_id']
+
+        self.assertEqual(json.loads(test_app.get(c.API_VERSION + '/order/' + payment_id).data)['price'], 4.0)
+        replayed = [test_app.post(c.API_VERSION + '/order', json=ORDER, headers={'Idempotency-Key': 'group'}).data
+                    for _ in range(2)]
+        self.assertEqual(replayed[0], replayed[1])
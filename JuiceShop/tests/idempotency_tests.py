@@ -0,0 +1,71 @@
+import datetime as dt
+from threading import Thread
+from unittest import TestCase, mock
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import idempotency, orders
+from JuiceShop.database import query
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+order_at = dt.datetime(year=2020, month=1, day=1, hour=5)
+received_order = {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]}
+
+
+def save_from_another_worker(key: str, body: bytes):
+    with db_session:
+        test_db.IdempotencyKey(key=key, request_hash=idempotency.request_hash(b'order'), response=body.decode('utf-8'),
+                               created_at=dt.datetime.utcnow())
+
+
+class IdempotencyTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_memory_store_evicts_and_expires(self):
+        store = idempotency.MemoryStore(size=2, ttl=60)
+        for key in ('a', 'b', 'c'):
+            store.save(test_db, key, idempotency.StoredResponse('hash', key.encode('utf-8')))
+
+        self.assertIsNone(store.get(test_db, 'a'))
+        self.assertEqual(store.get(test_db, 'c').body, b'c')
+
+        with mock.patch('time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(store.get(test_db, 'b'))
+
+    def test_database_store_keeps_first_worker_response(self):
+        def create():
+            # the same key is committed by another worker while this request runs
+            worker = Thread(target=save_from_another_worker, args=('conflict', b'{"first":true}\n'))
+            worker.start()
+            worker.join()
+            new_order = orders.create_order(test_db, received_order, payment_id='second', order_at=order_at)
+            return c.to_json_bytes(c.order_to_dict(query.order_record(new_order)))
+
+        with mock.patch.dict(idempotency._stores, {test_db: idempotency.DatabaseStore(ttl=60)}):
+            body, replayed = idempotency.run_once(test_db, 'conflict', b'order', create)
+            self.assertEqual((body, replayed), (b'{"first":true}\n', True))
+            with db_session:
+                self.assertIsNone(test_db.Order.get(payment_id='second'),
+                                  msg="test err 'test_database_store_keeps_first_worker_response', order kept")
+
+            self.assertEqual(idempotency.run_once(test_db, 'conflict', b'order', create), (b'{"first":true}\n', True))
+            with self.assertRaises(idempotency.KeyReuseError):
+                idempotency.run_once(test_db, 'conflict', b'another order', create)
+
+    def test_memory_store_of_several_workers_logged(self):
+        with mock.patch('JuiceShop.common.IDEMPOTENCY_STORE', 'memory'):
+            with self.assertLogs('juice_shop.idempotency', 'WARNING'):
+                idempotency.warn_if_per_process(4)
+            with self.assertNoLogs('juice_shop.idempotency', 'WARNING'):
+                idempotency.warn_if_per_process(1)
+        with mock.patch('JuiceShop.common.IDEMPOTENCY_STORE', 'database'):
+            with self.assertNoLogs('juice_shop.idempotency', 'WARNING'):
+                idempotency.warn_if_per_process(4)
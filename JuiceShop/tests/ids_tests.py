@@ -0,0 +1,30 @@
+import time
+from unittest import TestCase, mock
+
+from JuiceShop import ids
+
+
+class UlidGeneratorTestCase(TestCase):
+
+    def test_ids_sort_by_time(self):
+        generator = ids.UlidGenerator()
+        payment_ids = [generator.new(1700000000000 + i // 100) for i in range(1000)]
+
+        self.assertEqual(len(set(payment_ids)), 1000)
+        self.assertEqual(sorted(payment_ids), payment_ids)
+        self.assertTrue(all(len(payment_id) == ids.ID_LENGTH for payment_id in payment_ids))
+        self.assertLess(generator.new(), ids.encode(int(time.time() + 1) * 1000 << ids.RANDOM_BITS))
+
+    def test_clock_going_backwards(self):
+        generator = ids.UlidGenerator()
+        later = generator.new(1700000000500)
+
+        self.assertGreater(generator.new(1700000000000), later)
+
+    def test_forked_worker_restarts_sequence(self):
+        generator = ids.UlidGenerator()
+        generator.new(1700000000000)
+        with mock.patch('os.getpid', return_value=-1), mock.patch('os.urandom', return_value=bytes(10)):
+            child_id = generator.new(1700000000000)
+
+        self.assertEqual(child_id, ids.encode(1700000000000 << ids.RANDOM_BITS))
@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from pony.orm import db_session
+
+from JuiceShop import importer
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+
+def seasonal_menu(size: int) -> dict:
+    return {
+        'vitamins': [{'name': 'Vit{}'.format(i), 'description': 'Description Vit{}'.format(i)} for i in range(size)],
+        'fruits': [{'name': 'fruit_{}'.format(i), 'price': 1.5, 'description': 'Description fruit_{}'.format(i),
+                    'image': 'image', 'vitamins': ['VitA', 'Vit{}'.format(i)]} for i in range(size)],
+        'liquids': [{'name': 'liquid_{}'.format(i), 'price': 2, 'description': 'Description liquid_{}'.format(i),
+                     'image': 'image'} for i in range(size)],
+    }
+
+
+class ImporterTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_names_resolved_once_per_entity_type(self):
+        importer.import_catalog(test_db, seasonal_menu(50))
+
+        selects = []
+        for size in (1, 50):
+            test_db.merge_local_stats()
+            importer.import_catalog(test_db, seasonal_menu(size))
+            selects.append(sum(stat.db_count for sql, stat in test_db.local_stats.items()
+                               if sql is not None and sql.startswith('SELECT')))
+
+        self.assertEqual(selects[0], selects[1],
+                         msg="test err 'test_names_resolved_once_per_entity_type', selects grew with the catalog")
+
+    def test_reimport_skips_unchanged_rows(self):
+        importer.import_catalog(test_db, seasonal_menu(3))
+        summary = importer.import_catalog(test_db, seasonal_menu(3))
+
+        self.assertEqual(summary, {
+            'vitamins': {'inserted': 0, 'updated': 0, 'skipped': 3},
+            'fruits': {'inserted': 0, 'updated': 0, 'skipped': 3},
+            'liquids': {'inserted': 0, 'updated': 0, 'skipped': 3},
+            'unknown_vitamins': []
+        })
+        with db_session:
+            fruit = test_db.Fruit.get(name='fruit_2')
+            self.assertEqual((fruit.price, sorted(v.name for v in fruit.vitamins)), (150, ['Vit2', 'VitA']))
+
+    def test_parse_csv(self):
+        received_catalog = importer.parse_csv("type,name,price,description,image,vitamins\n"
+                                              "Fruit,fruit_C,1.5,Description,image, VitA ;VitB\n")
+
+        self.assertEqual(received_catalog['fruits'], [{'name': 'fruit_C', 'price': '1.5', 'description': 'Description',
+                                                       'image': 'image', 'vitamins': ['VitA', 'VitB']}])
+        with self.assertRaises(ValueError):
+            importer.parse_csv("type,name\nvegetable,carrot\n")
+
+    def test_invalid_catalogs_rejected(self):
+        fruit = {'name': 'fruit_C', 'price': 1.5, 'vitamins': ['VitA']}
+        for received_catalog in ({'fruits': [dict(fruit, price=float('inf'))]},
+                                 {'fruits': [dict(fruit, price=float('nan'))]},
+                                 {'fruits': [dict(fruit, price=10 ** 400)]},
+                                 {'fruits': [dict(fruit, price=-1)]},
+                                 {'liquids': [{'name': 'liquid_C', 'price': 'inf'}]},
+                                 {'fruits': [dict(fruit, name=['fruit_C'])]},
+                                 {'fruits': [dict(fruit, vitamins='VitA')]},
+                                 {'fruits': [dict(fruit, description=1)]},
+                                 {'vitamins': 'VitA'},
+                                 ['fruits']):
+            with self.assertRaises(ValueError, msg="test err 'test_invalid_catalogs_rejected', {!r} imported".format(
+                    received_catalog)):
+                importer.import_catalog(test_db, received_catalog)
+
+        with db_session:
+            self.assertIsNone(test_db.Fruit.get(name='fruit_C'))
@@ -0,0 +1,64 @@
+import re
+from http import HTTPStatus
+from unittest import TestCase, mock
+
+import JuiceShop.common as c
+from JuiceShop import catalog, juice_shop_app
+from JuiceShop.instrumentation import Histogram
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+        catalog.invalidate(test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_server_timing_and_metrics(self):
+        test_app = juice_shop_app.create_app().test_client()
+
+        response = test_app.get(c.API_VERSION + '/juices')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        server_timing = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries", serialize;dur=[\d.]+, handler;dur=[\d.]+',
+                                     response.headers['Server-Timing'])
+        self.assertIsNotNone(server_timing, msg="test err 'test_server_timing_and_metrics', unexpected Server-Timing "
+                                                "{}".format(response.headers['Server-Timing']))
+        self.assertEqual(server_timing.group(1), '1')
+
+        test_app.get(c.API_VERSION + '/order/unknown')
+        response = test_app.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        metrics = response.data.decode('utf-8')
+        self.assertIn('juice_shop_requests_total{route="/v1/juices",method="GET",status="200"} 1', metrics)
+        self.assertIn('juice_shop_requests_total{route="/v1/order/<string:payment_id>",method="GET",status="404"} 1',
+                      metrics)
+        self.assertIn('juice_shop_request_queries_bucket{route="/v1/juices",method="GET",le="1"} 1', metrics)
+        self.assertIn('juice_shop_request_duration_seconds_count{route="/v1/juices",method="GET"} 1', metrics)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_switched_off(self):
+        test_app = juice_shop_app.create_app({'INSTRUMENTATION': False}).test_client()
+
+        response = test_app.get(c.API_VERSION + '/liquids')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(test_app.get('/metrics').status_code, HTTPStatus.NOT_FOUND)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.render('m', 'r="x"'), [
+            'm_bucket{r="x",le="1"} 2',
+            'm_bucket{r="x",le="5"} 3',
+            'm_bucket{r="x",le="+Inf"} 4',
+            'm_sum{r="x"} 11.5',
+            'm_count{r="x"} 4',
+        ])
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+from pony.orm import db_session
+
+from JuiceShop.database import migrations, models
+
+# The lookup tables as they were created before the names and the payment id were declared unique.
+OLD_SCHEMA = """
+CREATE TABLE "Fruit" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT, "price" INTEGER, "description" TEXT,
+                      "image" TEXT);
+CREATE TABLE "Liquid" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT, "price" INTEGER, "description" TEXT,
+                       "image" TEXT);
+CREATE TABLE "Vitamin" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT, "description" TEXT);
+CREATE TABLE "Order" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "price" INTEGER, "payment_id" TEXT,
+                      "order_at" DATETIME, "is_paid" BOOLEAN);
+"""
+
+
+class MigrationsTestCase(TestCase):
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False).name
+        with sqlite3.connect(self.db_file) as connection:
+            connection.executescript(OLD_SCHEMA)
+            connection.execute('INSERT INTO "Fruit" ("name", "price") VALUES (\'fruit_A\', 200), (\'\', 0), (\'\', 0)')
+
+    def tearDown(self):
+        os.remove(self.db_file)
+
+    def index_names(self) -> set:
+        with sqlite3.connect(self.db_file) as connection:
+            return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    def test_upgrade_creates_indexes(self):
+        with sqlite3.connect(self.db_file) as connection:
+            connection.execute('INSERT INTO "Liquid" ("name", "price") VALUES (\'Água\', 100)')
+        db = models.define_db(provider='sqlite', filename=self.db_file, create_tables=False)
+        migrations.upgrade(db)
+        migrations.upgrade(db)
+        db.disconnect()
+
+        self.assertTrue({index_name for index_name, _, _, _ in migrations.INDEXES} <= self.index_names(),
+                        msg="test err 'test_upgrade_creates_indexes', missing indexes {}".format(self.index_names()))
+        with sqlite3.connect(self.db_file) as connection:
+            self.assertRaises(sqlite3.IntegrityError, connection.execute,
+                              'INSERT INTO "Fruit" ("name", "price") VALUES (\'fruit_A\', 300)')
+            self.assertIn('snapshot', [row[1] for row in connection.execute('PRAGMA table_info("Order")')])
+            self.assertEqual(connection.execute('SELECT "lower_name" FROM "Liquid"').fetchall(), [('água',)])
+
+    def test_upgrade_refuses_duplicates(self):
+        with sqlite3.connect(self.db_file) as connection:
+            connection.execute('INSERT INTO "Fruit" ("name", "price") VALUES (\'fruit_A\', 300)')
+        db = models.define_db(provider='sqlite', filename=self.db_file, create_tables=False)
+
+        with self.assertRaisesRegex(Exception, 'unq_fruit__name.*fruit_A'):
+            migrations.upgrade(db)
+        db.disconnect()
+
+        with db_session:
+            self.assertEqual(db.Fruit.select().count(), 4)
@@ -0,0 +1,35 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop.database import models
+
+
+class DefineDbTestCase(TestCase):
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False).name
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_file + suffix):
+                os.remove(self.db_file + suffix)
+
+    def test_pragma_profile_applied(self):
+        db = models.define_db(provider='sqlite', filename=self.db_file, pragmas=c.SQLITE_PROFILES['wal'])
+
+        with db_session:
+            self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(db.execute('PRAGMA busy_timeout').fetchone()[0], c.SQLITE_PROFILES['wal']['busy_timeout'])
+        db.disconnect()
+
+    def test_default_profile(self):
+        db = models.define_db(provider='sqlite', filename=self.db_file, pragmas=c.SQLITE_PROFILES['default'])
+
+        with db_session:
+            self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        db.disconnect()
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import time
+from threading import BoundedSemaphore
+from unittest import TestCase, mock
+
+import JuiceShop.common as c
+from JuiceShop import notifications
+from JuiceShop.juice_shop_app import app
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+
+class SharedPaymentEventsTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_publish_wakes_other_processes(self):
+        # two instances on the same file behave as two worker processes
+        publisher, waiter = notifications.PubSub(), notifications.PubSub()
+        publisher.share(self.path)
+        waiter.share(self.path)
+
+        with waiter.listen('order_1') as listener, waiter.listen('order_2') as other:
+            started_at = time.perf_counter()
+            self.assertEqual(publisher.publish('order_1', True), 0)
+            self.assertTrue(listener.wait(5))
+            self.assertLess(time.perf_counter() - started_at, 2,
+                            msg="test err 'test_publish_wakes_other_processes', the waiter wasn't signalled")
+            self.assertIsNone(listener.message)
+            self.assertFalse(other.wait(0.3))
+
+
+@mock.patch('JuiceShop.juice_shop_app.db', test_db)
+class WaitingThreadsTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_waits_beyond_the_limit_answered_at_once(self):
+        test_app = app.test_client()
+        order = test_app.post(c.API_VERSION + '/order', json={'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+        endpoint = c.API_VERSION + '/order/{}?wait=10'.format(json.loads(order.data)['payment_id'])
+
+        with mock.patch('JuiceShop.juice_shop_app._waiting_threads', BoundedSemaphore(1)) as waiting_threads:
+            # another request already holds the only waiting thread
+            waiting_threads.acquire()
+            started_at = time.perf_counter()
+            response = test_app.get(endpoint)
+
+        self.assertLess(time.perf_counter() - started_at, 5,
+                        msg="test err 'test_waits_beyond_the_limit_answered_at_once', the request waited")
+        self.assertFalse(json.loads(response.data)['is_paid'])
@@ -0,0 +1,77 @@
+import datetime as dt
+from unittest import TestCase
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import orders
+from JuiceShop.database import query
+from JuiceShop.tests.view_tests import populate_database, test_db
+
+order_at = dt.datetime(year=2020, month=1, day=1, hour=5)
+
+
+def count_selects(db) -> int:
+    return sum(stat.db_count for sql, stat in db.local_stats.items() if sql is not None and sql.startswith('SELECT'))
+
+
+class OrdersTestCase(TestCase):
+
+    def setUp(self):
+        self.test_db = test_db
+        self.test_db.create_tables()
+        populate_database(self.test_db)
+
+    def tearDown(self):
+        self.test_db.drop_all_tables(with_all_data=True)
+
+    def test_ingredients_resolved_once_per_order(self):
+        small_order = {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]}
+        large_order = {'order': [{'fruits': ['fruit_A', 'fruit_B'], 'liquid': 'liquid_{}'.format(name)}
+                                 for name in 'ABABABABAB']}
+
+        selects = []
+        for payment_id, received_order in (('small', small_order), ('large', large_order)):
+            test_db.merge_local_stats()
+            with db_session:
+                orders.create_order(test_db, received_order, payment_id=payment_id, order_at=order_at)
+            selects.append(count_selects(test_db))
+
+        self.assertEqual(selects[0], selects[1],
+                         msg="test err 'test_ingredients_resolved_once_per_order', selects grew with the order size")
+
+    def test_unknown_ingredients(self):
+        received_order = {'order': [
+            {'fruits': ['fruit_A', 'fruit_Z'], 'liquid': 'liquid_A'},
+            {'fruits': ['fruit_B'], 'liquid': 'liquid_Z'}
+        ]}
+
+        with db_session:
+            new_order = orders.create_order(test_db, received_order, payment_id='unknown', order_at=order_at)
+            self.assertEqual(new_order.price, 400)
+            self.assertEqual([j.price for j in new_order.juices], [400])
+            self.assertEqual(test_db.Juice.select().count(), 1)
+
+    def test_order_read_from_snapshot(self):
+        received_order = {'order': [{'fruits': ['fruit_A', 'fruit_B'], 'liquid': 'liquid_A'},
+                                    {'fruits': ['fruit_B'], 'liquid': 'liquid_B'}]}
+        with db_session:
+            orders.create_order(test_db, received_order, payment_id='snapshot', order_at=order_at)
+        with db_session:
+            expected = c.order_to_dict(query.get_order_record(test_db, 'snapshot'))
+            test_db.Fruit.get(name='fruit_B').price = 900
+
+        test_db.merge_local_stats()
+        with db_session:
+            order_dict = c.order_to_dict(query.get_order_record(test_db, 'snapshot'))
+            self.assertEqual(test_db.local_stats[None].db_count, 1,
+                             msg="test err 'test_order_read_from_snapshot', order read took more than one query")
+        self.assertEqual(order_dict, expected)
+        self.assertEqual(order_dict['juices'][1]['fruits'], [{'name': 'fruit_B', 'price': 4.0}])
+
+        with db_session:
+            test_db.Order.get(payment_id='snapshot').snapshot = None
+        with db_session:
+            legacy_dict = c.order_to_dict(query.get_order_record(test_db, 'snapshot'))
+        legacy_juice = [juice for juice in legacy_dict['juices'] if juice['liquid']['name'] == 'liquid_B'][0]
+        self.assertEqual(legacy_juice['fruits'], [{'name': 'fruit_B', 'price': 9.0}])
@@ -0,0 +1,73 @@
+import datetime as dt
+from http import HTTPStatus
+from typing import NamedTuple
+from unittest import TestCase, mock
+
+import JuiceShop.common as c
+from JuiceShop import payloads
+from JuiceShop.juice_shop_app import app
+from JuiceShop.tests.view_tests import test_db
+
+
+class Row(NamedTuple):
+    name: str
+    price: int
+
+
+class PayloadsTestCase(TestCase):
+
+    def assertInvalid(self, value, schema, message: str):
+        with self.assertRaises(payloads.PayloadError) as raised:
+            payloads.validate(value, schema)
+        self.assertEqual(str(raised.exception), 'Invalid payload - ' + message)
+
+    def test_validate(self):
+        payloads.validate({'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A', 'extra': 1}]}, payloads.ORDER)
+        payloads.validate({'name': 'fruit_A', 'price': 2, 'description': '', 'image': '', 'vitamins': []},
+                          payloads.FRUIT)
+
+        self.assertInvalid([], payloads.ORDER, 'body must be an object')
+        self.assertInvalid({'order': [{'fruits': []}]}, payloads.ORDER, 'body.order[0].liquid is missing')
+        self.assertInvalid({'order': [{'fruits': 'fruit_A', 'liquid': 'liquid_A'}]}, payloads.ORDER,
+                           'body.order[0].fruits must be a list')
+        self.assertInvalid({'fruits': [1], 'liquid': 'liquid_A'}, payloads.JUICE, 'body.fruits[0] must be a string')
+        self.assertInvalid({'is_paid': 1}, payloads.PAYMENT, 'body.is_paid must be a boolean')
+        self.assertInvalid({'name': 'fruit_A', 'price': True}, payloads.LIQUID, 'body.price must be a number')
+        for price in (float('inf'), float('nan'), 1e300, 10 ** 400, -1):
+            self.assertInvalid({'name': 'fruit_A', 'price': price}, payloads.LIQUID,
+                               'body.price must be from 0 to 21474836.47')
+        self.assertInvalid({'fruits': ['fruit_A'] * (c.PAYLOAD_MAX_ARRAY_LENGTH + 1), 'liquid': 'liquid_A'},
+                           payloads.JUICE, 'body.fruits has more than {} items'.format(c.PAYLOAD_MAX_ARRAY_LENGTH))
+
+    def test_json_backends_encode_the_same_bytes(self):
+        payload = {'b': [1, 2.5, None, True], 'a': {'at': dt.datetime(2020, 1, 1, 5)}, 'row': Row('açaí', 200)}
+        encoded = c.to_json_bytes(payload)
+        decoded = c.from_json_bytes(encoded)
+        with mock.patch('JuiceShop.common.orjson', None):
+            self.assertEqual(c.to_json_bytes(payload), encoded)
+            self.assertEqual(c.from_json_bytes(encoded), decoded)
+        self.assertEqual(encoded, b'{"a":{"at":"Wed, 01 Jan 2020 05:00:00 GMT"},"b":[1,2.5,null,true],'
+                                  b'"row":["a\xc3\xa7a\xc3\xad",200]}\n')
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_rejected_before_database_work(self):
+        test_app = app.test_client()
+
+        test_db.merge_local_stats()
+        responses = [
+            test_app.post(c.API_VERSION + '/order', data=b'{"order": [', content_type='application/json'),
+            test_app.post(c.API_VERSION + '/order', json={'order': [{'fruits': ['fruit_A']}]}),
+            test_app.put(c.API_VERSION + '/order/1010101010', json={'is_paid': 'yes'}),
+            test_app.post(c.API_VERSION + '/juice/description', json={'fruits': 'fruit_A', 'liquid': 'liquid_A'}),
+            test_app.put(c.API_VERSION + '/fruits/store', data=b'{"name": "fruit_C", "price": 1e300, "description": '
+                                                              b'"", "image": "", "vitamins": []}',
+                         content_type='application/json'),
+        ]
+        self.assertEqual([response.status_code for response in responses], [HTTPStatus.BAD_REQUEST] * 5)
+        self.assertEqual(responses[1].data, b'Invalid payload - body.order[0].liquid is missing')
+
+        response = test_app.put(c.API_VERSION + '/liquids/store', data=b' ' * (c.PAYLOAD_MAX_SIZE + 1),
+                                content_type='application/json')
+        self.assertEqual(response.status_code, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(sum(stat.db_count for stat in test_db.local_stats.values()), 0,
+                         msg="test err 'test_rejected_before_database_work', an invalid body queried the database")
@@ -0,0 +1,50 @@
+import sqlite3
+from threading import Thread
+from unittest import TestCase
+
+from JuiceShop.database.pool import BoundedPool, ConnectionPool
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.opened = []
+        self.shared = ConnectionPool(self.connect, size=2, timeout=0.05)
+
+    def connect(self):
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.opened.append(connection)
+        return connection
+
+    def test_connections_reused(self):
+        connection, is_new = self.shared.acquire()
+        self.shared.release(connection)
+        reused, is_new_again = self.shared.acquire()
+
+        self.assertEqual((is_new, is_new_again), (True, False))
+        self.assertIs(connection, reused)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_pool_size_bounded(self):
+        self.shared.acquire()
+        connection, _ = self.shared.acquire()
+        self.assertRaises(TimeoutError, self.shared.acquire)
+
+        self.shared.discard(connection)
+        self.shared.acquire()
+        self.assertEqual(len(self.opened), 3)
+
+    def test_threads_share_connections(self):
+        pool = BoundedPool(self.shared)
+
+        def run_session():
+            connection, _ = pool.connect()
+            self.assertIs(pool.connect()[0], connection)
+            pool.release(connection)
+
+        for _ in range(5):
+            thread = Thread(target=run_session)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(self.opened), 1)
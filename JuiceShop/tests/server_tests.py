@@ -0,0 +1,134 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+from unittest import TestCase, skipUnless
+
+import JuiceShop.common as c
+
+# the master runs in its own process, as it handles signals and forks
+SERVER_SCRIPT = """
+import sys
+from JuiceShop import juice_shop_app, server
+
+app = juice_shop_app.create_app({'DB_CONFIG': dict(provider='sqlite', filename=sys.argv[1], create_db=True),
+                                 'DB_CREATE_TABLES': True})
+server.PreforkServer(app, '127.0.0.1', int(sys.argv[2]), workers=2, threads=1, graceful_timeout=10).run()
+"""
+
+# no thread per worker, so every worker fails when it starts
+FAILING_SERVER_SCRIPT = """
+import sys
+from JuiceShop import juice_shop_app, server
+
+app = juice_shop_app.create_app({'DB_CONFIG': dict(provider='sqlite', filename=sys.argv[1], create_db=True),
+                                 'DB_CREATE_TABLES': True})
+server.PreforkServer(app, '127.0.0.1', 0, workers=1, threads=0, max_start_failures=3).run()
+"""
+
+
+def request(port: int, method: str, path: str, payload=None) -> tuple:
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def worker_pids(master_pid: int) -> set:
+    with open('/proc/{}/task/{}/children'.format(master_pid, master_pid)) as children:
+        return set(children.read().split())
+
+
+@skipUnless(sys.platform.startswith('linux'), 'forks, and lists the workers from /proc')
+class PreforkServerTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.master = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, os.path.join(self.directory.name, 'db'),
+                                        str(self.port)], cwd=root)
+        for _ in range(100):
+            try:
+                request(self.port, 'GET', c.API_VERSION + '/liquids')
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+        self.directory.cleanup()
+
+    def test_reload_and_graceful_stop(self):
+        self.assertEqual(request(self.port, 'GET', c.API_VERSION + '/liquids'), (200, b'{"liquids":[]}\n'))
+        workers = worker_pids(self.master.pid)
+        self.assertEqual(len(workers), 2)
+
+        self.master.send_signal(signal.SIGHUP)
+        for _ in range(100):
+            if not worker_pids(self.master.pid) & workers:
+                break
+            time.sleep(0.05)
+        self.assertFalse(worker_pids(self.master.pid) & workers,
+                         msg="test err 'test_reload_and_graceful_stop', the workers weren't replaced on SIGHUP")
+        status, body = request(self.port, 'POST', c.API_VERSION + '/order', {'order': []})
+        self.assertEqual(status, 200)
+
+        # a request being served when the server is stopped is still answered
+        waiting = []
+        endpoint = c.API_VERSION + '/order/{}?wait=1'.format(json.loads(body)['payment_id'])
+        waiter = Thread(target=lambda: waiting.append(request(self.port, 'GET', endpoint)))
+        waiter.start()
+        time.sleep(0.3)
+        self.master.send_signal(signal.SIGTERM)
+        waiter.join()
+
+        self.assertEqual(waiting[0][0], 200)
+        self.assertEqual(self.master.wait(timeout=10), 0)
+
+    def test_busy_worker_leaves_connections_to_the_others(self):
+        status, body = request(self.port, 'POST', c.API_VERSION + '/order', {'order': []})
+        endpoint = c.API_VERSION + '/order/{}?wait=3'.format(json.loads(body)['payment_id'])
+        # a request holding the only thread of one of the workers
+        waiter = Thread(target=request, args=(self.port, 'GET', endpoint))
+        waiter.start()
+        time.sleep(0.3)
+
+        started_at = time.perf_counter()
+        self.assertEqual(request(self.port, 'GET', c.API_VERSION + '/liquids')[0], 200)
+        self.assertLess(time.perf_counter() - started_at, 2,
+                        msg="test err 'test_busy_worker_leaves_connections_to_the_others', a busy worker accepted it")
+        waiter.join()
+
+
+@skipUnless(sys.platform.startswith('linux'), 'forks')
+class FailingWorkersTestCase(TestCase):
+
+    def test_workers_failing_to_start_replaced_with_delay(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with tempfile.TemporaryDirectory() as directory:
+            started_at = time.perf_counter()
+            master = subprocess.run([sys.executable, '-c', FAILING_SERVER_SCRIPT, os.path.join(directory, 'db')],
+                                    cwd=root, capture_output=True, timeout=30)
+            elapsed = time.perf_counter() - started_at
+
+        self.assertNotEqual(master.returncode, 0)
+        self.assertIn(b'Unable to serve - 3 workers in a row failed to start', master.stderr)
+        self.assertEqual(master.stderr.count(b'failed to start with status 1, replacing it in'), 2,
+                         msg="test err 'test_workers_failing_to_start_replaced_with_delay', {}".format(master.stderr))
+        # replaced after 0.1 then 0.2 seconds
+        self.assertGreater(elapsed, 0.3)
@@ -1,6 +1,9 @@
 import datetime as dt
 import json
+import os
+import time
 from http import HTTPStatus
+from threading import Thread
 from unittest import TestCase, mock
 
 from deepdiff import DeepDiff
@@ -8,11 +11,21 @@ import pytz
 from pony.orm import db_session
 
 import JuiceShop.common as c
-from JuiceShop.database import models
+from JuiceShop import catalog
+from JuiceShop.database import models, query
 from JuiceShop.juice_shop_app import app
 
+# JUICE_SHOP_TEST_DB selects the backend the tests run against: 'sqlite' (a file, the default), 'sharedmemory' (SQLite
+# in shared-cache memory, nothing to install or clean up) or 'postgres' (the JUICE_SHOP_DB_* server, using the
+# JUICE_SHOP_TEST_DB_NAME database, whose tables are dropped by the tests).
+DB_BACKEND_TEST = os.environ.get('JUICE_SHOP_TEST_DB', 'sqlite')
 DB_FILE_TEST = 'test_db'
-DB_CONFIG_TEST = dict(provider='sqlite', filename=DB_FILE_TEST, create_db=True)
+DB_CONFIGS_TEST = {
+    'sqlite': dict(provider='sqlite', filename=DB_FILE_TEST, create_db=True),
+    'sharedmemory': dict(provider='sqlite', filename=':sharedmemory:'),
+    'postgres': dict(c.POSTGRES_CONFIG, database=os.environ.get('JUICE_SHOP_TEST_DB_NAME', 'juice_shop_test')),
+}
+DB_CONFIG_TEST = DB_CONFIGS_TEST[DB_BACKEND_TEST]
 
 test_db = models.define_db(**DB_CONFIG_TEST)
 
@@ -98,10 +111,10 @@ def populate_database(db):
 class ApiTestCase(TestCase):
 
     def setUp(self):
-        self.test_db = models.define_db(provider=DB_CONFIG_TEST['provider'],
-                                        filename=DB_CONFIG_TEST['filename'],
-                                        create_db=True)
+        self.test_db = test_db
+        self.test_db.create_tables()
         populate_database(self.test_db)
+        catalog.invalidate(test_db)
 
     def tearDown(self):
         self.test_db.drop_all_tables(with_all_data=True)
@@ -144,6 +157,29 @@ class ApiTestCase(TestCase):
             msg="test err 'test_get_all_liquids' response."
         )
 
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_catalog_conditional_get(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/fruits'
+
+        response = test_app.get(endpoint)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age={}'.format(c.CATALOG_MAX_AGE))
+
+        test_db.merge_local_stats()
+        response = test_app.get(endpoint, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual((response.data, response.headers['ETag']), (b'', etag))
+        self.assertEqual(test_db.local_stats[None].db_count, 0,
+                         msg="test err 'test_catalog_conditional_get', HTTP 304 queried the database")
+
+        payload = {"name": "liquid_C", "description": "some description liquid_C", "price": 3.00,
+                   "image": "some_url_path_liquid_C"}
+        test_app.put(c.API_VERSION + '/liquids/store', json=payload)
+        response = test_app.get(endpoint, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     @mock.patch('JuiceShop.juice_shop_app.db', test_db)
     def test_store_new_fruit(self):
         test_app = app.test_client()
@@ -167,6 +203,75 @@ class ApiTestCase(TestCase):
             msg="test err 'test_store_new_fruit' response."
         )
 
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_update_existing_fruit(self):
+        test_app = app.test_client()
+
+        payload = {
+            "name": "fruit_A",
+            "vitamins": ["VitB"],
+            "description": "new description fruit_A",
+            "price": 2.5,
+            "image": "some_image_fruit_A"
+        }
+        response = test_app.put(c.API_VERSION + '/fruits/store', json=payload)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        fruits = json.loads(test_app.get(c.API_VERSION + '/fruits').data.decode('utf-8'))['fruits']
+        self.assertEqual([(f['price'], f['description']) for f in fruits if f['name'] == 'fruit_A'],
+                         [(2.5, 'new description fruit_A')])
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_prices_stored_alike_by_store_and_import(self):
+        test_app = app.test_client()
+
+        test_app.put(c.API_VERSION + '/fruits/store', json={"name": "fruit_C", "vitamins": [], "description": "",
+                                                            "price": 1.15, "image": ""})
+        test_app.put(c.API_VERSION + '/liquids/store', json={"name": "liquid_C", "description": "", "price": 1.15,
+                                                             "image": ""})
+        test_app.put(c.API_VERSION + '/catalog/import', json={'fruits': [{'name': 'fruit_D', 'price': 1.15}],
+                                                              'liquids': [{'name': 'liquid_D', 'price': 1.15}]})
+
+        with db_session:
+            prices = [test_db.Fruit.get(name='fruit_C').price, test_db.Liquid.get(name='liquid_C').price,
+                      test_db.Fruit.get(name='fruit_D').price, test_db.Liquid.get(name='liquid_D').price]
+        self.assertEqual(prices, [115] * 4, msg="test err 'test_prices_stored_alike_by_store_and_import', {}".format(
+            prices))
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_store_name_differing_by_case(self):
+        test_app = app.test_client()
+
+        fruit = {"name": "FRUIT_A", "vitamins": [], "description": "", "price": 2.5, "image": ""}
+        liquid = {"name": "Liquid_A", "description": "", "price": 2.5, "image": ""}
+        for endpoint, payload in (('/fruits/store', fruit), ('/liquids/store', liquid)):
+            response = test_app.put(c.API_VERSION + endpoint, json=payload)
+            self.assertEqual(response.status_code, HTTPStatus.CONFLICT,
+                             msg="test err 'test_store_name_differing_by_case', {} stored".format(payload['name']))
+
+        with db_session:
+            self.assertEqual(sorted(f.lower_name for f in test_db.Fruit.select()), ['fruit_a', 'fruit_b'])
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_menu_snapshot_invalidation(self):
+        test_app = app.test_client()
+        before = test_app.get(c.API_VERSION + '/liquids').data
+        self.assertIs(catalog.menu_snapshot(test_db).liquids, catalog.menu_snapshot(test_db).liquids,
+                      msg="test err 'test_menu_snapshot_invalidation', snapshot was rebuilt without a write")
+
+        payload = {
+            "name": "liquid_C",
+            "description": "some description liquid_C",
+            "price": 3.00,
+            "image": "some_url_path_liquid_C"
+        }
+        test_app.put(c.API_VERSION + '/liquids/store', json=payload)
+        after = json.loads(test_app.get(c.API_VERSION + '/liquids').data.decode('utf-8'))
+
+        self.assertNotEqual(before, test_app.get(c.API_VERSION + '/liquids').data)
+        self.assertIn('liquid_C', [liquid['name'] for liquid in after['liquids']],
+                      msg="test err 'test_menu_snapshot_invalidation', stored liquid missing from the menu")
+
     @mock.patch('JuiceShop.juice_shop_app.db', test_db)
     def test_store_new_liquid(self):
         test_app = app.test_client()
@@ -189,7 +294,37 @@ class ApiTestCase(TestCase):
             msg="test err 'test_store_new_liquid' response."
         )
 
-    @mock.patch('JuiceShop.juice_shop_app.generate_uuid', fake_uuid)
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_import_catalog(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/catalog/import'
+        etag = test_app.get(c.API_VERSION + '/fruits').headers['ETag']
+
+        payload = ("type,name,price,description,image,vitamins\n"
+                   "vitamin,VitC,,Description VitC,,\n"
+                   "fruit,fruit_A,2.0,Description fruit_A,some_image_fruit_A,VitA\n"
+                   "fruit,fruit_B,4.5,Description fruit_B,some_image_fruit_B,VitB;VitC;VitZ\n"
+                   "liquid,liquid_C,3.0,Description liquid_C,some_image_liquid_C,\n")
+        response = test_app.put(endpoint, data=payload, content_type='text/csv')
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.data), {
+            'vitamins': {'inserted': 1, 'updated': 0, 'skipped': 0},
+            'fruits': {'inserted': 0, 'updated': 1, 'skipped': 1},
+            'liquids': {'inserted': 1, 'updated': 0, 'skipped': 0},
+            'unknown_vitamins': ['VitZ']
+        })
+        response = test_app.get(c.API_VERSION + '/fruits', headers={'If-None-Match': etag})
+        fruit_b = json.loads(response.data)['fruits'][1]
+        self.assertEqual((fruit_b['price'], sorted(v['name'] for v in fruit_b['vitamins'])), (4.5, ['VitB', 'VitC']))
+
+        payload = {'liquids': [{'name': 'liquid_D', 'price': 1.0}, {'name': 'liquid_E', 'price': 'free'}]}
+        response = test_app.put(endpoint, json=payload)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        with db_session:
+            self.assertIsNone(test_db.Liquid.get(name='liquid_D'),
+                              msg="test err 'test_import_catalog', invalid catalog partially stored")
+
     @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
     @mock.patch('JuiceShop.juice_shop_app.db', test_db)
     def test_order_creation(self):
@@ -212,6 +347,7 @@ class ApiTestCase(TestCase):
                     {"fruits": [{"name": "fruit_A", "price": 2.0}], "liquid": {"name": "liquid_A", "price": 2.0},
                      "price": 4.0}], "order_at": "Wed, 01 Jan 2020 05:00:00 GMT", "payment_id": "1010101010",
                                       "price": 4.0},
+                'payment_id': uuid_value,
                 'expected_http_code': HTTPStatus.OK
             },
             {
@@ -237,14 +373,16 @@ class ApiTestCase(TestCase):
                     {'fruits': [{'name': 'fruit_A', 'price': 2.0}, {'name': 'fruit_B', 'price': 4.0}],
                      'liquid': {'name': 'liquid_B', 'price': 4.0}, 'price': 10.0},
                     {'fruits': [{'name': 'fruit_B', 'price': 4.0}], 'liquid': {'name': 'liquid_B', 'price': 4.0},
-                     'price': 8.0}], 'order_at': 'Wed, 01 Jan 2020 05:00:00 GMT', 'payment_id': '1010101010',
+                     'price': 8.0}], 'order_at': 'Wed, 01 Jan 2020 05:00:00 GMT', 'payment_id': '2020202020',
                                       'price': 18.0},
+                'payment_id': '2020202020',
                 'expected_http_code': HTTPStatus.OK
             }
         ]
 
         for test in testcases:
-            response = test_app.post(endpoint, json=test['payload'])
+            with mock.patch('JuiceShop.juice_shop_app.generate_uuid', return_value=test['payment_id']):
+                response = test_app.post(endpoint, json=test['payload'])
             self.assertEqual(
                 response.status_code, test['expected_http_code'],
                 msg="test err {}, expected HTTP code {}, got {}".format(test['name'],
@@ -256,6 +394,29 @@ class ApiTestCase(TestCase):
                 self.fail("test err {}, expected response {}, got {}".format(test['name'],
                                                                              test['expected_response'], response_dict))
 
+    @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_idempotent_order(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/order'
+        headers = {'Idempotency-Key': 'test_idempotent_order'}
+        order_payload = {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]}
+
+        first = test_app.post(endpoint, json=order_payload, headers=headers)
+        retry = test_app.post(endpoint, json=order_payload, headers=headers)
+
+        self.assertEqual((first.status_code, retry.status_code), (HTTPStatus.OK, HTTPStatus.OK))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        with db_session:
+            self.assertEqual(test_db.Order.select().count(), 1,
+                             msg="test err 'test_idempotent_order', the retry created another order")
+
+        order_payload['order'][0]['liquid'] = 'liquid_B'
+        response = test_app.post(endpoint, json=order_payload, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+
     @mock.patch('JuiceShop.juice_shop_app.generate_uuid', fake_uuid)
     @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
     @mock.patch('JuiceShop.juice_shop_app.db', test_db)
@@ -293,6 +454,135 @@ class ApiTestCase(TestCase):
             msg="test err 'test_update_order' response {}".format(response.data)
         )
 
+    @mock.patch('JuiceShop.juice_shop_app.generate_uuid', fake_uuid)
+    @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_wait_for_payment(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/order/' + uuid_value
+        test_app.post(c.API_VERSION + '/order', json={'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+
+        response = test_app.get(endpoint + '?wait=0.05')
+        self.assertFalse(json.loads(response.data)['is_paid'])
+        self.assertEqual(test_app.get(endpoint + '?wait=61').status_code, HTTPStatus.BAD_REQUEST)
+
+        responses = []
+        waiter = Thread(target=lambda: responses.append(app.test_client().get(endpoint + '?wait=10')))
+        started_at = time.perf_counter()
+        waiter.start()
+        time.sleep(0.1)
+        test_app.put(endpoint, json={'is_paid': True})
+        waiter.join()
+
+        self.assertLess(time.perf_counter() - started_at, 5,
+                        msg="test err 'test_wait_for_payment', the waiting request wasn't notified")
+        self.assertTrue(json.loads(responses[0].data)['is_paid'])
+
+    @mock.patch('JuiceShop.juice_shop_app.generate_uuid', fake_uuid)
+    @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_analytics(self):
+        test_app = app.test_client()
+        order_payload = {'order': [{'fruits': ['fruit_B', 'fruit_A'], 'liquid': 'liquid_A'}]}
+        test_app.post(c.API_VERSION + '/order', json=order_payload)
+        test_app.put(c.API_VERSION + '/order/' + uuid_value, json={'is_paid': True})
+
+        response = test_app.get(c.API_VERSION + '/analytics/combinations?since=2020-01-01T00:00:00')
+        self.assertEqual(json.loads(response.data),
+                         {'combinations': [{'fruits': ['fruit_A', 'fruit_B'], 'juices': 1, 'revenue': 8.0}]})
+
+        response = test_app.get(c.API_VERSION + '/analytics/revenue?by=fruit&period=hour')
+        self.assertEqual([(r['bucket'], r['fruit']) for r in json.loads(response.data)['revenue']],
+                         [('Wed, 01 Jan 2020 05:00:00 GMT', 'fruit_A'), ('Wed, 01 Jan 2020 05:00:00 GMT', 'fruit_B')])
+
+        response = test_app.get(c.API_VERSION + '/analytics/payments')
+        self.assertEqual(json.loads(response.data)['total'],
+                         {'orders': 1, 'paid': 1, 'unpaid': 0, 'paid_ratio': 1.0, 'revenue': 8.0, 'paid_revenue': 8.0})
+
+        for query_string in ('combinations?limit=0', 'combinations?since=yesterday', 'revenue?by=vitamin',
+                             'payments?period=week'):
+            self.assertEqual(test_app.get(c.API_VERSION + '/analytics/' + query_string).status_code,
+                             HTTPStatus.BAD_REQUEST)
+
+    @mock.patch('JuiceShop.juice_shop_app.generate_uuid', fake_uuid)
+    @mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime)
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_get_juices_pagination(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/juices'
+
+        order_payload = {
+            'order': [
+                {'fruits': ['fruit_A', 'fruit_B'], 'liquid': 'liquid_A'},
+                {'fruits': ['fruit_B'], 'liquid': 'liquid_B'}
+            ]
+        }
+        test_app.post(c.API_VERSION + '/order', json=order_payload)
+
+        first_page = json.loads(test_app.get(endpoint + '?limit=1').data.decode('utf-8'))
+        second_page = json.loads(test_app.get(
+            endpoint + '?limit=1&after={}'.format(first_page['next_after'])).data.decode('utf-8'))
+        last_page = json.loads(test_app.get(
+            endpoint + '?limit=1&after={}'.format(second_page['next_after'])).data.decode('utf-8'))
+
+        expected = [
+            {'fruits': [{'name': 'fruit_A', 'price': 2.0}, {'name': 'fruit_B', 'price': 4.0}],
+             'liquid': {'name': 'liquid_A', 'price': 2.0}, 'price': 8.0,
+             'order_datetime': 'Wed, 01 Jan 2020 05:00:00 GMT', 'order_total': 16.0},
+            {'fruits': [{'name': 'fruit_B', 'price': 4.0}], 'liquid': {'name': 'liquid_B', 'price': 4.0},
+             'price': 8.0, 'order_datetime': 'Wed, 01 Jan 2020 05:00:00 GMT', 'order_total': 16.0},
+        ]
+        received = first_page['juices'] + second_page['juices']
+        ddiff = DeepDiff(received, expected, ignore_order=True, exclude_regex_paths=r"\['id'\]")
+        if len(ddiff) != 0:
+            self.fail("test err 'test_get_juices_pagination', expected {}, got {}".format(expected, received))
+        self.assertEqual(last_page, {'juices': [], 'next_after': None})
+
+        response = test_app.get(endpoint + '?limit=0')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_get_juices_since_reads_the_fruits_of_the_page(self):
+        test_app = app.test_client()
+        for _ in range(3):
+            test_app.post(c.API_VERSION + '/order', json={'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]})
+        with db_session:
+            orders = test_db.Order.select().order_by(lambda o: o.id)[:]
+            orders[1].order_at = orders[0].order_at - dt.timedelta(days=1)
+            since = orders[0].order_at.isoformat()
+            juice_ids = [juice.id for order in (orders[0], orders[2]) for juice in order.juices]
+
+        with mock.patch('JuiceShop.database.query.get_juice_fruits', wraps=query.get_juice_fruits) as juice_fruits:
+            page = json.loads(test_app.get(c.API_VERSION + '/juices', query_string={'since': since}).data)
+
+        self.assertEqual([juice['id'] for juice in page['juices']], juice_ids)
+        self.assertEqual(list(juice_fruits.call_args[0][1]), juice_ids,
+                         msg="test err 'test_get_juices_since_reads_the_fruits_of_the_page', juices between read")
+
+    @mock.patch('JuiceShop.juice_shop_app.generate_uuid', side_effect=['1010101010', '2020202020', '3030303030'])
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_get_juices_ndjson_export(self, _):
+        test_app = app.test_client()
+        order_payload = {'order': [{'fruits': ['fruit_A'], 'liquid': 'liquid_A'}]}
+
+        with mock.patch('JuiceShop.juice_shop_app.current_datetime', fake_current_datetime):
+            test_app.post(c.API_VERSION + '/order', json=order_payload)
+            test_app.post(c.API_VERSION + '/order', json=order_payload)
+        with mock.patch('JuiceShop.juice_shop_app.current_datetime', lambda: current_clock + dt.timedelta(days=1)):
+            test_app.post(c.API_VERSION + '/order', json=order_payload)
+
+        with mock.patch('JuiceShop.common.JUICES_EXPORT_CHUNK_SIZE', 2):
+            response = test_app.get(c.API_VERSION + '/juices', headers={'Accept': c.NDJSON_MIMETYPE})
+            self.assertEqual(response.mimetype, c.NDJSON_MIMETYPE)
+            lines = response.data.decode('utf-8').splitlines()
+            self.assertEqual([json.loads(line)['price'] for line in lines], [4.0, 4.0, 4.0])
+
+            response = test_app.get(c.API_VERSION + '/juices?since=2020-01-02T00:00:00%2B00:00',
+                                    headers={'Accept': c.NDJSON_MIMETYPE})
+            lines = response.data.decode('utf-8').splitlines()
+            self.assertEqual([json.loads(line)['order_datetime'] for line in lines],
+                             ['Thu, 02 Jan 2020 05:00:00 GMT'])
+
     @mock.patch('JuiceShop.juice_shop_app.db', test_db)
     def test_juice_description(self):
         test_app = app.test_client()
@@ -314,9 +604,32 @@ class ApiTestCase(TestCase):
                        {'description': 'Description fruit_B', 'name': 'fruit_B'}],
             'liquid': {'description': 'Description liquid_B', 'name': 'liquid_B'},
             'vitamins': [{'description': 'Description VitA', 'name': 'VitA'},
-                         {'description': 'Description VitA', 'name': 'VitA'},
                          {'description': 'Description VitB', 'name': 'VitB'}]}
 
         ddiff = DeepDiff(response_dict, expected, ignore_order=True)
         if len(ddiff) != 0:
             self.fail("test err 'test_juice_description' response {}".format(expected, response_dict))
+
+    @mock.patch('JuiceShop.juice_shop_app.db', test_db)
+    def test_juice_description_cache(self):
+        test_app = app.test_client()
+        endpoint = c.API_VERSION + '/juice/description'
+
+        first = test_app.post(endpoint, json={'fruits': ['fruit_B', 'fruit_A'], 'liquid': 'liquid_B'})
+        self.assertFalse([sql for sql in test_db.local_stats if sql is not None and 'lower(' in sql.lower()],
+                         msg="test err 'test_juice_description_cache', names lower-cased in SQL, bypassing the index")
+        test_db.merge_local_stats()
+        second = test_app.post(endpoint, json={'fruits': ['FRUIT_A', 'fruit_B', 'fruit_A'], 'liquid': 'Liquid_B'})
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(test_db.local_stats[None].db_count, 0,
+                         msg="test err 'test_juice_description_cache', cached description queried the database")
+
+        payload = {"name": "fruit_A", "vitamins": ["VitB"], "description": "new description fruit_A", "price": 2.0,
+                   "image": "some_image_fruit_A"}
+        test_app.put(c.API_VERSION + '/fruits/store', json=payload)
+        third = json.loads(test_app.post(endpoint, json={'fruits': ['fruit_A'], 'liquid': 'liquid_B'}).data)
+        self.assertEqual(third['fruits'], [{'description': 'new description fruit_A', 'name': 'fruit_A'}])
+
+        response = test_app.post(endpoint, json={'fruits': ['fruit_Z'], 'liquid': 'liquid_B'})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
@@ -0,0 +1,100 @@
+"""
+Measures order throughput and latency with group commit off and at several window sizes.
+
+For each window, a fresh SQLite database receives orders from `--clients` concurrent threads for `--seconds` seconds.
+Window 0 is group commit off: each order is committed by its own thread, as with JUICE_SHOP_GROUP_COMMIT unset. The
+script prints one JSON document with the orders per second and the p50/p95/p99 latencies of each window.
+
+    python -m benchmarks.group_commit --windows 0 1 2 5 --clients 16 --seconds 10
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import tempfile
+import time
+from threading import Thread
+
+from pony.orm import db_session, select
+
+import JuiceShop.common as c
+from JuiceShop import group_commit, ids, orders
+from JuiceShop.database import models
+from benchmarks.run import percentile
+
+ORDER = {'order': [{'fruits': ['fruit_0', 'fruit_1'], 'liquid': 'liquid_0'}]}
+
+
+def create_catalog(db):
+    with db_session:
+        for i in range(2):
+            db.Fruit(name='fruit_{}'.format(i), price=200, description='', image='')
+        db.Liquid(name='liquid_0', price=100, description='', image='')
+
+
+def run(window_ms: float, clients: int, seconds: float, profile: str, directory: str,
+        max_batch: int = c.GROUP_COMMIT_MAX_BATCH) -> dict:
+    db_file = os.path.join(directory, 'group_commit_{}'.format(window_ms))
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    db = models.define_db(provider='sqlite', filename=db_file, create_db=True, pragmas=c.SQLITE_PROFILES[profile])
+    create_catalog(db)
+    writer = group_commit.OrderWriter(db, window=window_ms / 1000, max_batch=max_batch) if window_ms else None
+
+    def create_order():
+        if writer is not None:
+            writer.create_order(ORDER, ids.new_payment_id(), dt.datetime.utcnow())
+            return
+        with db_session:
+            orders.create_order(db, ORDER, payment_id=ids.new_payment_id(), order_at=dt.datetime.utcnow())
+
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            create_order()
+            latencies.append(time.perf_counter() - started)
+
+    threads = [Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with db_session:
+        created = select(o for o in db.Order).count()
+    db.disconnect()
+    os.remove(db_file)
+
+    latencies.sort()
+    return {
+        'orders_per_second': created / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--windows', nargs='+', type=float, default=[0, 1, 2, 5],
+                        help='group commit windows in milliseconds, 0 is group commit off')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent threads creating orders')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each window')
+    parser.add_argument('--max-batch', type=int, default=c.GROUP_COMMIT_MAX_BATCH)
+    parser.add_argument('--profile', default='default', choices=sorted(c.SQLITE_PROFILES))
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where the databases are created')
+    args = parser.parse_args()
+
+    results = {'{:g}'.format(window): run(window, args.clients, args.seconds, args.profile, args.dir, args.max_batch)
+               for window in args.windows}
+    print(json.dumps({'clients': args.clients, 'seconds': args.seconds, 'max_batch': args.max_batch,
+                      'profile': args.profile, 'results': results}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures how fast orders are inserted with each payment id generator, as the unique payment id index grows.
+
+For each generator, a fresh database receives `--orders` orders in transactions of `--chunk` rows. Random ids are
+inserted all over the index, so once it no longer fits in the page cache most inserts read pages from disk; time-ordered
+ids are appended to its end. The script prints one JSON document with the orders per second of each chunk.
+
+    python -m benchmarks.payment_ids --orders 5000000 --chunk 100000
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import ids
+from JuiceShop.database import models
+
+GENERATORS = {
+    # the generator used before payment ids were time-ordered
+    'uuid4_10': lambda: uuid.uuid4().hex[0:10],
+    'uuid4': lambda: uuid.uuid4().hex,
+    'ulid': ids.new_payment_id,
+}
+
+
+def insert_orders(db, generator, orders: int, chunk: int) -> list:
+    """
+    Inserts orders in chunks, one transaction per chunk.
+    :return: a list with the number of orders and the seconds taken of each chunk
+    """
+    sql = 'INSERT INTO "Order" ("price", "payment_id", "order_at", "is_paid") VALUES (?, ?, ?, ?)'
+    order_at = dt.datetime.utcnow().isoformat(' ')
+    timings = []
+    for first in range(0, orders, chunk):
+        rows = [(400, generator(), order_at, False) for _ in range(min(chunk, orders - first))]
+        started = time.perf_counter()
+        with db_session:
+            db.get_connection().cursor().executemany(sql, rows)
+        timings.append((len(rows), time.perf_counter() - started))
+    return timings
+
+
+def run(generator_name: str, orders: int, chunk: int, profile: str, directory: str) -> dict:
+    db_file = os.path.join(directory, 'payment_ids_{}'.format(generator_name))
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    db = models.define_db(provider='sqlite', filename=db_file, create_db=True, pragmas=c.SQLITE_PROFILES[profile])
+    try:
+        timings = insert_orders(db, GENERATORS[generator_name], orders, chunk)
+    finally:
+        db.disconnect()
+    size_mb = os.path.getsize(db_file) / (1024 * 1024)
+    os.remove(db_file)
+
+    rates = [rows / seconds for rows, seconds in timings]
+    return {
+        'orders_per_second': orders / sum(seconds for _, seconds in timings),
+        'last_chunk_orders_per_second': rates[-1],
+        'chunk_orders_per_second': rates,
+        'db_size_mb': size_mb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--chunk', type=int, default=50000, help='orders per transaction')
+    parser.add_argument('--generators', nargs='+', default=sorted(GENERATORS), choices=sorted(GENERATORS))
+    parser.add_argument('--profile', default='wal', choices=sorted(c.SQLITE_PROFILES))
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where the databases are created')
+    args = parser.parse_args()
+
+    results = {name: run(name, args.orders, args.chunk, args.profile, args.dir) for name in args.generators}
+    print(json.dumps({'orders': args.orders, 'chunk': args.chunk, 'profile': args.profile, 'results': results},
+                     indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Benchmarks every /v1 endpoint against a seeded database.
+
+Each route is driven through Flask's test client and through a real threaded WSGI server, with a number of concurrent
+clients. The p50/p95/p99 latencies, the throughput and the peak RSS of the process are written as JSON, and with
+--tracemalloc the peak memory allocated by the requests of each route. When a baseline file is given, the run fails
+if a route got slower than the threshold allows.
+
+    python -m benchmarks.run --fruits 2000 --orders 1000000 --requests 2000 --output results.json
+    python -m benchmarks.run --output new.json --baseline results.json --threshold 0.2
+"""
+import argparse
+import datetime as dt
+import http.client
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from threading import Thread
+
+from pony.orm import db_session, select
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import JuiceShop.common as c
+from JuiceShop import juice_shop_app
+from benchmarks import seed
+
+ROUTES = ('list_fruits', 'list_liquids', 'get_juices', 'receive_order', 'update_payment_status',
+          'get_juice_description', 'get_top_combinations')
+DRIVERS = ('test_client', 'wsgi')
+
+
+class Workload:
+    """
+    Builds random requests for each route, using the names and payment ids of the seeded database.
+    """
+
+    def __init__(self, db, size: seed.SeedSize, seed_value: int = 0):
+        self.size = size
+        self.rng = random.Random(seed_value)
+        with db_session:
+            self.payment_ids = list(select(o.payment_id for o in db.Order).random(1000)) or ['missing']
+            self.max_juice_id = db.Juice.select().count()
+
+    def _juice(self) -> dict:
+        fruits = self.rng.sample(range(self.size.fruits), self.size.fruits_per_juice)
+        return {
+            'fruits': [seed.fruit_name(i) for i in fruits],
+            'liquid': seed.liquid_name(self.rng.randrange(self.size.liquids))
+        }
+
+    def request(self, route: str) -> tuple:
+        """
+        :param route: one of ROUTES.
+        :return: a tuple with the HTTP method, the path and the JSON body (or None).
+        """
+        if route == 'list_fruits':
+            return 'GET', c.API_VERSION + '/fruits', None
+        if route == 'list_liquids':
+            return 'GET', c.API_VERSION + '/liquids', None
+        if route == 'get_juices':
+            after = self.rng.randrange(max(self.max_juice_id - c.JUICES_PAGE_SIZE, 1))
+            return 'GET', c.API_VERSION + '/juices?after={}'.format(after), None
+        if route == 'receive_order':
+            order = {'order': [self._juice() for _ in range(self.size.juices_per_order)]}
+            return 'POST', c.API_VERSION + '/order', order
+        if route == 'update_payment_status':
+            path = c.API_VERSION + '/order/' + self.rng.choice(self.payment_ids)
+            return ('PUT', path, {'is_paid': True}) if self.rng.random() < 0.5 else ('GET', path, None)
+        if route == 'get_juice_description':
+            return 'POST', c.API_VERSION + '/juice/description', self._juice()
+        if route == 'get_top_combinations':
+            since = dt.datetime.utcnow() - dt.timedelta(days=self.rng.randrange(1, self.size.history_days + 1))
+            return 'GET', c.API_VERSION + '/analytics/combinations?since={}'.format(since.date().isoformat()), None
+        raise ValueError('Unknown route {}'.format(route))
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def flask_client_sender(app):
+    def send(method: str, path: str, body) -> int:
+        return app.test_client().open(path, method=method, json=body).status_code
+    return send
+
+
+def wsgi_sender(port: int):
+    def send(method: str, path: str, body) -> int:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+    return send
+
+
+def measure(send, workload: Workload, route: str, requests: int, concurrency: int) -> dict:
+    """
+    Sends `requests` requests of a route from `concurrency` client threads.
+    :return: a dict with the latency percentiles in milliseconds, the throughput and the errors
+    """
+    plans = [[workload.request(route) for _ in range(requests // concurrency)] for _ in range(concurrency)]
+    latencies = []
+    errors = []
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        traced_at_start = tracemalloc.get_traced_memory()[0]
+
+    def client(plan):
+        for method, path, body in plan:
+            started = time.perf_counter()
+            status = send(method, path, body)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+
+    threads = [Thread(target=client, args=(plan,)) for plan in plans]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if tracemalloc.is_tracing():
+        # the most memory the in-flight requests of the route held at once, above what was allocated before
+        result['traced_peak_kb'] = (tracemalloc.get_traced_memory()[1] - traced_at_start) / 1024
+    return result
+
+
+def run(db_file: str, size: seed.SeedSize, routes=ROUTES, drivers=DRIVERS, requests: int = 1000,
+        concurrency: int = 4, profile: str = c.DB_PROFILE, reseed: bool = True, trace_memory: bool = False) -> dict:
+    """
+    Seeds the database (unless reseed is off) and benchmarks the routes with the drivers. With trace_memory, the
+    routes are measured with tracemalloc on: the latencies are then slower, and only comparable with traced runs.
+    :return: the results, as written to the JSON output
+    """
+    db_config = dict(provider='sqlite', filename=os.path.abspath(db_file), create_db=True,
+                     pragmas=c.SQLITE_PROFILES[profile])
+    app = juice_shop_app.create_app({'DB_CONFIG': db_config, 'DB_CREATE_TABLES': True})
+    db = juice_shop_app.bind_db(app)
+    if reseed:
+        seed.seed(db, size)
+    workload = Workload(db, size)
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        results = measure_drivers(app, workload, routes, drivers, requests, concurrency)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return {
+        'config': dict(vars(size), requests=requests, concurrency=concurrency, profile=profile,
+                       trace_memory=trace_memory),
+        'results': results,
+    }
+
+
+def measure_drivers(app, workload: Workload, routes, drivers, requests: int, concurrency: int) -> dict:
+    results = {}
+    if 'test_client' in drivers:
+        send = flask_client_sender(app)
+        results['test_client'] = {route: measure(send, workload, route, requests, concurrency) for route in routes}
+    if 'wsgi' in drivers:
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            send = wsgi_sender(server.port)
+            results['wsgi'] = {route: measure(send, workload, route, requests, concurrency) for route in routes}
+        finally:
+            server.shutdown()
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Compares two runs. A route regresses when its p95 latency grows, or its throughput drops, by more than threshold.
+    :return: a list of messages, one per regression
+    """
+    regressions = []
+    for driver, routes in current['results'].items():
+        for route, result in routes.items():
+            base = baseline['results'].get(driver, {}).get(route)
+            if base is None:
+                continue
+            if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+                regressions.append('{} {}: p95 {:.2f} ms, baseline {:.2f} ms'.format(
+                    driver, route, result['p95_ms'], base['p95_ms']))
+            if result['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+                regressions.append('{} {}: {:.1f} requests/s, baseline {:.1f} requests/s'.format(
+                    driver, route, result['throughput_rps'], base['throughput_rps']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-file', default=os.path.join(tempfile.gettempdir(), 'juice_shop_bench_db'))
+    parser.add_argument('--no-seed', action='store_true', help='reuse a database seeded by a previous run')
+    parser.add_argument('--profile', default=c.DB_PROFILE, choices=sorted(c.SQLITE_PROFILES))
+    parser.add_argument('--routes', nargs='+', default=ROUTES, choices=ROUTES)
+    parser.add_argument('--drivers', nargs='+', default=DRIVERS, choices=DRIVERS)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per route and driver')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also measure the peak memory allocated by the requests, slowing every route down')
+    parser.add_argument('--output', help='JSON file for the results, printed when not given')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression, 0.2 is 20%%')
+    seed.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args.db_file, seed.size_from_arguments(args), args.routes, args.drivers, args.requests,
+                 args.concurrency, args.profile, reseed=not args.no_seed, trace_memory=args.tracemalloc)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(json.load(baseline), report, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Seeds an empty database with a catalog and an order history of configurable size.
+
+Rows are inserted with executemany in chunks, bypassing the ORM, so millions of orders can be created in minutes. The
+tables of the database are dropped and created again first.
+
+    python -m benchmarks.seed --db-file bench_db --fruits 2000 --orders 1000000
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+
+from pony.orm import db_session
+from pony.utils import datetime2timestamp
+
+import JuiceShop.common as c
+from JuiceShop import analytics, ids
+from JuiceShop.database import models
+
+CHUNK_SIZE = 10000
+
+
+class SeedSize:
+    """
+    The number of rows created by seed().
+    """
+
+    def __init__(self, vitamins: int = 20, fruits: int = 200, liquids: int = 10, orders: int = 10000,
+                 juices_per_order: int = 2, fruits_per_juice: int = 2, vitamins_per_fruit: int = 2,
+                 history_days: int = 365):
+        self.vitamins = vitamins
+        self.fruits = fruits
+        self.liquids = liquids
+        self.orders = orders
+        self.juices_per_order = juices_per_order
+        self.fruits_per_juice = min(fruits_per_juice, fruits)
+        self.vitamins_per_fruit = min(vitamins_per_fruit, vitamins)
+        self.history_days = history_days
+
+
+def vitamin_name(i: int) -> str:
+    return 'vitamin_{}'.format(i)
+
+
+def fruit_name(i: int) -> str:
+    return 'fruit_{}'.format(i)
+
+
+def liquid_name(i: int) -> str:
+    return 'liquid_{}'.format(i)
+
+
+def _insert(cursor, placeholder: str, table: str, columns: tuple, rows):
+    sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        table, ', '.join('"{}"'.format(column) for column in columns), ', '.join([placeholder] * len(columns)))
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            cursor.executemany(sql, chunk)
+            chunk = []
+    if chunk:
+        cursor.executemany(sql, chunk)
+
+
+def _orders(size: SeedSize, fruit_prices: list, liquid_prices: list, to_sql_datetime, rng: random.Random):
+    """
+    Generates the rows of the Order, Juice and Fruit_Juice tables together, so the prices add up and the order
+    snapshots match the juices.
+    """
+    history_start = dt.datetime.utcnow() - dt.timedelta(days=size.history_days)
+    seconds_between_orders = size.history_days * 86400 / max(size.orders, 1)
+    juice_id = 0
+    for order_id in range(1, size.orders + 1):
+        juices = []
+        juice_snapshots = []
+        order_price = 0
+        for _ in range(size.juices_per_order):
+            juice_id += 1
+            liquid = rng.randrange(size.liquids)
+            fruits = rng.sample(range(size.fruits), size.fruits_per_juice)
+            juice_price = liquid_prices[liquid] + sum(fruit_prices[fruit] for fruit in fruits)
+            order_price += juice_price
+            juices.append((juice_id, juice_price, liquid + 1, fruits))
+            juice_snapshots.append({
+                'price': juice_price,
+                'liquid': {'name': liquid_name(liquid), 'price': liquid_prices[liquid]},
+                'fruits': [{'name': fruit_name(fruit), 'price': fruit_prices[fruit]} for fruit in fruits]
+            })
+        order_at = history_start + dt.timedelta(seconds=order_id * seconds_between_orders)
+        payment_id = ids.new_payment_id(int(order_at.replace(tzinfo=dt.timezone.utc).timestamp() * 1000))
+        snapshot = json.dumps({'juices': juice_snapshots})
+        yield (order_id, order_price, payment_id, to_sql_datetime(order_at), rng.random() < 0.9, snapshot), juices
+
+
+def seed(db, size: SeedSize, seed_value: int = 0):
+    """
+    Drops the tables of a database and fills them with generated rows, then computes the analytics rollups.
+    :param db: DB Connection
+    :param size: how many rows of each kind are created.
+    :param seed_value: seed of the random generator, so runs are reproducible.
+    :return: None
+    """
+    rng = random.Random(seed_value)
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+    placeholder = '?' if db.provider.paramstyle == 'qmark' else '%s'
+    to_sql_datetime = datetime2timestamp if db.provider.dialect == 'SQLite' else (lambda value: value)
+
+    fruit_prices = [rng.randrange(100, 1000) for _ in range(size.fruits)]
+    liquid_prices = [rng.randrange(100, 500) for _ in range(size.liquids)]
+
+    with db_session:
+        cursor = db.get_connection().cursor()
+        _insert(cursor, placeholder, 'Vitamin', ('id', 'name', 'description'),
+                ((i + 1, vitamin_name(i), 'Description of {}'.format(vitamin_name(i))) for i in range(size.vitamins)))
+        _insert(cursor, placeholder, 'Fruit', ('id', 'name', 'lower_name', 'price', 'description', 'image'),
+                ((i + 1, fruit_name(i), fruit_name(i).lower(), price, 'Description of {}'.format(fruit_name(i)),
+                  'http://someurl.com/image/{}.jpeg'.format(fruit_name(i))) for i, price in enumerate(fruit_prices)))
+        _insert(cursor, placeholder, 'Fruit_Vitamin', ('fruit', 'vitamin'),
+                ((fruit + 1, vitamin + 1) for fruit in range(size.fruits)
+                 for vitamin in rng.sample(range(size.vitamins), size.vitamins_per_fruit)))
+        _insert(cursor, placeholder, 'Liquid', ('id', 'name', 'lower_name', 'price', 'description', 'image'),
+                ((i + 1, liquid_name(i), liquid_name(i).lower(), price, 'Description of {}'.format(liquid_name(i)),
+                  'http://someurl.com/image/{}.jpeg'.format(liquid_name(i))) for i, price in enumerate(liquid_prices)))
+
+    order_rows, juice_rows, fruit_juice_rows = [], [], []
+    for order_row, juices in _orders(size, fruit_prices, liquid_prices, to_sql_datetime, rng):
+        order_rows.append(order_row)
+        for juice_id, juice_price, liquid_id, fruits in juices:
+            juice_rows.append((juice_id, juice_price, liquid_id, order_row[0]))
+            fruit_juice_rows.extend((fruit + 1, juice_id) for fruit in fruits)
+        if len(order_rows) == CHUNK_SIZE or order_row[0] == size.orders:
+            with db_session:
+                cursor = db.get_connection().cursor()
+                _insert(cursor, placeholder, 'Order', ('id', 'price', 'payment_id', 'order_at', 'is_paid', 'snapshot'),
+                        order_rows)
+                _insert(cursor, placeholder, 'Juice', ('id', 'price', 'liquid', 'order'), juice_rows)
+                _insert(cursor, placeholder, 'Fruit_Juice', ('fruit', 'juice'), fruit_juice_rows)
+            order_rows, juice_rows, fruit_juice_rows = [], [], []
+
+    analytics.rebuild(db)
+
+
+def add_size_arguments(parser: argparse.ArgumentParser):
+    defaults = SeedSize()
+    for name in ('vitamins', 'fruits', 'liquids', 'orders', 'juices_per_order', 'fruits_per_juice',
+                 'vitamins_per_fruit', 'history_days'):
+        parser.add_argument('--' + name.replace('_', '-'), type=int, default=getattr(defaults, name))
+
+
+def size_from_arguments(args) -> SeedSize:
+    return SeedSize(args.vitamins, args.fruits, args.liquids, args.orders, args.juices_per_order,
+                    args.fruits_per_juice, args.vitamins_per_fruit, args.history_days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-file', default='bench_db', help='SQLite file to be (re)created')
+    parser.add_argument('--profile', default=c.DB_PROFILE, choices=sorted(c.SQLITE_PROFILES))
+    add_size_arguments(parser)
+    args = parser.parse_args()
+
+    db = models.define_db(provider='sqlite', filename=os.path.abspath(args.db_file), create_db=True,
+                          pragmas=c.SQLITE_PROFILES[args.profile])
+    seed(db, size_from_arguments(args))
+
+
+if __name__ == '__main__':
+    main()
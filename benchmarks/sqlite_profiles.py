@@ -0,0 +1,103 @@
+"""
+Compares read/write concurrency of the SQLite pragma profiles in common.SQLITE_PROFILES.
+
+For each profile a fresh database is seeded with a small menu, then writer processes create orders while reader
+processes load pages of /v1/juices and the menu, all for the same amount of time. The script prints one JSON document
+with the operations per second and the 'database is locked' errors of each profile.
+
+    python -m benchmarks.sqlite_profiles --writers 4 --readers 4 --seconds 10
+"""
+import argparse
+import datetime as dt
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from pony.orm import db_session
+
+import JuiceShop.common as c
+from JuiceShop import ids, orders
+from JuiceShop.database import models, query
+
+ORDER = {'order': [
+    {'fruits': ['fruit_0', 'fruit_1'], 'liquid': 'liquid_0'},
+    {'fruits': ['fruit_2'], 'liquid': 'liquid_1'}
+]}
+
+
+@db_session
+def seed(db, fruits: int = 20, liquids: int = 4):
+    for i in range(fruits):
+        db.Fruit(name='fruit_{}'.format(i), price=100 + i, description='', image='')
+    for i in range(liquids):
+        db.Liquid(name='liquid_{}'.format(i), price=100 + i, description='', image='')
+
+
+def write_orders(db):
+    with db_session:
+        orders.create_order(db, ORDER, payment_id=ids.new_payment_id(), order_at=dt.datetime.utcnow())
+
+
+def read_menu_and_juices(db):
+    with db_session:
+        query.get_fruit_records(db)
+        query.get_juices_page(db, 0, 100)
+
+
+def worker(kind: str, db_config: dict, deadline: float, results):
+    db = models.define_db(**db_config)
+    operation = write_orders if kind == 'writer' else read_menu_and_juices
+    done = locked = failed = 0
+
+    while time.time() < deadline:
+        try:
+            operation(db)
+            done += 1
+        except Exception as e:
+            if 'locked' in str(e):
+                locked += 1
+            else:
+                failed += 1
+
+    results.put((kind, done, locked, failed))
+
+
+def run_profile(profile: str, writers: int, readers: int, seconds: float) -> dict:
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench_db')
+    db_config = dict(provider='sqlite', filename=db_file, create_db=True, pragmas=c.SQLITE_PROFILES[profile])
+    seed(models.define_db(**db_config))
+
+    results = multiprocessing.Queue()
+    deadline = time.time() + seconds
+    processes = [multiprocessing.Process(target=worker, args=(kind, db_config, deadline, results))
+                 for kind in ['writer'] * writers + ['reader'] * readers]
+    for process in processes:
+        process.start()
+    totals = {kind: {'ops_per_second': 0.0, 'locked_errors': 0, 'other_errors': 0} for kind in ('writer', 'reader')}
+    for _ in processes:
+        kind, done, locked, failed = results.get()
+        totals[kind]['ops_per_second'] += done / seconds
+        totals[kind]['locked_errors'] += locked
+        totals[kind]['other_errors'] += failed
+    for process in processes:
+        process.join()
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=sorted(c.SQLITE_PROFILES), choices=sorted(c.SQLITE_PROFILES))
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    report = {profile: run_profile(profile, args.writers, args.readers, args.seconds) for profile in args.profiles}
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,18 @@
+import argparse
+import datetime as dt
+import json
 import sys
 
-from pony.orm import db_session, select
-
 import JuiceShop.common as c
-from JuiceShop.database import models
-from JuiceShop.juice_shop_app import app
+from JuiceShop import analytics, archive, asgi, catalog, importer, server
+from JuiceShop.database import migrations
+from JuiceShop.juice_shop_app import app, bind_archive_db, bind_db
 
-HTTP_PORT = 8000
-HOST = '127.0.0.1'
+HTTP_PORT = c.SERVER_PORT
+HOST = c.SERVER_HOST
 
-db = models.define_db(
-    provider='sqlite',
-    filename=c.DB_FILE,
-    create_db=True
-)
+# bound in __main__, with table creation enabled when the database is created or migrated
+db = None
 
 VITAMINS = {
     'C': {
@@ -72,74 +71,105 @@ LIQUIDS = {
 }
 
 
-@db_session
-def add_vitamins():
+def initial_catalog() -> dict:
     """
-    Initial load to the database. It adds a set of Vitamins.
-    :return: None
+    The catalog loaded when the database is created, in the format of the catalog import.
+    :return: a dict with the vitamins, fruits and liquids
     """
-
-    for k, v in VITAMINS.items():
-        try:
-            db.Vitamin(
-                name=k,
-                description=v['description']
-            )
-        except Exception as e:
-            raise Exception("Unable to Create Vitamin - {}".format(e))
+    return {
+        'vitamins': [{'name': k, 'description': v['description']} for k, v in VITAMINS.items()],
+        'fruits': [{'name': k, 'price': v['price'] / c.PRICE_DIVISOR, 'description': v['description'],
+                    'image': v['image'], 'vitamins': v['vitamins']} for k, v in FRUITS.items()],
+        'liquids': [{'name': k, 'price': v['price'] / c.PRICE_DIVISOR, 'description': v['description'],
+                     'image': v['image']} for k, v in LIQUIDS.items()],
+    }
 
 
-@db_session
-def add_fruits():
-    """
-    Initial load to the database. It adds a set of Fruits and associate them to the Vitamins.
-    :return: None
-    """
-    for k, v in FRUITS.items():
-        try:
-            new_fruit = db.Fruit(
-                name=k,
-                price=v['price'],
-                description=v['description'],
-                image=v['image'])
-            for vit_name in v['vitamins']:
-                vit = select(
-                    v for v in db.Vitamin if v.name == vit_name)
-                new_fruit.vitamins.add(vit)
-        except Exception as e:
-            raise Exception("Unable to Create Fruit - {}".format(e))
-
-
-@db_session
-def add_liquids():
+def read_catalog_file(path: str) -> dict:
     """
-    Initial load to the database. It adds a set of Liquids to be used when making a juice.
-    :return: None
+    Reads a catalog file, as CSV when its name ends with .csv and as JSON otherwise.
+    :param path: the path of the file.
+    :return: the catalog, in the format of the catalog import
     """
-    for k, v in LIQUIDS.items():
-        try:
-            db.Liquid(
-                name=k,
-                price=v['price'],
-                description=v['description'],
-                image=v['image'])
-        except Exception as e:
-            raise Exception("Unable to Create Liquid - {}".format(e))
+    with open(path, newline='') as catalog_file:
+        if path.lower().endswith('.csv'):
+            return importer.parse_csv(catalog_file.read())
+        return json.load(catalog_file)
+
+
+def print_summary(summary: dict):
+    for section in importer.SECTIONS:
+        print("{}: {inserted} inserted, {updated} updated, {skipped} skipped".format(section.capitalize(),
+                                                                                     **summary[section]))
+    if summary['unknown_vitamins']:
+        print("Unknown vitamins ignored: {}".format(', '.join(summary['unknown_vitamins'])))
 
 
 if __name__ == '__main__':
-    args_len = len(sys.argv)
-    if args_len >= 2 and sys.argv[1] == '-c':
+    parser = argparse.ArgumentParser(description="Runs the Juice Shop server.")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('-c', action='store_true', help="drop the tables and load the initial catalog, then serve")
+    action.add_argument('-m', action='store_true', help="migrate an existing database, then serve")
+    action.add_argument('-i', '--import', dest='import_file', metavar='FILE',
+                        help="import a JSON or CSV catalog file in one transaction, then exit")
+    action.add_argument('--rebuild-analytics', action='store_true',
+                        help="recompute the sales rollups from every order, then exit")
+    action.add_argument('--archive', nargs='?', const=c.ARCHIVE_AFTER_DAYS, type=float, metavar='DAYS',
+                        help="move the paid orders older than DAYS (default %(const)g) to the archive, then exit")
+    serving = parser.add_mutually_exclusive_group()
+    serving.add_argument('--prefork', action='store_true',
+                         help="serve with pre-forked worker processes instead of the development server")
+    serving.add_argument('--asgi', action='store_true',
+                         help="serve the ASGI app with uvicorn instead of the development server")
+    parser.add_argument('--host', default=HOST, help="address to listen on (default %(default)s)")
+    parser.add_argument('--port', type=int, default=HTTP_PORT, help="port to listen on (default %(default)s)")
+    parser.add_argument('--backlog', type=int, default=c.SERVER_BACKLOG,
+                        help="connections waiting to be accepted, with --prefork (default %(default)s)")
+    parser.add_argument('--workers', type=int, default=c.WORKERS,
+                        help="worker processes, with --prefork or --asgi (default %(default)s, the number of CPUs)")
+    parser.add_argument('--threads', type=int, default=c.WORKER_THREADS,
+                        help="threads of each worker, with --prefork (default %(default)s)")
+    args = parser.parse_args()
+
+    # a database being reset or migrated can't be checked against the models: -c drops and creates the tables below,
+    # -m upgrades them
+    app.config['DB_CREATE_TABLES'] = app.config['DB_CREATE_TABLES'] and not (args.c or args.m)
+    db = bind_db(app)
+    print("Ready in {:.1f} ms".format(app.config['IMPORT_TO_READY_SECONDS'] * 1000))
+
+    if args.c:
         db.drop_all_tables(with_all_data=True)
         db.create_tables()
         print("Creating and populating DB...\n")
-        print("Creating the Vitamins")
-        add_vitamins()
-
-        print("Creating the Fruits")
-        add_fruits()
-
-        print("Creating the Liquids")
-        add_liquids()
-
-    app.run(host=HOST, port=HTTP_PORT)
+        print_summary(importer.import_catalog(db, initial_catalog()))
+        # the running servers, and the one started below, drop the menu they shared
+        catalog.invalidate(db)
+    elif args.m:
+        print("Migrating DB...\n")
+        for name in migrations.upgrade(db):
+            print("{} is up to date".format(name))
+        catalog.invalidate(db)
+    elif args.import_file:
+        try:
+            print_summary(importer.import_catalog(db, read_catalog_file(args.import_file)))
+        except ValueError as e:
+            sys.exit(str(e))
+        catalog.invalidate(db)
+        sys.exit(0)
+    elif args.rebuild_analytics:
+        print("Rollups rebuilt from {} orders".format(analytics.rebuild(db, bind_archive_db(app))))
+        sys.exit(0)
+    elif args.archive is not None:
+        older_than = dt.datetime.utcnow() - dt.timedelta(days=args.archive)
+        print("{} orders archived".format(archive.archive_orders(db, bind_archive_db(app), older_than)))
+        sys.exit(0)
+
+    try:
+        if args.prefork:
+            server.serve(args.host, args.port, args.workers, args.threads, args.backlog)
+        elif args.asgi:
+            asgi.serve(args.host, args.port, args.workers)
+        else:
+            app.run(host=args.host, port=args.port)
+    except Exception as e:
+        sys.exit(str(e))